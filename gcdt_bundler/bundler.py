@@ -1,14 +1,17 @@
 # -*- coding: utf-8 -*-
 """A gcdt-plugin which to prepare bundles (zip-files)."""
 from __future__ import unicode_literals, print_function
+import argparse
 import os
+import io
+import functools
+import itertools
 import tarfile
 import subprocess
-import io
-from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
-import warnings
 import shutil
-from io import StringIO
+import tempfile
+import time
+import warnings
 import ruamel.yaml as yaml
 import json
 
@@ -18,12 +21,47 @@ from gcdt.gcdt_logging import getLogger
 from gcdt.gcdt_defaults import DEFAULT_CONFIG
 from gcdt.utils import GracefulExit
 from .vendor import nodeenv
-from .python_bundler import install_dependencies_with_pip, add_deps_folder, install_dependencies_with_poetry
-from gcdt_bundler.bundler_utils import glob_files, get_path_info
+from .python_bundler import install_dependencies_with_pip, add_deps_folder, install_dependencies_with_poetry, \
+    install_dependencies_from_wheels, download_dependency_wheels, \
+    export_poetry_requirements, install_dependencies_pinned
+from .pinned import RequirementsNotPinnedError
+from gcdt_bundler.bundler_utils import glob_files, get_path_info, \
+    HashingWriter
+from gcdt_bundler.zip_writer import ZipWriter, ZipBundle, compress_bytes, \
+    compress_file, imap_entries, normalize_arcname, normalize_entry, \
+    SizeBudget, BundleSizeLimitExceeded, CompressionPolicy, \
+    COMPRESSION_PROFILES
+from gcdt_bundler.zip_cache import ZipEntryCache
+from gcdt_bundler.manifest import ManifestIndex
+from gcdt_bundler.deps_cache import DepsCache
+from gcdt_bundler.package_index import PackageIndex, \
+    DEFAULT_TTL as DEFAULT_METADATA_TTL
+from gcdt_bundler.wheel_cache import WheelCache
+from gcdt_bundler.venv_template import VenvTemplates
+from gcdt_bundler.overlay import PrecompiledCache
+from gcdt_bundler.cache_utils import remove_file
+from gcdt_bundler.node_cache import NodeDistributions
+from gcdt_bundler.wheels import bundle_wheel_entries, keep_metadata_file, \
+    DIST_INFO_POLICIES
+from gcdt_bundler.pruning import Pruner, is_dependency
+from gcdt_bundler.bytecode import BytecodeCompiler
+from gcdt_bundler.watch import BundleWatcher, DEFAULT_POLL_INTERVAL
+from gcdt_bundler.tar_compression import open_compressed_writer, \
+    TAR_COMPRESSIONS
 
 
 log = getLogger(__name__)
 
+# AWS Lambda deployment package limits in MB
+# http://docs.aws.amazon.com/lambda/latest/dg/limits.html
+DEFAULT_SIZE_LIMITS = {
+    'compressed': 50.0,
+    'uncompressed': 250.0
+}
+
+# 1980-01-01 00:00:00 UTC, same as the timestamp of reproducible zip bundles
+DETERMINISTIC_MTIME = 315532800
+
 
 class NpmDependencyInstallationError(GcdtError):
     """
@@ -33,15 +71,33 @@ class NpmDependencyInstallationError(GcdtError):
 
 
 # tenkai bundling:
-def bundle_revision(paths, outputpath=None, gcdtignore=None, artifacts=None):
+def bundle_revision(paths, outputpath=None, gcdtignore=None, artifacts=None,
+                    deterministic=False, compression='gzip', workers=1,
+                    manifest=None):
     """Create the bundle tar file.
 
     :param paths: list of path => {'source': ,'target': }
     :param outputpath: path to store the temp archive file
     :param gcdtignore: list of path => {'source': ,'target': }
     :param artifacts: list of artifacts => {'content': ,'target': , 'attr': }
+    :param deterministic: create a reproducible archive (sorted entries,
+    normalized timestamps, owners and permissions, fixed gzip header)
+    :param compression: 'gzip' (tar.gz) or 'zstd' (tar.zst)
+    :param workers: number of threads used for compression (None: one per
+    cpu). With more than one worker gzip output is compressed block by block
+    (multi-member gzip).
+    :param manifest: ManifestIndex to reuse the file listing of the previous
+    run (provides the changed files)
     :return: path of the archive
     """
+    return _write_revision(paths, outputpath, gcdtignore, artifacts,
+                           deterministic, compression, workers, manifest)[0]
+
+
+def _write_revision(paths, outputpath=None, gcdtignore=None, artifacts=None,
+                    deterministic=False, compression='gzip', workers=1,
+                    manifest=None):
+    # create the bundle tar file, returns (path, sha256)
     # tar file since this archive format can contain more files than zip!
     # make sure we add a unique identifier when we are running within jenkins
     if outputpath is None:
@@ -49,29 +105,78 @@ def bundle_revision(paths, outputpath=None, gcdtignore=None, artifacts=None):
     file_suffix = os.getenv('BUILD_TAG', '')
     if file_suffix:
         file_suffix = '_%s' % file_suffix
-    destfile = '%s/tenkai-bundle%s.tar.gz' % (outputpath, file_suffix)
-    with tarfile.open(destfile, 'w:gz') as tar:
-        for path in paths:
-            base, ptz, target = get_path_info(path)
-            for full_path, rel_path in \
-                    glob_files(base, includes=[ptz],
-                               gcdtignore=gcdtignore):
-                archive_target = target + rel_path
-                tar.add(full_path, recursive=False, arcname=archive_target)
+    if compression not in TAR_COMPRESSIONS:
+        raise ValueError('Unknown compression: %s' % compression)
+    destfile = '%s/tenkai-bundle%s%s' % (outputpath, file_suffix,
+                                         TAR_COMPRESSIONS[compression])
+
+    files = _bundle_files(paths, gcdtignore, manifest)
+    if deterministic:
+        files = sorted(files, key=lambda f: normalize_arcname(f[1]))
+        tar_filter = _normalize_tarinfo
+        tar_format = tarfile.GNU_FORMAT
+    else:
+        tar_filter = None
+        tar_format = tarfile.DEFAULT_FORMAT
+
+    try:
+        with open(destfile, 'wb') as f:
+            writer = HashingWriter(f)
+            compressed = open_compressed_writer(
+                writer, compression, workers,
+                filename=None if deterministic else destfile)
+            try:
+                _write_tar(compressed, files, artifacts, deterministic,
+                           tar_filter, tar_format)
+            finally:
+                # stops the compression threads
+                compressed.close()
+    except BaseException:
+        # no truncated bundle is left behind
+        remove_file(destfile)
+        raise
+    if manifest is not None:
+        manifest.flush()
+
+    return destfile, writer.sha256
+
+
+def _write_tar(fileobj, files, artifacts, deterministic, tar_filter,
+               tar_format):
+    # stream the files and artifacts as tar into fileobj
+    with tarfile.open(fileobj=fileobj, mode='w|', format=tar_format) as tar:
+        for full_path, archive_target in files:
+            tar.add(full_path, recursive=False,
+                    arcname=archive_target, filter=tar_filter)
 
         # add each artifact as file
         if artifacts:
             for artifact in artifacts:
                 log.debug('add artifact \'%s\'', artifact['target'])
                 attr = artifact.get('attr', None)
+                content = artifact['content']
+                if not isinstance(content, bytes):
+                    content = content.encode('utf-8')
                 info = tarfile.TarInfo(artifact['target'])
-                info.size = len(artifact['content'])
+                info.size = len(content)
                 if attr:
                     # give artifact -rw-r--r-- permissions
                     info.mode = attr
-                tar.addfile(info, StringIO(artifact['content']))
+                if deterministic:
+                    info = _normalize_tarinfo(info)
+                tar.addfile(info, io.BytesIO(content))
+
 
-    return destfile
+def _normalize_tarinfo(tarinfo):
+    # remove host specific metadata from a tar entry
+    tarinfo.mtime = DETERMINISTIC_MTIME
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ''
+    if tarinfo.isdir() or tarinfo.mode & 0o111:
+        tarinfo.mode = 0o755
+    else:
+        tarinfo.mode = 0o644
+    return tarinfo
 
 
 # ramuda bundling
@@ -81,10 +186,81 @@ def get_zipped_file(
         settings=None,
         settings_filename='settings.conf',
         gcdtignore=None,
-        keep=False
+        keep=False,
+        zip_options=None,
+        return_bundle=False,
+        size_limits=None,
+        deps_cache=None,
+        package_index=None,
+        wheel_cache=None,
+        python_installer='venv',
+        wheel_passthrough=False,
+        venv_templates=None,
+        node_distributions=None,
+        precompiled_cache=None
     ):
+    """Install the dependencies for the runtime and create the bundle zip.
+
+    :param zip_options: dict of additional options for make_zip_file
+    :param return_bundle: return the ZipBundle handle instead of bytes
+    :param size_limits: size limits per runtime (see get_size_limits)
+    :param deps_cache: DepsCache to reuse installed python dependencies
+    :param package_index: PackageIndex to look up manylinux wheels
+    :param wheel_cache: WheelCache for the downloaded wheels
+    :param python_installer: 'venv' (pip in a virtualenv), 'wheels'
+    (unpack Lambda platform wheels without a virtualenv) or 'pinned'
+    (fully pinned requirements: concurrent downloads and parallel unpacking,
+    otherwise pip in a virtualenv), poetry projects need a poetry.lock for
+    'wheels' and 'pinned'
+    :param wheel_passthrough: with the 'wheels' installer copy the wheel
+    members into the bundle without unpacking them
+    :param venv_templates: VenvTemplates to clone the virtualenv from
+    :param node_distributions: NodeDistributions to link the nodeenv from
+    (nodejs runtimes)
+    :param precompiled_cache: PrecompiledCache for the extracted
+    precompiled packages
+    :return: bundle (bytes or ZipBundle) or None if the bundle exceeds the
+    size limit
+    """
     log.debug('keep: %s', keep)
+    if zip_options is None:
+        zip_options = {}
+    artifacts, wheels = _prepare_zip_sources(
+        handler_filename, folders, runtime, settings, settings_filename, keep,
+        deps_cache, package_index, wheel_cache, python_installer,
+        wheel_passthrough, venv_templates, node_distributions,
+        precompiled_cache)
+
+    limits = get_size_limits(runtime, size_limits)
+    try:
+        bundle = make_zip_file(
+            folders, artifacts=artifacts, gcdtignore=gcdtignore,
+            wheels=wheels,
+            size_budget=SizeBudget(limits['compressed'],
+                                   limits['uncompressed']),
+            **zip_options)
+    except BundleSizeLimitExceeded as e:
+        log.error(str(e))
+        log.error('See http://docs.aws.amazon.com/lambda/latest/dg/limits.html')
+        return
 
+    if return_bundle:
+        return bundle
+    try:
+        return bundle.getvalue()
+    finally:
+        bundle.close()
+
+
+def _prepare_zip_sources(handler_filename, folders, runtime, settings,
+                         settings_filename, keep, deps_cache=None,
+                         package_index=None, wheel_cache=None,
+                         python_installer='venv', wheel_passthrough=False,
+                         venv_templates=None, node_distributions=None,
+                         precompiled_cache=None):
+    # install the dependencies and add them and the handler to folders
+    # returns the artifacts and the wheels to copy into the bundle
+    wheels = []
     if runtime.startswith('python'):
         # also from chalice:
         def _has_at_least_one_package(filename):
@@ -105,16 +281,60 @@ def get_zipped_file(
             return os.path.isfile('pyproject.toml')
 
         venv_dir = DEFAULT_CONFIG['ramuda']['python_bundle_venv_dir']
+        requirements_file = None
         if _has_pyproject_toml():
-            install_dependencies_with_poetry(runtime, venv_dir, keep)
-            add_deps_folder(folders, venv_dir)
-
+            if python_installer in ('wheels', 'pinned') and \
+                    os.path.isfile('poetry.lock'):
+                # the locked dependencies as pinned requirements
+                requirements_file = export_poetry_requirements(venv_dir)
+            else:
+                if python_installer in ('wheels', 'pinned'):
+                    log.info('the \'%s\' installer needs a poetry.lock, '
+                             'using a virtualenv', python_installer)
+                install_dependencies_with_poetry(
+                    runtime, venv_dir, keep, deps_cache=deps_cache,
+                    package_index=package_index, wheel_cache=wheel_cache,
+                    venv_templates=venv_templates,
+                    precompiled_cache=precompiled_cache)
+                add_deps_folder(folders, venv_dir)
         elif _has_at_least_one_package('requirements.txt'):
-            install_dependencies_with_pip('requirements.txt', runtime,
-                                           venv_dir, keep)
-            add_deps_folder(folders, venv_dir)
+            requirements_file = 'requirements.txt'
+
+        if requirements_file is not None:
+            if python_installer == 'pinned':
+                try:
+                    install_dependencies_pinned(requirements_file, runtime,
+                                                venv_dir,
+                                                deps_cache=deps_cache,
+                                                package_index=package_index,
+                                                wheel_cache=wheel_cache)
+                except RequirementsNotPinnedError as e:
+                    log.info('%s Using pip in a virtualenv.', e)
+                    install_dependencies_with_pip(
+                        requirements_file, runtime, venv_dir, keep,
+                        deps_cache=deps_cache, package_index=package_index,
+                        wheel_cache=wheel_cache, venv_templates=venv_templates,
+                        precompiled_cache=precompiled_cache)
+                add_deps_folder(folders, venv_dir)
+            elif python_installer == 'wheels' and wheel_passthrough:
+                wheels = download_dependency_wheels(requirements_file,
+                                                    runtime, venv_dir,
+                                                    deps_cache=deps_cache)
+            elif python_installer == 'wheels':
+                install_dependencies_from_wheels(requirements_file, runtime,
+                                                 venv_dir,
+                                                 deps_cache=deps_cache)
+                add_deps_folder(folders, venv_dir)
+            else:
+                install_dependencies_with_pip(
+                    requirements_file, runtime, venv_dir, keep,
+                    deps_cache=deps_cache, package_index=package_index,
+                    wheel_cache=wheel_cache, venv_templates=venv_templates,
+                    precompiled_cache=precompiled_cache)
+                add_deps_folder(folders, venv_dir)
     elif runtime.startswith('nodejs'):
-        _install_dependencies_with_npm(runtime, keep)
+        _install_dependencies_with_npm(runtime, keep,
+                                       node_distributions=node_distributions)
 
     # add handler to folders
     folders.append({
@@ -130,22 +350,75 @@ def get_zipped_file(
             'target': settings_filename,
             'attr': 0o644  # permissions -rw-r--r--
         })
-
-    zipfile = make_zip_file_bytes(folders, artifacts=artifacts,
-                                  gcdtignore=gcdtignore)
-
-    size_limit_exceeded = check_buffer_exceeds_limit(zipfile)
-    if size_limit_exceeded:
-        return
-
-    return zipfile
-
-
-def _install_dependencies_with_npm(runtime, keep=False):
+    return artifacts, wheels
+
+
+def watch_zipped_file(handler_filename, folders, runtime='python2.7',
+                      settings=None, settings_filename='settings.conf',
+                      gcdtignore=None, keep=False, outfile=None, callback=None,
+                      workers=1, compression=None,
+                      poll_interval=DEFAULT_POLL_INTERVAL, should_stop=None,
+                      deps_cache=None, package_index=None,
+                      wheel_cache=None, python_installer='venv',
+                      wheel_passthrough=False, dist_info='keep',
+                      pruner=None, venv_templates=None,
+                      node_distributions=None, precompiled_cache=None,
+                      deterministic=False, size_limits=None,
+                      entry_cache=None, compiler=None):
+    """Install the dependencies once and keep the bundle zip up to date
+    while files change (inotify on linux, polling otherwise).
+
+    Only changed files are compressed (and compiled) again, the zip is
+    rebuilt from the compressed entries kept in memory.
+
+    :param outfile: path to write the bundle to after every change
+    :param callback: called with the BundleWatcher after every change
+    :param workers: number of threads used to compress files
+    :param compression: compression profile (see make_zip_file)
+    :param poll_interval: seconds between checks
+    :param should_stop: function returning True to stop watching
+    :param deps_cache: DepsCache to reuse installed python dependencies
+    :param package_index: PackageIndex to look up manylinux wheels
+    :param wheel_cache: WheelCache for the downloaded wheels
+    :param python_installer: 'venv', 'wheels' or 'pinned' (see
+    get_zipped_file)
+    :param wheel_passthrough: copy the wheel members into the bundle
+    :param dist_info: 'keep', 'minimal' or 'strip' (see make_zip_file)
+    :param pruner: Pruner to leave files out of the bundle
+    :param venv_templates: VenvTemplates to clone the virtualenv from
+    :param node_distributions: NodeDistributions to link the nodeenv from
+    :param precompiled_cache: PrecompiledCache for the extracted
+    precompiled packages
+    :param deterministic: reproducible archive (see make_zip_file)
+    :param size_limits: size limits per runtime (see get_size_limits), a
+    bundle crossing a limit is reported and not written
+    :param entry_cache: ZipEntryCache to reuse compressed entries
+    :param compiler: BytecodeCompiler to add the compiled python files
+    """
+    artifacts, wheels = _prepare_zip_sources(
+        handler_filename, folders, runtime, settings, settings_filename, keep,
+        deps_cache, package_index, wheel_cache, python_installer,
+        wheel_passthrough, venv_templates, node_distributions,
+        precompiled_cache)
+    watcher = BundleWatcher(folders, gcdtignore=gcdtignore,
+                            artifacts=artifacts, outfile=outfile,
+                            workers=workers, compression=compression,
+                            wheels=wheels, dist_info=dist_info,
+                            pruner=pruner, deterministic=deterministic,
+                            size_limits=get_size_limits(runtime, size_limits),
+                            entry_cache=entry_cache, compiler=compiler)
+    watcher.run(callback=callback, poll_interval=poll_interval,
+                should_stop=should_stop)
+
+
+def _install_dependencies_with_npm(runtime, keep=False,
+                                   node_distributions=None):
     """installs dependencies from a package.json file for the right runtime
 
     :param runtime: AWS Lambda runtime i.e. nodejs6.10
     :param keep: keep / cache installed packages
+    :param node_distributions: NodeDistributions to link the nodeenv from
+    (default: nodeenv downloads node into the nodeenv folder)
     """
     # extract from https://nodejs.org/en/download/releases/
     NODEENV_FOLDER = 'nodeenv'
@@ -159,7 +432,26 @@ def _install_dependencies_with_npm(runtime, keep=False):
         shutil.rmtree(NODEENV_FOLDER, ignore_errors=True)
         shutil.rmtree('node_modules', ignore_errors=True)
     node_version = VERSION_MAP[runtime]
+    if node_distributions is not None:
+        node_distributions.create_env(node_version, NODEENV_FOLDER)
+    else:
+        _create_nodeenv(NODEENV_FOLDER, node_version)
+
+    if not os.path.isfile('package.json'):
+        return
+    cmd = ['nodeenv/bin/npm', 'install', '--only=prod', '--unsafe-perm']
+
+    try:
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT,
+                                env=NodeDistributions.env(NODEENV_FOLDER))
+    except subprocess.CalledProcessError as e:
+        log.debug('Running command: %s resulted in the ' % e.cmd)
+        log.debug('following error: %s' % e.output)
+        raise NpmDependencyInstallationError()
+
 
+def _create_nodeenv(env_dir, node_version):
+    # download node into the nodeenv folder (vendored nodeenv)
     # http://code.activestate.com/recipes/52308-the-simple-but-handy-collector-of-a-bunch-of-named/?in=user-97991
     class Bunch:
         def __init__(self, **kwds):
@@ -174,73 +466,250 @@ def _install_dependencies_with_npm(runtime, keep=False):
         'quiet': False, 'python_virtualenv': True, 'debug': False,
         'config_file': ['./setup.cfg', '~/.nodeenvrc']
     })
-    nodeenv.create_environment(NODEENV_FOLDER, opt)
+    nodeenv.create_environment(env_dir, opt)
 
-    if not os.path.isfile('package.json'):
-        return
-    cmd = ['nodeenv/bin/npm', 'install', '--only=prod', '--unsafe-perm']
 
+def make_zip_file_bytes(paths, gcdtignore=None, artifacts=None, **options):
+    """Create the bundle zip file. With this version the vendor - folder magic
+    has been removed.
+
+    :param paths: list of path => {'source': ,'target': }
+    :param gcdtignore: list of path => {'source': ,'target': }
+    :param artifacts: list of artifacts => {'content': ,'target': , 'attr': }
+    :param options: further options of make_zip_file (e.g. workers)
+    :return: bundle as bytes
+    """
+    bundle = make_zip_file(paths, gcdtignore=gcdtignore, artifacts=artifacts,
+                           **options)
     try:
-        subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        log.debug('Running command: %s resulted in the ' % e.cmd)
-        log.debug('following error: %s' % e.output)
-        raise NpmDependencyInstallationError()
+        return bundle.getvalue()
+    finally:
+        bundle.close()
 
 
-def make_zip_file_bytes(paths, gcdtignore=None, artifacts=None):
-    """Create the bundle zip file. With this version the vendor - folder magic
-    has been removed.
+def make_zip_file(paths, gcdtignore=None, artifacts=None, workers=1,
+                  outfile=None, entry_cache=None, deterministic=False,
+                  size_budget=None, compression=None, manifest=None,
+                  wheels=None, dist_info='keep', pruner=None, compiler=None):
+    """Create the bundle zip file and stream it into a file.
 
     :param paths: list of path => {'source': ,'target': }
     :param gcdtignore: list of path => {'source': ,'target': }
     :param artifacts: list of artifacts => {'content': ,'target': , 'attr': }
-    :return: exit_code
+    :param workers: number of threads used to compress files (None: one per
+    cpu). The archive content does not depend on the number of workers.
+    :param outfile: path or writable file object for the bundle. Defaults to
+    a temporary file which is removed when the bundle is closed.
+    :param entry_cache: ZipEntryCache to reuse compressed entries of
+    unchanged files from previous bundles
+    :param deterministic: create a reproducible archive (entries sorted by
+    name, normalized timestamps and permissions)
+    :param size_budget: SizeBudget, raises BundleSizeLimitExceeded as soon
+    as the bundle crosses a limit
+    :param compression: compression profile ('fast', 'balanced', 'max') to
+    store incompressible files and pick the deflate level. By default all
+    files are deflated with the default level.
+    :param manifest: ManifestIndex to reuse the file listing of the previous
+    run (provides the changed files)
+    :param wheels: list of wheel paths, the members are copied into the
+    bundle root without decompressing and compressing them again
+    :param dist_info: files of .dist-info / .egg-info folders to bundle:
+    'keep' (all), 'minimal' (metadata and entry points) or 'strip' (none)
+    :param pruner: Pruner to leave files which are not needed at runtime
+    out of the bundle (tests, caches, packages provided by the runtime),
+    applies to dependency folders (see add_deps_folder), node_modules and
+    wheel members
+    :param compiler: BytecodeCompiler to add the compiled python files
+    (after pruning)
+    :return: ZipBundle handle (path, size, sha256)
     """
     if artifacts is None:
         artifacts = []
+    if dist_info not in DIST_INFO_POLICIES:
+        raise ValueError('Unknown dist_info policy: %s' % dist_info)
     log.debug('creating zip file...')
-    buf = io.BytesIO()
+    if outfile is None:
+        fileobj = tempfile.NamedTemporaryFile(prefix='gcdt-bundle-',
+                                              suffix='.zip')
+    elif isinstance(outfile, (bytes, type(''))):
+        fileobj = open(outfile, 'w+b')
+    else:
+        fileobj = outfile
     """
     paths = [
         { source = './vendored', target = '.' },
         { source = './impl', target = '.' }
     ]
     """
-    with warnings.catch_warnings():
-        warnings.simplefilter('ignore')
-        with ZipFile(buf, 'w', ZIP_DEFLATED) as z:
-            z.debug = 0
-            for path in paths:
-                base, ptz, target = get_path_info(path)
-                for full_path, rel_path in \
-                        glob_files(base, includes=[ptz],
-                                   gcdtignore=gcdtignore):
-                    #print('full_path ' + full_path)
-                    archive_target = target + rel_path
-                    #print('archive target ' + archive_target)
-                    z.write(full_path, archive_target)
-
-            # add each artifact as file
-            for artifact in artifacts:
-                artifact_file = ZipInfo(artifact['target'])
-                attr = artifact.get('attr', None)
-                if attr:
-                    artifact_file.external_attr = attr << 16
-                z.writestr(artifact_file, artifact['content'])
+    if entry_cache is not None:
+        compress = entry_cache.compress_file
+    else:
+        compress = compress_file
+    if compression is not None:
+        policy = CompressionPolicy(compression)
+        compress = functools.partial(compress, policy=policy)
+    tasks = _bundle_files(paths, gcdtignore, manifest, pruner)
+    if dist_info != 'keep':
+        tasks = (t for t in tasks
+                 if keep_metadata_file(normalize_arcname(t[1]), dist_info))
+    if compiler is not None:
+        tasks = compiler.compile_tasks(tasks, deterministic)
+    if deterministic:
+        tasks = sorted(tasks, key=lambda t: normalize_arcname(t[1]))
+    # the wheel members follow the files, project files take precedence
+    bundled = set()
+    tasks = _record_arcnames(tasks, bundled)
+    wheel_members = bundle_wheel_entries(wheels or [], dist_info=dist_info,
+                                         exclude=bundled)
+    if pruner is not None:
+        wheel_members = (e for e in wheel_members
+                         if pruner.keep_file(e.arcname, e.file_size))
+    if compiler is not None and wheels:
+        wheel_members = compiler.compile_entries(wheel_members, deterministic)
+    entries = itertools.chain(
+        imap_entries(compress, tasks, workers=workers), wheel_members,
+        _artifact_entries(artifacts))
+    try:
+        with ZipWriter(fileobj) as z:
+            for entry in entries:
+                if deterministic:
+                    normalize_entry(entry)
+                if size_budget is not None:
+                    size_budget.add(entry)
+                z.add(entry)
+    except Exception:
+        if fileobj is not outfile:
+            fileobj.close()
+        raise
+    finally:
+        if entry_cache is not None:
+            entry_cache.flush()
+        if compiler is not None:
+            compiler.close()
+    if manifest is not None:
+        manifest.flush()
+    if compression is not None:
+        policy.log_stats()
+    if pruner is not None:
+        pruner.log_stats()
+    if compiler is not None:
+        compiler.log_stats()
+
+    return ZipBundle(fileobj, z.offset, z.sha256)
+
+
+def compare_compression_profiles(paths, gcdtignore=None, profiles=None,
+                                 **options):
+    """Bundle the paths with each compression profile and report the time
+    and bundle size compared to deflating all files with the default level.
+
+    :param paths: list of path => {'source': ,'target': }
+    :param gcdtignore: list of path => {'source': ,'target': }
+    :param profiles: list of profiles (default: all profiles)
+    :param options: further options of make_zip_file (e.g. workers)
+    :return: list of dicts (profile, seconds, size, seconds_saved,
+    bytes_saved), the first one is the default (profile None)
+    """
+    if profiles is None:
+        profiles = sorted(COMPRESSION_PROFILES)
+    results = []
+    for profile in [None] + list(profiles):
+        start = time.time()
+        bundle = make_zip_file(paths, gcdtignore=gcdtignore,
+                               compression=profile, **options)
+        bundle.close()
+        results.append({
+            'profile': profile,
+            'seconds': time.time() - start,
+            'size': bundle.size
+        })
+    for result in results:
+        result['seconds_saved'] = results[0]['seconds'] - result['seconds']
+        result['bytes_saved'] = results[0]['size'] - result['size']
+        log.info('compression \'%s\': %0.2f s (%0.2f s saved), %0.2f MB '
+                 '(%0.2f MB saved)', result['profile'] or 'default',
+                 result['seconds'], result['seconds_saved'],
+                 result['size'] / 1000000.0,
+                 result['bytes_saved'] / 1000000.0)
+    return results
+
+
+def _artifact_entries(artifacts):
+    # add each artifact as file
+    for artifact in artifacts:
+        content = artifact['content']
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        attr = artifact.get('attr', None)
+        yield compress_bytes(artifact['target'], content,
+                             external_attr=(attr << 16) if attr else 0)
+
+
+def _record_arcnames(tasks, arcnames):
+    # add the archive name of each task to the arcnames set
+    for task in tasks:
+        arcnames.add(normalize_arcname(task[1]))
+        yield task
+
+
+def _bundle_files(paths, gcdtignore, manifest=None, pruner=None):
+    # (full_path, archive_target) for each file to bundle, the pruner
+    # applies to dependencies only
+    stats = {'dirs_pruned': 0, 'files_skipped': 0}
+    for path in paths:
+        base, ptz, target = get_path_info(path)
+        if manifest is not None:
+            files = manifest.glob_files(base, includes=[ptz],
+                                        gcdtignore=gcdtignore)
+        else:
+            files = glob_files(base, includes=[ptz], gcdtignore=gcdtignore,
+                               stats=stats)
+        for full_path, rel_path in files:
+            if pruner is not None:
+                arcname = normalize_arcname(target + rel_path)
+                if is_dependency(path, arcname) and not pruner.keep_file(
+                        arcname, functools.partial(os.path.getsize,
+                                                   full_path)):
+                    continue
+            yield full_path, target + rel_path
+    if gcdtignore:
+        log.debug('gcdtignore: %d folders pruned, %d files skipped',
+                  stats['dirs_pruned'], stats['files_skipped'])
+
+
+def get_size_limits(runtime, size_limits=None):
+    """Get the bundle size limits (in MB) for a runtime.
+
+    :param runtime: AWS Lambda runtime i.e. python3.6
+    :param size_limits: dict of limits per runtime (or 'default'), i.e.
+    {'python3.6': {'compressed': 50, 'uncompressed': 250}}
+    :return: dict with 'compressed' and 'uncompressed' limit
+    """
+    limits = dict(DEFAULT_SIZE_LIMITS)
+    if size_limits:
+        limits.update(size_limits.get('default', {}))
+        limits.update(size_limits.get(runtime, {}))
+    return limits
 
-    return buf.getvalue()
 
+def check_buffer_exceeds_limit(buf, runtime=None, size_limits=None):
+    """Check if the bundle is bigger than the compressed size limit.
 
-def check_buffer_exceeds_limit(buf):
-    """Check if size is bigger than 50MB.
+    Deprecated: make_zip_file checks the limits while zipping (SizeBudget).
 
-    :return: True/False returns True if bigger than 50MB.
+    :param buf: bundle (bytes or ZipBundle)
+    :param runtime: AWS Lambda runtime i.e. python3.6
+    :param size_limits: dict of limits per runtime (see get_size_limits)
+    :return: True/False returns True if bigger than the limit (50MB).
     """
+    warnings.warn('check_buffer_exceeds_limit is deprecated, the size '
+                  'limits are checked while zipping', DeprecationWarning,
+                  stacklevel=2)
+    limit = get_size_limits(runtime, size_limits)['compressed']
     buffer_mbytes = float(len(buf) / 1000000.0)
     log.debug('buffer has size %0.2f MB' % buffer_mbytes)
-    if buffer_mbytes >= 50.0:
-        log.error('Deployment bundles must not be bigger than 50MB')
+    if buffer_mbytes >= limit:
+        log.error('Deployment bundles must not be bigger than %gMB', limit)
         log.error('See http://docs.aws.amazon.com/lambda/latest/dg/limits.html')
         return True
     return False
@@ -294,9 +763,17 @@ def bundle(params):
                 'attr': 0o644  # permissions -rw-r--r--
             })
 
-        context['_bundle_file'] = \
-            bundle_revision(folders, outputpath=outputpath,
-                            gcdtignore=gcdtignore, artifacts=artifacts)
+        bundling = cfg.get('bundling', {})
+        manifest = _get_manifest(bundling)
+        context['_bundle_file'], context['_bundle_sha256'] = \
+            _write_revision(folders, outputpath=outputpath,
+                            gcdtignore=gcdtignore, artifacts=artifacts,
+                            deterministic=bundling.get('deterministic', False),
+                            compression=bundling.get('tarCompression', 'gzip'),
+                            workers=bundling.get('workers', 1),
+                            manifest=manifest)
+        log.info('bundle sha256: %s', context['_bundle_sha256'])
+        _set_changed_files(context, manifest)
     elif tool == 'ramuda' and cmd in ['bundle', 'deploy']:
         cfg = config['ramuda']
         runtime = cfg['lambda'].get('runtime', 'python2.7')
@@ -307,7 +784,9 @@ def bundle(params):
                 handler_filename = cfg['lambda'].get('handlerFile')
                 folders = cfg.get('bundling', []).get('folders', [])
                 settings = cfg.get('settings', None)
-                context['_zipfile'] = get_zipped_file(
+                zip_options = _get_zip_options(cfg.get('bundling', {}),
+                                               runtime)
+                zip_bundle = get_zipped_file(
                     handler_filename,
                     folders,
                     runtime=runtime,
@@ -315,8 +794,36 @@ def bundle(params):
                     settings_filename=DEFAULT_CONFIG['ramuda']['settings_file'],
                     gcdtignore=gcdtignore,
                     keep=(context['_arguments']['--keep']
-                          or DEFAULT_CONFIG['ramuda']['keep'])
+                          or DEFAULT_CONFIG['ramuda']['keep']),
+                    zip_options=zip_options,
+                    return_bundle=True,
+                    size_limits=cfg.get('bundling', {}).get('sizeLimits'),
+                    deps_cache=_get_deps_cache(cfg.get('bundling', {})),
+                    package_index=_get_package_index(cfg.get('bundling', {})),
+                    wheel_cache=_get_wheel_cache(cfg.get('bundling', {})),
+                    python_installer=cfg.get('bundling', {}).get(
+                        'pythonInstaller', 'venv'),
+                    wheel_passthrough=cfg.get('bundling', {}).get(
+                        'wheelPassthrough', False),
+                    venv_templates=_get_venv_templates(
+                        cfg.get('bundling', {})),
+                    node_distributions=_get_node_distributions(
+                        cfg.get('bundling', {})),
+                    precompiled_cache=_get_precompiled_cache(
+                        cfg.get('bundling', {}))
                 )
+                if zip_bundle is not None:
+                    # gcdt expects the bundle as bytes in '_zipfile', the
+                    # temporary file is removed
+                    try:
+                        context['_zipfile'] = zip_bundle.getvalue()
+                    finally:
+                        zip_bundle.close()
+                    context['_zipfile_sha256'] = zip_bundle.sha256
+                    log.info('bundle sha256: %s', zip_bundle.sha256)
+                    _set_changed_files(context, zip_options.get('manifest'))
+                else:
+                    context['_zipfile'] = None
             except GracefulExit:
                 raise
             except Exception as e:
@@ -325,6 +832,177 @@ def bundle(params):
                 log.error(context['error'])
 
 
+def _get_zip_options(bundling, runtime='python2.7'):
+    """Translate the ramuda 'bundling' config into make_zip_file options.
+
+    :param bundling: ramuda bundling config
+    :param runtime: AWS Lambda runtime (for the default prune rules and
+    the bytecode compiler)
+    :return: dict of options
+    """
+    options = {
+        'workers': bundling.get('workers', 1),
+        'deterministic': bundling.get('deterministic', False),
+        'compression': bundling.get('compression', None),
+        'dist_info': bundling.get('distInfo', 'keep')
+    }
+    if bundling.get('entryCache', False):
+        options['entry_cache'] = ZipEntryCache(
+            max_size=bundling.get('entryCacheMaxSize', 512) * 1024 * 1024)
+    manifest = _get_manifest(bundling)
+    if manifest is not None:
+        options['manifest'] = manifest
+    prune = bundling.get('prune', False)
+    if prune:
+        # 'prune': true or {'rules': [...], 'keep': [...]}
+        if prune is True:
+            prune = {}
+        options['pruner'] = Pruner(runtime, rules=prune.get('rules'),
+                                   keep=prune.get('keep'))
+    bytecode = bundling.get('bytecode', False)
+    if bytecode and runtime.startswith('python'):
+        # 'bytecode': true or {'pycOnly': true, 'python': '/usr/bin/python3.6'}
+        if bytecode is True:
+            bytecode = {}
+        options['compiler'] = BytecodeCompiler(
+            runtime, python_exe=bytecode.get('python'),
+            workers=options['workers'],
+            pyc_only=bytecode.get('pycOnly', False))
+    return options
+
+
+def _get_deps_cache(bundling):
+    # cache of installed python dependencies ('depsCache')
+    if bundling.get('depsCache', False):
+        return DepsCache(
+            max_size=bundling.get('depsCacheMaxSize', 2048) * 1024 * 1024,
+            workers=bundling.get('workers', 1))
+
+
+def _get_package_index(bundling):
+    # PyPI json api or mirror ('indexUrl', 'offline', 'metadataTtl')
+    return PackageIndex(
+        index_url=bundling.get('indexUrl'),
+        ttl=bundling.get('metadataTtl', DEFAULT_METADATA_TTL),
+        offline=bundling.get('offline', False))
+
+
+def _get_wheel_cache(bundling):
+    # shared cache of downloaded wheels ('wheelCacheMaxSize' in MB)
+    return WheelCache(
+        max_size=bundling.get('wheelCacheMaxSize', 1024) * 1024 * 1024)
+
+
+def _get_precompiled_cache(bundling):
+    # extracted precompiled packages ('precompiledCacheMaxSize' in MB)
+    return PrecompiledCache(
+        max_size=bundling.get('precompiledCacheMaxSize', 1024) * 1024 * 1024)
+
+
+def _get_venv_templates(bundling):
+    # clone the virtualenv from a template per runtime ('venvTemplate')
+    if bundling.get('venvTemplate', False):
+        return VenvTemplates()
+
+
+def _get_node_distributions(bundling):
+    # shared cache of Node.js distributions ('nodeCache')
+    if bundling.get('nodeCache', False):
+        return NodeDistributions()
+
+
+def _get_manifest(bundling):
+    # persistent manifest index of the bundled folders ('manifestIndex')
+    if bundling.get('manifestIndex', False):
+        return ManifestIndex()
+
+
+def _set_changed_files(context, manifest):
+    # provide the changed files for incremental processing downstream
+    if manifest is not None:
+        context['_bundle_changed_files'] = sorted(manifest.changed)
+        context['_bundle_removed_files'] = sorted(manifest.removed)
+
+
+def _read_gcdtignore(filenames=('.gcdtignore', '.npmignore')):
+    # ignore patterns of the project (like gcdt reads them)
+    patterns = []
+    for filename in filenames:
+        if os.path.isfile(filename):
+            with io.open(filename, encoding='utf-8') as f:
+                patterns.extend(line.strip() for line in f
+                                if line.strip() and
+                                not line.startswith('#'))
+    return patterns
+
+
+def watch_main(argv=None):
+    """Keep the ramuda bundle of a gcdt config file up to date while files
+    change (gcdt-bundler-watch).
+
+    The config is read as is (no gcdt lookups), ramuda 'bundling' options
+    apply like for 'ramuda bundle' (manifestIndex is not used, the watcher
+    tracks the changed files itself).
+    """
+    parser = argparse.ArgumentParser(
+        prog='gcdt-bundler-watch',
+        description='Keep a ramuda bundle up to date while files change.')
+    parser.add_argument('config', help='gcdt config file (json) with a '
+                                       '\'ramuda\' section, i.e. '
+                                       'gcdt_dev.json')
+    parser.add_argument('-o', '--outfile', default='bundle.zip',
+                        help='bundle written after every change '
+                             '(default: bundle.zip)')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the installed dependencies')
+    parser.add_argument('--poll-interval', type=float,
+                        default=DEFAULT_POLL_INTERVAL,
+                        help='seconds between checks without inotify')
+    args = parser.parse_args(argv)
+
+    with io.open(args.config, encoding='utf-8') as f:
+        cfg = json.load(f)['ramuda']
+    runtime = cfg['lambda'].get('runtime', 'python2.7')
+    bundling = cfg.get('bundling', {})
+    zip_options = _get_zip_options(bundling, runtime)
+
+    def _log_change(watcher):
+        log.info('bundle #%d written to %s (%d bytes)',
+                 watcher.stats['builds'], args.outfile, len(watcher.bundle))
+
+    try:
+        watch_zipped_file(
+            cfg['lambda'].get('handlerFile'),
+            bundling.get('folders', []),
+            runtime=runtime,
+            settings=cfg.get('settings', None),
+            settings_filename=DEFAULT_CONFIG['ramuda']['settings_file'],
+            gcdtignore=_read_gcdtignore(),
+            keep=args.keep,
+            outfile=os.path.abspath(args.outfile),
+            callback=_log_change,
+            workers=zip_options['workers'],
+            compression=zip_options['compression'],
+            poll_interval=args.poll_interval,
+            deps_cache=_get_deps_cache(bundling),
+            package_index=_get_package_index(bundling),
+            wheel_cache=_get_wheel_cache(bundling),
+            python_installer=bundling.get('pythonInstaller', 'venv'),
+            wheel_passthrough=bundling.get('wheelPassthrough', False),
+            dist_info=zip_options['dist_info'],
+            pruner=zip_options.get('pruner'),
+            deterministic=zip_options['deterministic'],
+            size_limits=bundling.get('sizeLimits'),
+            entry_cache=zip_options.get('entry_cache'),
+            compiler=zip_options.get('compiler'),
+            venv_templates=_get_venv_templates(bundling),
+            node_distributions=_get_node_distributions(bundling),
+            precompiled_cache=_get_precompiled_cache(bundling))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
 def register():
     """Please be very specific about when your plugin needs to run and why.
     E.g. run the sample stuff after at the very beginning of the lifecycle
@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
+import fnmatch
+import hashlib
 import os
+import re
 
 import pathspec
-from pathlib2 import PurePath, Path
+from pathlib2 import PurePath
+
+try:
+    from os import scandir
+except ImportError:  # python < 3.5 (scandir is a pathlib2 dependency)
+    from scandir import scandir
 
 from gcdt.gcdt_logging import getLogger
 
@@ -12,63 +20,217 @@ log = getLogger(__name__)
 
 # based on: https://github.com/finklabs/botodeploy/blob/master/botodeploy/utils_static.py
 
+_RECURSIVE = None  # '**' segment of an include pattern
+_ignore_specs = {}  # compiled gcdtignore patterns
+
 
-def glob_files(root_dir, includes=None, excludes=None, gcdtignore=None):
+def glob_files(root_dir, includes=None, excludes=None, gcdtignore=None,
+               stats=None):
     """Powerful and flexible utility to search and tag files using patterns.
+
+    The tree is walked once (sorted, files of a folder before its sub
+    folders). Include patterns use pathlib glob semantics, exclude patterns
+    PurePath.match semantics. Each file is returned once, even if more than
+    one include pattern matches it (last one wins).
+    gcdtignore patterns are matched against the absolute and the relative
+    path. Folders ignored as a whole are not walked unless there are negated
+    patterns (which could re-include files).
+
     :param root_dir: directory where we start the search
-    :param includes: list or iterator of include pattern tuples (pattern, tag)
+    :param includes: list or iterator of include patterns
     :param excludes: list or iterator of exclude patterns
     :param gcdtignore: list of ignore patterns (gitwildcard format)
+    :param stats: dict to count 'dirs_pruned' and 'files_skipped' due to
+    gcdtignore (counters are incremented)
     :return: iterator of (absolute_path, relative_path)
     """
     # docu here: https://docs.python.org/3/library/pathlib.html
-    if not includes:
-        includes = ['**']
-    else:
-        # we need to iterate multiple times (iterator safeguard)
-        includes = list(includes)
-
-    if excludes:
-        # we need to iterate multiple times (iterator safeguard)
-        excludes = list(excludes)
-
-    if gcdtignore:
-        spec = pathspec.PathSpec.from_lines('gitwildmatch', gcdtignore)
+    if stats is None:
+        stats = {}
+    stats.setdefault('dirs_pruned', 0)
+    stats.setdefault('files_skipped', 0)
+    matcher = GlobMatcher(includes or ['**'], excludes, gcdtignore, stats)
+    stack = [(str(PurePath(root_dir)), '', matcher.start())]
+    while stack:
+        path, rel_dir, states = stack.pop()
+        files, subdirs = scan_dir(matcher, path, rel_dir, states)
+        for name in files:
+            yield (os.path.join(path, name), rel_dir + name)
+        stack.extend((os.path.join(path, name), rel_dir + name + '/',
+                      sub_states) for name, sub_states in reversed(subdirs))
+
+
+def scan_dir(matcher, path, rel_dir, states):
+    """List the matching files and the sub folders to walk of a folder.
+
+    :param matcher: GlobMatcher
+    :param path: path of the folder
+    :param rel_dir: path of the folder relative to the root ('' or 'a/b/')
+    :param states: matcher states of the folder
+    :return: tuple (list of file names, list of (folder name, states)),
+    sorted by name
+    """
+    try:
+        entries = sorted(scandir(path), key=lambda e: e.name)
+    except OSError:
+        # same as pathlib glob (i.e. permission denied)
+        return [], []
+    files = []
+    subdirs = []
+    for entry in entries:
+        rel_path = rel_dir + entry.name
+        if entry.is_dir():
+            sub_states = matcher.descend(states, entry.name,
+                                         entry.is_symlink())
+            if sub_states is not None and \
+                    not matcher.prune_dir(entry.path, rel_path):
+                subdirs.append((entry.name, sub_states))
+        elif matcher.match_file(states, entry.name, entry.path, rel_path):
+            files.append(entry.name)
+    return files, subdirs
+
+
+def _compile_segment(segment):
+    # matcher for a single path segment (case sensitive fnmatch)
+    if not any(c in segment for c in '*?['):
+        return lambda name: name == segment
+    return re.compile(fnmatch.translate(segment)).match
+
+
+def _get_ignore_spec(gcdtignore):
+    # glob_files is called for every bundle path so compile only once
+    key = tuple(gcdtignore)
+    spec = _ignore_specs.get(key)
+    if spec is None:
         log.debug('gcdtignore patterns: %s', gcdtignore)
+        spec = pathspec.PathSpec.from_lines('gitwildmatch', key)
+        _ignore_specs[key] = spec
+    return spec
+
+
+class _IncludePattern(object):
+    """Glob pattern compiled into a state machine over path segments.
+
+    A state is the index of the next segment to match. Walking into a folder
+    advances the states so every folder and file is matched only once.
+    """
 
-    while includes:
-        pattern = includes.pop(0)
+    def __init__(self, pattern):
         # for compatibility with std. python Lib/glop.py:
         # >>>If recursive is true, the pattern '**' will match any files and
         #    zero or more directories and subdirectories.<<<
         if pattern.endswith('**'):
             pattern += '/*'
-        matches = list(Path(root_dir).glob(pattern))
+        self.segments = [_RECURSIVE if s == '**' else _compile_segment(s)
+                         for s in pattern.split('/') if s not in ('', '.')]
+        if not self.segments:
+            raise ValueError('Unacceptable pattern: %r' % pattern)
+        self.last = len(self.segments) - 1
+
+    def start(self):
+        return self._closure([0])
+
+    def _closure(self, states):
+        # '**' also matches zero directories
+        result = set()
+        for i in states:
+            result.add(i)
+            while i < self.last and self.segments[i] is _RECURSIVE:
+                i += 1
+                result.add(i)
+        return frozenset(result)
+
+    def descend(self, states, name, is_symlink):
+        """States for the contents of sub folder name."""
+        result = []
+        for i in states:
+            segment = self.segments[i]
+            if segment is _RECURSIVE:
+                # same as pathlib, '**' does not follow symlinked folders
+                if not is_symlink:
+                    result.append(i)
+            elif i < self.last and segment(name):
+                result.append(i + 1)
+        return self._closure(result)
+
+    def match_file(self, states, name):
+        segment = self.segments[self.last]
+        return self.last in states and segment is not _RECURSIVE and \
+            bool(segment(name))
+
 
-        for m in matches:
-            if m.is_dir():
-                continue
+class _ExcludePattern(object):
+    """Pattern with PurePath.match semantics (matched from the right)."""
 
-            # some discussion on how to convert a pattern into regex:
-            # http://stackoverflow.com/questions/27726545/python-glob-but-against-a-list-of-strings-rather-than-the-filesystem
-            pp = PurePath(m)
+    def __init__(self, pattern):
+        self.absolute = pattern.startswith('/')
+        self.segments = [_compile_segment(s)
+                         for s in reversed(pattern.split('/'))
+                         if s not in ('', '.')]
 
-            # check if m is contained in remaining include patterns
-            # (last one wins)
-            if includes and any(map(lambda p: pp.match(p), includes)):
-                continue
+    def match(self, parts):
+        # parts of the path (without the root)
+        if len(self.segments) > len(parts) or \
+                (self.absolute and len(self.segments) != len(parts)):
+            return False
+        return all(segment(part) for segment, part
+                   in zip(self.segments, reversed(parts)))
 
-            # check if m is contained in exclude pattern
-            if excludes and any(map(lambda p: pp.match(p), excludes)):
-                continue
 
-            # check if m is contained in gcdtignore
-            if gcdtignore and spec.match_file(str(m)):
-                log.debug('Skipped file \'%s\' due to gcdtignore pattern',
-                          str(m.relative_to(root_dir)))
-                continue
+class GlobMatcher(object):
+    """Include, exclude and gcdtignore rules of a glob_files call."""
 
-            yield (str(m), str(m.relative_to(root_dir)))
+    def __init__(self, includes, excludes=None, gcdtignore=None, stats=None):
+        self.includes = [_IncludePattern(p) for p in includes]
+        self.excludes = [_ExcludePattern(p) for p in excludes or []]
+        self.spec = _get_ignore_spec(gcdtignore) if gcdtignore else None
+        # a negated pattern can re-include files within an ignored folder
+        self.prune = self.spec is not None and \
+            not any(p.include is False for p in self.spec.patterns)
+        self.stats = stats if stats is not None else \
+            {'dirs_pruned': 0, 'files_skipped': 0}
+
+    def start(self):
+        return tuple(p.start() for p in self.includes)
+
+    def descend(self, states, name, is_symlink):
+        """States for sub folder name (None if no file can match inside)."""
+        sub_states = tuple(p.descend(s, name, is_symlink)
+                           for p, s in zip(self.includes, states))
+        if any(sub_states):
+            return sub_states
+
+    def prune_dir(self, full_path, rel_path):
+        """True if the folder is ignored as a whole (gcdtignore)."""
+        if self.prune and self._ignored(full_path + '/', rel_path + '/'):
+            log.debug('Skipped folder \'%s\' due to gcdtignore pattern',
+                      rel_path)
+            self.stats['dirs_pruned'] += 1
+            return True
+        return False
+
+    def _ignored(self, full_path, rel_path):
+        return self.spec.match_file(full_path) or \
+            self.spec.match_file(rel_path)
+
+    def match_file(self, states, name, full_path, rel_path):
+        if not any(p.match_file(s, name)
+                   for p, s in zip(self.includes, states)):
+            return False
+
+        # check if file is contained in exclude pattern
+        if self.excludes:
+            parts = full_path.lstrip('/').split('/')
+            if any(p.match(parts) for p in self.excludes):
+                return False
+
+        # check if file is contained in gcdtignore
+        if self.spec is not None and self._ignored(full_path, rel_path):
+            log.debug('Skipped file \'%s\' due to gcdtignore pattern',
+                      rel_path)
+            self.stats['files_skipped'] += 1
+            return False
+        return True
 
 
 def get_path_info(path):
@@ -97,3 +259,51 @@ def get_path_info(path):
         target += '/'
 
     return base, ptz, target
+
+
+class HashingWriter(object):
+    """File object wrapper computing the sha256 of everything written."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    def write(self, data):
+        self._sha256.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+class HashingReader(object):
+    """File object wrapper computing the sha256 of everything read."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self._sha256.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self, chunk_size=64 * 1024):
+        """Read (and hash) the rest of the file."""
+        while self.read(chunk_size):
+            pass
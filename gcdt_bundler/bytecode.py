@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""Compile the python modules of a bundle ahead of time with the
+interpreter of the Lambda runtime.
+"""
+from __future__ import unicode_literals, print_function
+import calendar
+import json
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+
+try:
+    from shutil import which
+except ImportError:  # python 2
+    from distutils.spawn import find_executable as which
+
+from gcdt import GcdtError
+from gcdt.gcdt_logging import getLogger
+
+from .cache_utils import makedirs
+from .zip_writer import ZIP_STORED, DETERMINISTIC_DATE_TIME, compress_file, \
+    file_attributes, normalize_arcname, worker_count
+
+
+log = getLogger(__name__)
+
+# the bundle is unzipped into this folder on AWS Lambda
+LAMBDA_TASK_ROOT = '/var/task'
+
+# runs with the runtime interpreter (python2.7 and python3), reads one json
+# list [source, cfile, dfile] per line
+_COMPILE_SCRIPT = '''
+import json, py_compile, sys
+options = {}
+if hasattr(py_compile, 'PycInvalidationMode'):
+    # python 3.7+, the mtime is patched afterwards
+    options['invalidation_mode'] = py_compile.PycInvalidationMode.TIMESTAMP
+for line in sys.stdin:
+    source, cfile, dfile = json.loads(line)
+    try:
+        py_compile.compile(source, cfile=cfile, dfile=dfile, doraise=True,
+                           **options)
+    except py_compile.PyCompileError as e:
+        sys.stderr.write(e.msg + '\\n')
+'''
+
+
+class InterpreterNotFoundError(GcdtError):
+    """
+    No interpreter for the runtime could be found
+    """
+    fmt = 'No interpreter for runtime \'{runtime}\' found to compile the ' \
+          'bundle (bytecode.python).'
+
+
+class InterpreterMismatchError(GcdtError):
+    """
+    The interpreter does not match the runtime
+    """
+    fmt = 'Interpreter \'{python_exe}\' is python {version}, runtime ' \
+          '\'{runtime}\' needs a matching interpreter to compile the bundle.'
+
+
+def _runtime_version(runtime):
+    # python3.6 => (3, 6)
+    return tuple(int(v) for v in runtime[len('python'):].split('.')[:2])
+
+
+def _source_mtime(date_time):
+    # mtime of a file unzipped from an entry with this date_time on Lambda
+    # (UTC, zip times have a resolution of two seconds)
+    date_time = tuple(date_time[:5]) + (date_time[5] // 2 * 2,)
+    return calendar.timegm(date_time + (0, 0, 0))
+
+
+def _entry_content(entry):
+    # uncompressed data of a ZipEntry (stored or deflated)
+    if entry.compress_type == ZIP_STORED:
+        return entry.data
+    return zlib.decompressobj(-15).decompress(entry.data)
+
+
+class BytecodeCompiler(object):
+    """Compile the .py files of a bundle with the interpreter of the runtime.
+
+    Compiled files are added next to the sources (__pycache__ for python 3).
+    The pyc header carries the mtime the source gets when the bundle is
+    unzipped on Lambda, so the bytecode is used as is. With pyc_only the
+    sources are replaced by the compiled files.
+
+    :param runtime: AWS Lambda python runtime i.e. python3.6
+    :param python_exe: interpreter of the runtime (default: runtime on PATH)
+    :param workers: number of compiler processes (None: one per cpu)
+    :param pyc_only: bundle the compiled files without the sources
+    """
+
+    def __init__(self, runtime, python_exe=None, workers=None,
+                 pyc_only=False):
+        self.runtime = runtime
+        self.version = _runtime_version(runtime)
+        self.python_exe = python_exe
+        self.workers = workers
+        self.pyc_only = pyc_only
+        self.stats = {'compiled': 0, 'failed': 0, 'seconds': 0.0}
+        self._tmp_dir = None
+        self._checked = False
+
+    def pyc_arcname(self, arcname):
+        """Name of the compiled file within the bundle.
+
+        :param arcname: name of the .py file within the bundle
+        """
+        if self.pyc_only or self.version[0] == 2:
+            return arcname + 'c'
+        folder, filename = os.path.split(arcname)
+        tag = 'cpython-%d%d' % self.version
+        pyc_name = '%s.%s.pyc' % (filename[:-len('.py')], tag)
+        return normalize_arcname(os.path.join(folder, '__pycache__',
+                                              pyc_name))
+
+    def _interpreter(self):
+        # find and check the interpreter once
+        if self._checked:
+            return self.python_exe
+        python_exe = self.python_exe or which(self.runtime)
+        if python_exe is None:
+            raise InterpreterNotFoundError(runtime=self.runtime)
+        version = subprocess.check_output(
+            [python_exe, '-c',
+             'import sys; print("%d.%d" % sys.version_info[:2])'])
+        version = version.decode('utf-8').strip()
+        if version != '%d.%d' % self.version:
+            raise InterpreterMismatchError(python_exe=python_exe,
+                                           version=version,
+                                           runtime=self.runtime)
+        self.python_exe = python_exe
+        self._checked = True
+        return python_exe
+
+    def _compile_chunk(self, python_exe, chunk):
+        proc = subprocess.Popen([python_exe, '-c', _COMPILE_SCRIPT],
+                                stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        lines = ''.join(json.dumps(job) + '\n' for job in chunk)
+        _, stderr = proc.communicate(lines.encode('utf-8'))
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, python_exe)
+        for line in stderr.decode('utf-8', 'replace').splitlines():
+            log.debug('bytecode: %s', line)
+
+    def _patch_mtime(self, pyc_path, mtime):
+        # python 3.7+ header: magic, flags, mtime, size
+        offset = 8 if self.version >= (3, 7) else 4
+        with open(pyc_path, 'r+b') as f:
+            f.seek(offset)
+            f.write(struct.pack('<I', mtime & 0xFFFFFFFF))
+
+    def compile(self, sources):
+        """Compile python files in parallel.
+
+        :param sources: list of (path, arcname, date_time of the zip entry)
+        :return: dict arcname => path of the compiled file (files which do
+        not compile are left out)
+        """
+        if not sources:
+            return {}
+        python_exe = self._interpreter()
+        start = time.time()
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix='gcdt-pyc-')
+        jobs = []
+        for path, arcname, _ in sources:
+            pyc_path = os.path.join(self._tmp_dir,
+                                    *self.pyc_arcname(arcname).split('/'))
+            makedirs(os.path.dirname(pyc_path))
+            jobs.append([os.path.abspath(path), pyc_path,
+                         LAMBDA_TASK_ROOT + '/' + arcname])
+        count = min(worker_count(self.workers), len(jobs))
+        chunks = [jobs[i::count] for i in range(count)]
+        pool = ThreadPool(count)
+        try:
+            pool.map(lambda chunk: self._compile_chunk(python_exe, chunk),
+                     chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+        compiled = {}
+        for (_, arcname, date_time), (_, pyc_path, _) in zip(sources, jobs):
+            if not os.path.isfile(pyc_path):
+                self.stats['failed'] += 1
+                continue
+            if not self.pyc_only:
+                self._patch_mtime(pyc_path, _source_mtime(date_time))
+            compiled[arcname] = pyc_path
+        self.stats['compiled'] += len(compiled)
+        self.stats['seconds'] += time.time() - start
+        return compiled
+
+    def compile_files(self, tasks, deterministic=False):
+        """Compile the python files of (path, arcname) tasks.
+
+        :param tasks: iterable of (path, arcname), arcnames are normalized
+        :param deterministic: the bundle has normalized timestamps
+        :return: dict arcname => path of the compiled file
+        """
+        sources = []
+        for path, arcname in tasks:
+            if arcname.endswith('.py'):
+                if deterministic:
+                    date_time = DETERMINISTIC_DATE_TIME
+                else:
+                    date_time = file_attributes(os.stat(path))[0]
+                sources.append((path, arcname, date_time))
+        return self.compile(sources)
+
+    def compile_tasks(self, tasks, deterministic=False):
+        """Add the compiled files to the (path, arcname) tasks of a bundle.
+
+        :param tasks: iterable of (path, arcname)
+        :param deterministic: the bundle has normalized timestamps
+        :return: list of (path, arcname)
+        """
+        tasks = [(path, normalize_arcname(arcname)) for path, arcname in tasks]
+        compiled = self.compile_files(tasks, deterministic)
+        result = [(path, arcname) for path, arcname in tasks
+                  if not (self.pyc_only and arcname in compiled)]
+        for arcname in sorted(compiled):
+            result.append((compiled[arcname], self.pyc_arcname(arcname)))
+        return result
+
+    def compile_entries(self, entries, deterministic=False):
+        """Add the compiled files to ZipEntries (i.e. wheel members).
+
+        :param entries: iterable of ZipEntry
+        :param deterministic: the bundle has normalized timestamps
+        :return: list of ZipEntry
+        """
+        entries = list(entries)
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix='gcdt-pyc-')
+        sources = []
+        for entry in entries:
+            if not entry.arcname.endswith('.py'):
+                continue
+            path = os.path.join(self._tmp_dir, 'src',
+                                *entry.arcname.split('/'))
+            makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(_entry_content(entry))
+            sources.append((path, entry.arcname, DETERMINISTIC_DATE_TIME
+                            if deterministic else entry.date_time))
+        compiled = self.compile(sources)
+        result = [e for e in entries
+                  if not (self.pyc_only and e.arcname in compiled)]
+        for arcname in sorted(compiled):
+            result.append(compress_file(compiled[arcname],
+                                        self.pyc_arcname(arcname)))
+        return result
+
+    def close(self):
+        """Remove the compiled files."""
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+    def log_stats(self):
+        """Log the number of compiled files."""
+        log.info('compiled %d python files in %0.2f s (%d failed)',
+                 self.stats['compiled'], self.stats['seconds'],
+                 self.stats['failed'])
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Helpers shared by the on-disk caches of gcdt-bundler."""
+from __future__ import unicode_literals, print_function
+import contextlib
+import errno
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+from gcdt.gcdt_logging import getLogger
+
+
+log = getLogger(__name__)
+
+CACHE_DIR_ENV = 'GCDT_BUNDLER_CACHE_DIR'
+
+
+def get_cache_dir(*parts):
+    """Get (and create) a folder within the gcdt-bundler cache.
+
+    The cache is located in '~/.cache/gcdt-bundler' unless the
+    GCDT_BUNDLER_CACHE_DIR environment variable is set.
+
+    :param parts: path elements within the cache
+    :return: path of the folder
+    """
+    base = os.getenv(CACHE_DIR_ENV) or \
+        os.path.join(os.path.expanduser('~'), '.cache', 'gcdt-bundler')
+    path = os.path.join(base, *parts)
+    makedirs(path)
+    return path
+
+
+def makedirs(path):
+    """Create a folder including parents (no error if it exists)."""
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def atomic_write(path, data):
+    """Write data to path so readers never see a partial file.
+
+    :param path: destination file
+    :param data: bytes to write
+    """
+    folder = os.path.dirname(path)
+    makedirs(folder)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+    except Exception:
+        remove_file(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive lock between threads and processes (flock is bound to the
+    open file).
+
+    :param path: lock file (created if missing)
+    """
+    makedirs(os.path.dirname(path))
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def touch(path):
+    """Mark a cache file as recently used."""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def prune_lru(folder, max_size, suffixes=None):
+    """Remove the least recently used files until the folder fits max_size.
+
+    Files are ordered by their modification time (use touch() on cache hits).
+
+    :param folder: cache folder
+    :param max_size: maximum total size in bytes
+    :param suffixes: only consider files ending with one of the suffixes
+    :return: list of removed paths
+    """
+    files = []
+    total = 0
+    for dirpath, _, filenames in os.walk(folder):
+        for filename in filenames:
+            if suffixes and not filename.endswith(tuple(suffixes)):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+    removed = []
+    for mtime, size, path in sorted(files):
+        if total <= max_size:
+            break
+        if remove_file(path):
+            total -= size
+            removed.append(path)
+    if removed:
+        log.debug('evicted %d files from cache \'%s\'', len(removed), folder)
+    return removed
+
+
+def remove_file(path):
+    """Remove a file, returns False if it could not be removed."""
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Cache of installed python dependencies keyed by lockfile, runtime and
+platform.
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import sysconfig
+import tempfile
+import time
+import zipfile
+
+from gcdt.gcdt_logging import getLogger
+
+from .cache_utils import get_cache_dir, atomic_write, makedirs, touch, \
+    remove_file
+from .zip_writer import ZipWriter, compress_file, imap_entries
+
+
+log = getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 2 * 1024 * 1024 * 1024  # 2 GB
+DEPS_CACHE_VERSION = 1
+
+
+def platform_tag():
+    """Platform of the host the dependencies are installed on."""
+    return sysconfig.get_platform().replace('-', '_').replace('.', '_')
+
+
+class DepsCache(object):
+    """Store installed site-packages trees as zip layers.
+
+    A layer is keyed by the content of the lockfiles (requirements.txt,
+    poetry.lock, ...), the runtime and the platform. The cache is bounded by
+    max_size (least recently used layers are evicted).
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE, workers=1):
+        if cache_dir is None:
+            cache_dir = get_cache_dir('deps')
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, lockfiles, runtime, platform=None, variant=None):
+        """Cache key for the dependencies.
+
+        :param lockfiles: list of files defining the dependencies
+        :param runtime: AWS Lambda runtime i.e. python3.6
+        :param platform: platform tag (default: platform_tag())
+        :param variant: kind of layer if it is not an installed
+        site-packages folder (i.e. 'wheels')
+        :return: key (sha256 hex digest)
+        """
+        sha256 = hashlib.sha256()
+        parts = [DEPS_CACHE_VERSION, runtime, platform or platform_tag()]
+        if variant:
+            parts.append(variant)
+        sha256.update(json.dumps(parts).encode('utf-8'))
+        for lockfile in lockfiles:
+            sha256.update(os.path.basename(lockfile).encode('utf-8') + b'\0')
+            with open(lockfile, 'rb') as f:
+                sha256.update(hashlib.sha256(f.read()).digest())
+        return sha256.hexdigest()
+
+    def _layer_path(self, key):
+        return os.path.join(self.cache_dir, '%s.zip' % key)
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, '%s.json' % key)
+
+    def restore(self, key, target_dir, replace=None):
+        """Extract a cached layer into target_dir (replaces target_dir).
+
+        :param key: cache key
+        :param target_dir: site-packages folder to restore
+        :param replace: folder containing target_dir which is removed on a
+        cache hit (i.e. the virtualenv), nothing is removed on a miss
+        :return: True on a cache hit
+        """
+        layer_path = self._layer_path(key)
+        if not os.path.isfile(layer_path):
+            self.misses += 1
+            return False
+        start = time.time()
+        shutil.rmtree(replace or target_dir, ignore_errors=True)
+        makedirs(target_dir)
+        with zipfile.ZipFile(layer_path) as z:
+            for info in z.infolist():
+                path = z.extract(info, target_dir)
+                mode = info.external_attr >> 16
+                if mode:
+                    os.chmod(path, mode & 0o7777)
+        touch(layer_path)
+        touch(self._meta_path(key))
+        self.hits += 1
+        log.info('restored dependencies from cache in %0.2f s',
+                 time.time() - start)
+        return True
+
+    def store(self, key, source_dir, **meta):
+        """Store the content of source_dir as layer.
+
+        :param key: cache key
+        :param source_dir: installed site-packages folder
+        :param meta: additional info to show in entries() (i.e. runtime)
+        """
+        tasks = []
+        for dirpath, dirnames, filenames in os.walk(source_dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                full_path = os.path.join(dirpath, filename)
+                if os.path.isfile(full_path):
+                    tasks.append((full_path,
+                                  os.path.relpath(full_path, source_dir)))
+        makedirs(self.cache_dir)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with ZipWriter(f) as z:
+                    for entry in imap_entries(compress_file, tasks,
+                                              workers=self.workers):
+                        z.add(entry)
+                    size = z.offset
+            os.rename(tmp_path, self._layer_path(key))
+        except Exception:
+            remove_file(tmp_path)
+            raise
+        meta.update({'key': key, 'files': len(tasks), 'size': size,
+                     'created': time.time()})
+        atomic_write(self._meta_path(key), json.dumps(meta).encode('utf-8'))
+        self.prune()
+
+    def entries(self):
+        """List the cached layers (most recently used first).
+
+        :return: list of dicts (key, size, files, last_used, ...)
+        """
+        result = []
+        try:
+            filenames = os.listdir(self.cache_dir)
+        except OSError:
+            return result
+        for filename in filenames:
+            if not filename.endswith('.zip') or filename.startswith('.'):
+                continue
+            key = filename[:-len('.zip')]
+            try:
+                st = os.stat(self._layer_path(key))
+                with open(self._meta_path(key), 'r') as f:
+                    meta = json.load(f)
+            except (IOError, OSError, ValueError):
+                meta = {'key': key}
+                st = os.stat(self._layer_path(key))
+            meta['size'] = st.st_size
+            meta['last_used'] = st.st_mtime
+            result.append(meta)
+        return sorted(result, key=lambda m: m['last_used'], reverse=True)
+
+    def prune(self, max_size=None):
+        """Evict least recently used layers exceeding max_size.
+
+        :param max_size: size in bytes (default: max_size of the cache)
+        :return: list of removed keys
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = self.entries()
+        total = sum(meta['size'] for meta in entries)
+        removed = []
+        for meta in reversed(entries):
+            if total <= max_size:
+                break
+            if remove_file(self._layer_path(meta['key'])):
+                remove_file(self._meta_path(meta['key']))
+                total -= meta['size']
+                removed.append(meta['key'])
+        if removed:
+            log.debug('evicted %d dependency layers', len(removed))
+        # metadata of layers which are gone
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.json') and not os.path.isfile(
+                    self._layer_path(filename[:-len('.json')])):
+                remove_file(os.path.join(self.cache_dir, filename))
+        return removed
+
+
+def main(argv=None):
+    """Inspect and prune the dependency cache (gcdt-bundler-cache)."""
+    parser = argparse.ArgumentParser(
+        prog='gcdt-bundler-cache',
+        description='Inspect and prune the gcdt-bundler dependency cache.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('list', help='list the cached dependency layers')
+    prune_parser = subparsers.add_parser(
+        'prune', help='evict least recently used layers')
+    prune_parser.add_argument('--max-size', type=float, default=None,
+                              help='maximum cache size in MB')
+    subparsers.add_parser('clear', help='remove all cached layers')
+    args = parser.parse_args(argv)
+
+    cache = DepsCache()
+    if args.command == 'prune':
+        max_size = None if args.max_size is None \
+            else int(args.max_size * 1024 * 1024)
+        for key in cache.prune(max_size):
+            print('removed %s' % key)
+    elif args.command == 'clear':
+        for key in cache.prune(0):
+            print('removed %s' % key)
+    else:
+        total = 0
+        for meta in cache.entries():
+            total += meta['size']
+            print('%s  %8.1f MB  %s  %s' % (
+                meta['key'][:12], meta['size'] / 1024.0 / 1024.0,
+                time.strftime('%Y-%m-%d %H:%M',
+                              time.localtime(meta['last_used'])),
+                meta.get('runtime', '')))
+        print('total: %0.1f MB in %s' % (total / 1024.0 / 1024.0,
+                                         cache.cache_dir))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
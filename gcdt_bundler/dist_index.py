@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Index of the distributions installed into a site-packages folder, read
+from the .dist-info / .egg-info metadata (no interpreter involved).
+"""
+from __future__ import unicode_literals, print_function
+import io
+import os
+import re
+
+from gcdt.gcdt_logging import getLogger
+
+
+log = getLogger(__name__)
+
+_METADATA_SUFFIXES = ('.dist-info', '.egg-info')
+# metadata file within a .dist-info / .egg-info folder
+_METADATA_FILES = {'.dist-info': 'METADATA', '.egg-info': 'PKG-INFO'}
+_NORMALIZE = re.compile(r'[-_.]+')
+
+
+def normalize_name(name):
+    """Normalized project name (PEP 503), i.e. MySQL_python => mysql-python.
+
+    :param name: project name
+    """
+    return _NORMALIZE.sub('-', name).lower()
+
+
+def _read_headers(path):
+    # Name and Version from the header of a METADATA / PKG-INFO file
+    headers = {}
+    with io.open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if not line.strip():
+                break  # end of the header, the description follows
+            key, _, value = line.partition(':')
+            if key in ('Name', 'Version') and key not in headers:
+                headers[key] = value.strip()
+    return headers
+
+
+def read_distribution(path):
+    """Project name and version of a .dist-info / .egg-info folder (or
+    egg-info file).
+
+    :param path: path of the metadata folder or file
+    :return: tuple (name, version) or None if it can not be read
+    """
+    filename = os.path.basename(path)
+    base, suffix = os.path.splitext(filename)
+    if os.path.isdir(path):
+        metadata = os.path.join(path, _METADATA_FILES[suffix])
+    else:
+        metadata = path
+    headers = {}
+    if os.path.isfile(metadata):
+        headers = _read_headers(metadata)
+    # fall back to the folder name: name-version(-pyX.Y)
+    parts = base.split('-')
+    name = headers.get('Name') or parts[0]
+    version = headers.get('Version') or (parts[1] if len(parts) > 1
+                                         else None)
+    if not version:
+        log.debug('no version found in %s', path)
+        return None
+    return name, version
+
+
+class DistributionIndex(object):
+    """Installed distributions of site-packages folders.
+
+    The folders are scanned once and again only after their content changed
+    (mtime of the folder), so the index is reused during a build.
+
+    :param site_packages_dirs: site-packages folders (lib and lib64),
+    missing folders are skipped
+    """
+
+    def __init__(self, *site_packages_dirs):
+        self.site_packages_dirs = site_packages_dirs
+        self._mtimes = None
+        self._distributions = {}
+
+    def _folder_mtimes(self):
+        mtimes = []
+        for folder in self.site_packages_dirs:
+            try:
+                mtimes.append(os.stat(folder).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def distributions(self):
+        """Installed distributions.
+
+        :return: dict normalized name => (name, version, path of the metadata)
+        """
+        mtimes = self._folder_mtimes()
+        if mtimes == self._mtimes:
+            return self._distributions
+        distributions = {}
+        for folder, mtime in zip(self.site_packages_dirs, mtimes):
+            if mtime is None:
+                continue
+            for filename in sorted(os.listdir(folder)):
+                if not filename.endswith(_METADATA_SUFFIXES):
+                    continue
+                path = os.path.join(folder, filename)
+                dist = read_distribution(path)
+                if dist is not None:
+                    distributions.setdefault(normalize_name(dist[0]),
+                                             dist + (path,))
+        self._mtimes = mtimes
+        self._distributions = distributions
+        return distributions
+
+    def versions(self):
+        """Installed versions.
+
+        :return: dict normalized name => version
+        """
+        return dict((name, dist[1])
+                    for name, dist in self.distributions().items())
+
+    def get(self, name):
+        """Installed distribution or None.
+
+        :param name: project name (normalized or not)
+        :return: tuple (name, version, path of the metadata)
+        """
+        return self.distributions().get(normalize_name(name))
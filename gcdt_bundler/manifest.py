@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Persistent file manifest of the bundled folders for incremental bundling."""
+from __future__ import unicode_literals, print_function
+import hashlib
+import json
+import os
+import threading
+import time
+
+from pathlib2 import PurePath
+
+from gcdt.gcdt_logging import getLogger
+
+from .bundler_utils import GlobMatcher, scan_dir
+from .cache_utils import get_cache_dir, atomic_write
+from .zip_writer import READ_CHUNK_SIZE
+
+
+log = getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def _file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ManifestIndex(object):
+    """Index of the files (size, mtime, inode, sha256) of each bundling root.
+
+    Folders whose mtime did not change since the last run are not listed
+    again, only their known files are checked with stat. Files are hashed
+    only if size, mtime or inode changed. A manifest is discarded when the
+    include or gcdtignore patterns of the root change.
+
+    After walking, `changed` contains the new or modified files and
+    `removed` the files which are gone (absolute paths).
+    """
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = get_cache_dir('manifests')
+        self.cache_dir = cache_dir
+        self.changed = set()
+        self.removed = set()
+        self.stats = {'dirs_scanned': 0, 'dirs_reused': 0, 'files_hashed': 0}
+        self._lock = threading.Lock()
+        self._manifests = {}  # path => manifest to write on flush()
+
+    def _manifest_file(self, root):
+        digest = hashlib.sha256(root.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, '%s.json' % digest)
+
+    def _load(self, manifest_file, config):
+        try:
+            with open(manifest_file, 'r') as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if manifest.get('version') != MANIFEST_VERSION or \
+                manifest.get('config') != config:
+            log.debug('manifest \'%s\' invalidated', manifest_file)
+            return None
+        return manifest
+
+    def glob_files(self, root_dir, includes=None, gcdtignore=None):
+        """Same as bundler_utils.glob_files but reuses the manifest of
+        root_dir from the previous run.
+
+        :param root_dir: directory where we start the search
+        :param includes: list of include patterns
+        :param gcdtignore: list of ignore patterns (gitwildcard format)
+        :return: iterator of (absolute_path, relative_path)
+        """
+        includes = list(includes or ['**'])
+        gcdtignore = list(gcdtignore or [])
+        root = str(PurePath(root_dir))
+        config = hashlib.sha256(json.dumps(
+            [includes, gcdtignore], sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        manifest_file = self._manifest_file(root)
+        known = self._load(manifest_file, config) or \
+            {'scanned_at': 0, 'dirs': {}, 'files': {}}
+        # entries modified in the same second as the last scan can not be
+        # trusted (mtime granularity)
+        trusted_before = known['scanned_at'] - 1
+        scanned_at = time.time()
+        dirs = {}
+        files = {}
+        matcher = GlobMatcher(includes, gcdtignore=gcdtignore)
+
+        stack = [(root, '', matcher.start())]
+        while stack:
+            path, rel_dir, states = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            cached = known['dirs'].get(rel_dir)
+            if cached and cached[0] == mtime and mtime < trusted_before:
+                names, subdir_names = cached[1], cached[2]
+                subdirs = []
+                for name in subdir_names:
+                    sub_states = matcher.descend(
+                        states, name, os.path.islink(os.path.join(path, name)))
+                    if sub_states is not None:
+                        subdirs.append((name, sub_states))
+                self._count('dirs_reused')
+            else:
+                names, subdirs = scan_dir(matcher, path, rel_dir, states)
+                self._count('dirs_scanned')
+            dirs[rel_dir] = [mtime, names, [name for name, _ in subdirs]]
+
+            for name in names:
+                full_path = os.path.join(path, name)
+                rel_path = rel_dir + name
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    continue
+                info = [st.st_size, st.st_mtime, st.st_ino]
+                previous = known['files'].get(rel_path)
+                if previous and previous[:3] == info and \
+                        st.st_mtime < trusted_before:
+                    digest = previous[3]
+                else:
+                    digest = _file_digest(full_path)
+                    self._count('files_hashed')
+                    if not previous or previous[3] != digest:
+                        with self._lock:
+                            self.changed.add(full_path)
+                files[rel_path] = info + [digest]
+                yield (full_path, rel_path)
+
+            stack.extend((os.path.join(path, name), rel_dir + name + '/',
+                          sub_states) for name, sub_states in reversed(subdirs))
+
+        with self._lock:
+            self.removed.update(os.path.join(root, rel_path)
+                                for rel_path in known['files']
+                                if rel_path not in files)
+            self._manifests[manifest_file] = {
+                'version': MANIFEST_VERSION,
+                'config': config,
+                'scanned_at': scanned_at,
+                'dirs': dirs,
+                'files': files
+            }
+
+    def _count(self, counter):
+        with self._lock:
+            self.stats[counter] += 1
+
+    def flush(self):
+        """Persist the manifests of the walked roots."""
+        with self._lock:
+            for manifest_file, manifest in self._manifests.items():
+                atomic_write(manifest_file,
+                             json.dumps(manifest).encode('utf-8'))
+            self._manifests = {}
+        log.debug('manifest: %d folders scanned, %d reused, %d files hashed, '
+                  '%d changed, %d removed', self.stats['dirs_scanned'],
+                  self.stats['dirs_reused'], self.stats['files_hashed'],
+                  len(self.changed), len(self.removed))
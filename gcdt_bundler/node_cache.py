@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""Prebuilt Node.js distributions downloaded once per version into a shared
+cache, nodeenv folders link to them.
+"""
+from __future__ import unicode_literals, print_function
+import contextlib
+import os
+import platform
+import shutil
+import tarfile
+import tempfile
+import time
+
+import requests
+
+from gcdt import GcdtError
+from gcdt.gcdt_logging import getLogger
+
+from .bundler_utils import HashingReader
+from .cache_utils import get_cache_dir, makedirs, atomic_write, file_lock, \
+    touch
+
+
+log = getLogger(__name__)
+
+DEFAULT_DIST_URL = 'https://nodejs.org/dist'
+# same variable as node-gyp and nvm use for mirrors
+DIST_URL_ENV = 'NODEJS_ORG_MIRROR'
+# written into the distribution folder once it is complete and verified
+COMPLETE_MARKER = '.gcdt-node'
+_ARCHS = {
+    'x86_64': 'x64',
+    'amd64': 'x64',
+    'i686': 'x86',
+    'x86': 'x86',
+    'aarch64': 'arm64',
+    'armv7l': 'armv7l',
+    'armv6l': 'armv6l',
+}
+_EXTRACT_OPTIONS = {}
+if hasattr(tarfile, 'data_filter'):
+    # python 3.12+ (and backports), keeps the permissions of the executables
+    _EXTRACT_OPTIONS['filter'] = 'tar'
+
+
+class NodeChecksumMissingError(GcdtError):
+    """
+    The archive is not listed in SHASUMS256.txt
+    """
+    fmt = '\'{filename}\' is not listed in {url}.'
+
+
+class NodeDigestMismatchError(GcdtError):
+    """
+    The downloaded archive does not match SHASUMS256.txt
+    """
+    fmt = 'sha256 of \'{filename}\' does not match SHASUMS256.txt ' \
+          '({sha256}).'
+
+
+class UnsafeArchiveMemberError(GcdtError):
+    """
+    The archive contains a file outside of its folder
+    """
+    fmt = '\'{filename}\' contains \'{member}\' outside of the distribution ' \
+          'folder.'
+
+
+def archive_name(version):
+    """Name of the prebuilt distribution for the build host,
+    i.e. node-v8.10.0-linux-x64.tar.gz
+
+    :param version: Node.js version i.e. 8.10.0
+    """
+    machine = platform.machine()
+    arch = _ARCHS.get(machine.lower(), machine)
+    return 'node-v%s-%s-%s.tar.gz' % (version, platform.system().lower(),
+                                      arch)
+
+
+def _is_safe_path(name):
+    # relative, no parent references
+    name = name.replace('\\', '/')
+    return not name.startswith('/') and '..' not in name.split('/')
+
+
+def _is_safe(member, base_dir):
+    """True if the member is extracted into its folder below base_dir.
+
+    Links are checked as well (tarfile only filters them on python 3.12+):
+    a symlink may only climb up with leading '..' and must end within the
+    folder, so no later member is written outside through a link.
+
+    :param member: TarInfo
+    :param base_dir: extraction folder (real path)
+    """
+    if not _is_safe_path(member.name):
+        return False
+    if member.islnk():
+        # hard links refer to a member of the archive
+        return _is_safe_path(member.linkname)
+    if member.issym():
+        parts = member.linkname.replace('\\', '/').split('/')
+        ups = 0
+        while ups < len(parts) and parts[ups] == '..':
+            ups += 1
+        if not parts[0] or '..' in parts[ups:]:
+            return False
+        name = member.name.replace('\\', '/').strip('/')
+        folder = os.path.join(base_dir, name.split('/')[0])
+        parent = os.path.realpath(
+            os.path.join(base_dir, os.path.dirname(name)))
+        target = os.path.normpath(os.path.join(parent, *(['..'] * ups)))
+        return target == folder or target.startswith(folder + os.sep)
+    return member.isfile() or member.isdir()
+
+
+class NodeDistributions(object):
+    """Versioned Node.js distributions shared by all projects.
+
+    A distribution is downloaded once (~/.cache/gcdt-bundler/node/<version>)
+    under a lock file. The archive is extracted while it is downloaded and
+    verified against SHASUMS256.txt of the release before it is moved into
+    place. A nodeenv is a folder of symlinks into the distribution.
+
+    :param cache_dir: folder for the distributions
+    :param dist_url: Node.js download server (default: NODEJS_ORG_MIRROR or
+    https://nodejs.org/dist)
+    :param timeout: seconds to wait for the server
+    """
+
+    def __init__(self, cache_dir=None, dist_url=None, timeout=30):
+        if cache_dir is None:
+            cache_dir = get_cache_dir('node')
+        if dist_url is None:
+            dist_url = os.getenv(DIST_URL_ENV, DEFAULT_DIST_URL)
+        self.cache_dir = cache_dir
+        self.dist_url = dist_url.rstrip('/')
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+
+    def _release_url(self, version, filename):
+        return '%s/v%s/%s' % (self.dist_url, version, filename)
+
+    def _expected_sha256(self, version, filename):
+        url = self._release_url(version, 'SHASUMS256.txt')
+        resp = requests.get(url, timeout=self.timeout)
+        resp.raise_for_status()
+        for line in resp.text.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1] == filename:
+                return parts[0].lower()
+        raise NodeChecksumMissingError(filename=filename, url=url)
+
+    def _download(self, version, path):
+        # stream the archive into the extraction, the folder is moved into
+        # place after the digest has been verified
+        filename = archive_name(version)
+        sha256 = self._expected_sha256(version, filename)
+        url = self._release_url(version, filename)
+        log.info('downloading %s', url)
+        tmp_dir = os.path.realpath(
+            tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-'))
+        try:
+            with contextlib.closing(requests.get(url, timeout=self.timeout,
+                                                 stream=True)) as resp:
+                resp.raise_for_status()
+                resp.raw.decode_content = False
+                reader = HashingReader(resp.raw)
+                with tarfile.open(fileobj=reader, mode='r|gz') as archive:
+                    for member in archive:
+                        if not _is_safe(member, tmp_dir):
+                            raise UnsafeArchiveMemberError(
+                                filename=filename, member=member.name)
+                        archive.extract(member, tmp_dir, **_EXTRACT_OPTIONS)
+                reader.drain()
+            if reader.sha256 != sha256:
+                raise NodeDigestMismatchError(filename=filename,
+                                              sha256=sha256)
+            # the archive contains one folder: node-v<version>-<platform>
+            folder, = os.listdir(tmp_dir)
+            os.rename(os.path.join(tmp_dir, folder), path)
+            log.debug('downloaded %s (%d bytes)', filename, reader.size)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def distribution(self, version):
+        """Path of the distribution, download it if missing.
+
+        :param version: Node.js version i.e. 8.10.0
+        :return: path of the distribution (contains bin, lib, ...)
+        """
+        path = os.path.join(self.cache_dir, version)
+        marker = os.path.join(path, COMPLETE_MARKER)
+        if os.path.isfile(marker):
+            touch(marker)
+            self.hits += 1
+            return path
+        with file_lock(path + '.lock'):
+            if os.path.isfile(marker):
+                # downloaded by a concurrent build
+                self.hits += 1
+                return path
+            self.misses += 1
+            shutil.rmtree(path, ignore_errors=True)
+            try:
+                self._download(version, path)
+                atomic_write(marker, version.encode('utf-8'))
+            except BaseException:
+                shutil.rmtree(path, ignore_errors=True)
+                raise
+        return path
+
+    def create_env(self, version, env_dir):
+        """Create a nodeenv linked to the cached distribution. The bin folder
+        contains symlinks to the executables, the other folders are
+        symlinked.
+
+        :param version: Node.js version i.e. 8.10.0
+        :param env_dir: nodeenv folder (replaced if it exists)
+        """
+        # absolute links, env_dir and cache_dir may be relative
+        dist_dir = os.path.abspath(self.distribution(version))
+        start = time.time()
+        if os.path.islink(env_dir):
+            os.remove(env_dir)
+        shutil.rmtree(env_dir, ignore_errors=True)
+        bin_dir = os.path.join(env_dir, 'bin')
+        makedirs(bin_dir)
+        for name in os.listdir(dist_dir):
+            if name == COMPLETE_MARKER:
+                continue
+            source = os.path.join(dist_dir, name)
+            if name == 'bin':
+                for executable in os.listdir(source):
+                    os.symlink(os.path.join(source, executable),
+                               os.path.join(bin_dir, executable))
+            else:
+                os.symlink(source, os.path.join(env_dir, name))
+        log.debug('linked nodeenv %s in %0.3f s', version, time.time() - start)
+
+    @staticmethod
+    def env(env_dir):
+        """Environment to run node and npm of a nodeenv.
+
+        :param env_dir: nodeenv folder
+        :return: copy of os.environ with the bin folder on the PATH
+        """
+        env = dict(os.environ)
+        env['PATH'] = os.path.join(os.path.abspath(env_dir), 'bin') + \
+            os.pathsep + env.get('PATH', '')
+        return env
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Replace locally built packages in site-packages with precompiled ones."""
+from __future__ import unicode_literals, print_function
+import errno
+import os
+import shutil
+import tarfile
+import tempfile
+
+from gcdt.gcdt_logging import getLogger
+
+from .cache_utils import get_cache_dir, makedirs, touch, file_lock, \
+    remove_file
+from .wheels import install_wheel
+
+
+log = getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024  # 1 GB
+LOCK_SUFFIX = '.lock'
+
+
+class PrecompiledCache(object):
+    """Extracted precompiled packages (lambda-packages tarballs, manylinux
+    wheels), each archive is extracted only once.
+
+    An archive is extracted under a lock file into a temporary folder which
+    is renamed into place. The cache is bounded by max_size (least recently
+    used folders are evicted).
+
+    :param cache_dir: folder for the extracted trees
+    :param max_size: maximum total size in bytes (None for no limit)
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        if cache_dir is None:
+            cache_dir = get_cache_dir('precompiled')
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def extracted(self, key, archive_path):
+        """Folder with the extracted content of an archive.
+
+        :param key: unique name of the archive content, i.e.
+        psycopg2-2.7.1-python3.6
+        :param archive_path: tar.gz of lambda-packages or a wheel
+        :return: path of the folder
+        """
+        path = os.path.join(self.cache_dir, key)
+        if os.path.isdir(path):
+            touch(path)
+            self.hits += 1
+            return path
+        with file_lock(path + LOCK_SUFFIX):
+            if os.path.isdir(path):
+                # extracted by a concurrent process
+                touch(path)
+                self.hits += 1
+                return path
+            self.misses += 1
+            tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+            try:
+                if archive_path.endswith('.whl'):
+                    install_wheel(archive_path, tmp_path)
+                else:
+                    with tarfile.open(archive_path, mode='r:gz') as tar:
+                        tar.extractall(tmp_path)
+                os.rename(tmp_path, path)
+            except BaseException:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+        if self.max_size is not None:
+            self.prune(keep=key)
+        return path
+
+    def entries(self):
+        """List the extracted folders (least recently used first).
+
+        :return: list of (last_used, size, key)
+        """
+        result = []
+        try:
+            keys = os.listdir(self.cache_dir)
+        except OSError:
+            return result
+        for key in keys:
+            path = os.path.join(self.cache_dir, key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            size = 0
+            for dirpath, _, filenames in os.walk(path):
+                for filename in filenames:
+                    try:
+                        size += os.lstat(os.path.join(dirpath,
+                                                      filename)).st_size
+                    except OSError:
+                        pass
+            try:
+                result.append((os.stat(path).st_mtime, size, key))
+            except OSError:
+                continue
+        return sorted(result)
+
+    def prune(self, max_size=None, keep=None):
+        """Evict least recently used folders exceeding max_size (and their
+        lock files).
+
+        :param max_size: size in bytes (default: max_size of the cache)
+        :param keep: key which is not evicted (i.e. the one just extracted)
+        :return: list of removed keys
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for _, size, key in entries:
+            if total <= max_size:
+                break
+            if key == keep:
+                continue
+            path = os.path.join(self.cache_dir, key)
+            with file_lock(path + LOCK_SUFFIX):
+                # moved away first, a folder in place is always complete
+                # (site-packages keeps its hardlinks to the files)
+                tmp_path = tempfile.mkdtemp(dir=self.cache_dir,
+                                            prefix='.tmp-')
+                try:
+                    os.rename(path, os.path.join(tmp_path, key))
+                except OSError:
+                    continue
+                finally:
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+            remove_file(path + LOCK_SUFFIX)
+            total -= size
+            removed.append(key)
+        if removed:
+            log.debug('evicted %d precompiled packages', len(removed))
+        return removed
+
+
+def _link_tree(source, target):
+    # hardlink the files of source into target (copy across devices)
+    for dirpath, dirnames, filenames in os.walk(source):
+        rel_dir = os.path.relpath(dirpath, source)
+        target_dir = os.path.normpath(os.path.join(target, rel_dir))
+        makedirs(target_dir)
+        for filename in filenames:
+            source_file = os.path.join(dirpath, filename)
+            target_file = os.path.join(target_dir, filename)
+            try:
+                os.link(source_file, target_file)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+                shutil.copy2(source_file, target_file)
+
+
+def overlay_tree(source_dir, site_packages):
+    """Replace the top-level entries of site_packages which exist in
+    source_dir (i.e. the package folder and its dist-info).
+
+    The new entry is linked into a temporary sibling and swapped in with a
+    rename, files are hardlinked instead of copied.
+
+    :param source_dir: extracted precompiled package
+    :param site_packages: site-packages folder to update
+    :return: list of replaced top-level names
+    """
+    replaced = []
+    for name in sorted(os.listdir(source_dir)):
+        source = os.path.join(source_dir, name)
+        target = os.path.join(site_packages, name)
+        staging = tempfile.mkdtemp(dir=site_packages, prefix='.overlay-')
+        try:
+            new = os.path.join(staging, 'new')
+            if os.path.isdir(source):
+                _link_tree(source, new)
+            else:
+                try:
+                    os.link(source, new)
+                except OSError:
+                    shutil.copy2(source, new)
+            if os.path.lexists(target):
+                os.rename(target, os.path.join(staging, 'old'))
+            os.rename(new, target)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        replaced.append(name)
+    return replaced
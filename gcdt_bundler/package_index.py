@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Cached access to the PyPI json api (or a mirror providing it)."""
+from __future__ import unicode_literals, print_function
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+from gcdt.gcdt_logging import getLogger
+
+from .cache_utils import get_cache_dir, atomic_write
+
+
+log = getLogger(__name__)
+
+DEFAULT_INDEX_URL = 'https://pypi.python.org/pypi'
+DEFAULT_TTL = 24 * 60 * 60  # seconds
+REQUEST_TIMEOUT = 1.5  # seconds
+
+
+class PackageIndex(object):
+    """Release metadata of packages, cached on disk.
+
+    Cached metadata is used for ttl seconds, afterwards it is revalidated
+    with ETag / Last-Modified. If the index can not be reached, stale
+    metadata is used (also on server errors). In offline mode only cached metadata is used.
+
+    :param index_url: base url of the json api, i.e. https://pypi.org/pypi
+    :param cache_dir: folder for the cached metadata
+    :param ttl: seconds to use cached metadata without revalidation
+    :param offline: never access the network
+    """
+
+    def __init__(self, index_url=None, cache_dir=None, ttl=DEFAULT_TTL,
+                 offline=False):
+        self.index_url = (index_url or DEFAULT_INDEX_URL).rstrip('/')
+        if cache_dir is None:
+            cache_dir = get_cache_dir(
+                'pypi', hashlib.sha256(self.index_url.encode('utf-8'))
+                .hexdigest()[:16])
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.offline = offline
+        self.stats = {'fresh': 0, 'revalidated': 0, 'downloaded': 0,
+                      'stale': 0, 'missing': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, kind):
+        # lookups run on the download threads
+        with self._stats_lock:
+            self.stats[kind] += 1
+
+    def _cache_file(self, package_name):
+        return os.path.join(self.cache_dir, '%s.json' % package_name.lower())
+
+    def _load(self, package_name):
+        try:
+            with open(self._cache_file(package_name), 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _store(self, package_name, cached):
+        atomic_write(self._cache_file(package_name),
+                     json.dumps(cached).encode('utf-8'))
+
+    def get_json(self, package_name, session=None):
+        """Metadata of a package from the json api.
+
+        :param package_name: name of the package
+        :param session: requests session to use
+        :return: dict or None if the package is unknown (or not cached in
+        offline mode)
+        """
+        cached = self._load(package_name)
+        if cached is not None and (
+                self.offline or time.time() - cached['fetched'] < self.ttl):
+            self._count('fresh')
+            return cached['data']
+        if self.offline:
+            log.debug('no cached metadata for \'%s\' (offline)', package_name)
+            self._count('missing')
+            return None
+
+        headers = {}
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        url = '%s/%s/json' % (self.index_url, package_name)
+        try:
+            res = (session or requests).get(url, headers=headers,
+                                            timeout=REQUEST_TIMEOUT)
+            if res.status_code >= 500:
+                # the index is unavailable, same as unreachable
+                res.raise_for_status()
+        except requests.RequestException as e:
+            if cached is None:
+                raise
+            log.debug('using stale metadata for \'%s\': %s', package_name, e)
+            self._count('stale')
+            return cached['data']
+
+        if res.status_code == 304 and cached is not None:
+            self._count('revalidated')
+            cached['fetched'] = time.time()
+        elif res.status_code == 404:
+            self._count('downloaded')
+            cached = {'fetched': time.time(), 'data': None}
+        else:
+            res.raise_for_status()
+            self._count('downloaded')
+            cached = {
+                'fetched': time.time(),
+                'etag': res.headers.get('ETag'),
+                'last_modified': res.headers.get('Last-Modified'),
+                'data': res.json()
+            }
+        self._store(package_name, cached)
+        return cached['data']
+
+    def release_files(self, package_name, package_version, session=None):
+        """Files of a release.
+
+        :return: list of dicts (filename, url, ...) or None if the release
+        is unknown
+        """
+        data = self.get_json(package_name, session)
+        if data is None:
+            return None
+        return data.get('releases', {}).get(package_version)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Fully pinned requirements files (name==version, optional hashes)."""
+from __future__ import unicode_literals, print_function
+import collections
+import hashlib
+import io
+import re
+
+try:
+    from packaging.markers import Marker
+except ImportError:
+    Marker = None
+
+from gcdt import GcdtError
+from gcdt.gcdt_logging import getLogger
+
+from .wheels import target_platform
+
+
+log = getLogger(__name__)
+
+# name[extras]==version
+_PINNED = re.compile(
+    r'^(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[[^\]]*\])?\s*'
+    r'===?\s*(?P<version>[^\s;*,]+)$')
+_HASH = re.compile(r'--hash[=\s]\s*(?P<algorithm>\w+):(?P<digest>[0-9a-fA-F]+)')
+
+PinnedRequirement = collections.namedtuple(
+    'PinnedRequirement', ['name', 'version', 'sha256', 'line'])
+
+
+class RequirementsNotPinnedError(GcdtError):
+    """
+    The requirements file needs to be resolved by pip
+    """
+    fmt = 'Requirement \'{line}\' is not pinned (name==version).'
+
+
+class RequirementHashMismatchError(GcdtError):
+    """
+    The file does not match the hashes of the requirement
+    """
+    fmt = 'sha256 of \'{filename}\' does not match the hashes of ' \
+          '\'{requirement}\'.'
+
+
+def marker_environment(runtime):
+    """Environment markers (PEP 508) of a Lambda runtime.
+
+    :param runtime: AWS Lambda python runtime i.e. python3.6
+    """
+    version = target_platform(runtime)['python_version']
+    python_version = '%s.%s' % (version[0], version[1:])
+    return {
+        'implementation_name': 'cpython',
+        'implementation_version': python_version + '.0',
+        'os_name': 'posix',
+        'platform_machine': 'x86_64',
+        'platform_python_implementation': 'CPython',
+        'platform_release': '',
+        'platform_system': 'Linux',
+        'platform_version': '',
+        'python_full_version': python_version + '.0',
+        'python_version': python_version,
+        'sys_platform': 'linux',
+    }
+
+
+def _logical_lines(f):
+    # join continuation lines and strip comments
+    line = ''
+    for raw in f:
+        raw = raw.rstrip('\r\n')
+        if raw.endswith('\\'):
+            line += raw[:-1] + ' '
+            continue
+        line = (line + raw).split(' #', 1)[0].strip()
+        if line and not line.startswith('#'):
+            yield line
+        line = ''
+    if line.strip():
+        yield line.strip()
+
+
+def parse_pinned_requirements(requirements_file, runtime):
+    """Read a requirements file where every requirement is pinned.
+
+    Requirements with environment markers which do not apply to the runtime
+    are skipped (markers need the 'packaging' package).
+
+    :param requirements_file: path of the requirements file
+    :param runtime: AWS Lambda python runtime i.e. python3.6
+    :return: list of PinnedRequirement
+    :raises RequirementsNotPinnedError: if pip needs to resolve the file
+    (ranges, urls, editables, options like -r or --index-url)
+    """
+    requirements = []
+    environment = marker_environment(runtime)
+    with io.open(requirements_file, encoding='utf-8') as f:
+        for line in _logical_lines(f):
+            hashes = _HASH.findall(line)
+            requirement = _HASH.sub('', line).strip()
+            requirement, _, marker = requirement.partition(';')
+            m = _PINNED.match(requirement.strip())
+            if m is None:
+                raise RequirementsNotPinnedError(line=line)
+            if marker.strip():
+                if Marker is None:
+                    raise RequirementsNotPinnedError(line=line)
+                if not Marker(marker.strip()).evaluate(environment):
+                    log.debug('skipping \'%s\' for %s', line, runtime)
+                    continue
+            requirements.append(PinnedRequirement(
+                m.group('name'), m.group('version'),
+                frozenset(digest.lower() for algorithm, digest in hashes
+                          if algorithm == 'sha256'),
+                line))
+    return requirements
+
+
+def verify_hashes(path, requirement):
+    """Check a downloaded file against the hashes of the requirement.
+
+    :param path: path of the file
+    :param requirement: PinnedRequirement (nothing to check without hashes)
+    :raises RequirementHashMismatchError: if the file does not match
+    """
+    if not requirement.sha256:
+        return
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    if sha256.hexdigest() not in requirement.sha256:
+        raise RequirementHashMismatchError(filename=path,
+                                           requirement=requirement.line)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Poetry installed once per version into a shared virtualenv (outside of
+the project venv)."""
+from __future__ import unicode_literals, print_function
+import os
+import shutil
+import subprocess
+import sys
+
+from gcdt.gcdt_logging import getLogger
+
+from .cache_utils import get_cache_dir, atomic_write, file_lock, touch
+
+
+log = getLogger(__name__)
+
+DEFAULT_POETRY_VERSION = '1.0.2'
+# written into the tool folder once poetry is installed
+COMPLETE_MARKER = '.gcdt-poetry'
+
+
+class PoetryTool(object):
+    """Versioned poetry installation shared by all projects.
+
+    Poetry is installed with pip into its own virtualenv
+    (~/.cache/gcdt-bundler/poetry/<version>) under a lock file, so
+    concurrent builds install it only once.
+
+    :param version: poetry version (default: POETRY_VERSION or 1.0.2)
+    :param cache_dir: folder for the poetry installations
+    """
+
+    def __init__(self, version=None, cache_dir=None):
+        if version is None:
+            version = os.getenv('POETRY_VERSION', DEFAULT_POETRY_VERSION)
+        if cache_dir is None:
+            cache_dir = get_cache_dir('poetry')
+        self.version = version
+        self.cache_dir = cache_dir
+
+    @property
+    def tool_dir(self):
+        return os.path.join(self.cache_dir, self.version)
+
+    def executable(self, create):
+        """Path of the poetry executable, install poetry if missing.
+
+        :param create: function(python, venv_dir) creating a virtualenv
+        :return: path of bin/poetry
+        """
+        poetry_exe = os.path.join(self.tool_dir, 'bin', 'poetry')
+        marker = os.path.join(self.tool_dir, COMPLETE_MARKER)
+        if os.path.isfile(marker):
+            touch(marker)
+            return poetry_exe
+        with file_lock(self.tool_dir + '.lock'):
+            if os.path.isfile(marker):
+                # installed by a concurrent build
+                return poetry_exe
+            log.debug('installing poetry %s into %s', self.version,
+                      self.tool_dir)
+            shutil.rmtree(self.tool_dir, ignore_errors=True)
+            try:
+                create(sys.executable, self.tool_dir)
+                pip_cmd = [os.path.join(self.tool_dir, 'bin', 'python'), '-m',
+                           'pip', 'install', 'poetry==%s' % self.version]
+                if os.getenv('POETRY_PREVIEW') == '1':
+                    pip_cmd.append('--pre')
+                print(subprocess.check_output(pip_cmd,
+                                              stderr=subprocess.STDOUT))
+                atomic_write(marker, self.version.encode('utf-8'))
+            except BaseException:
+                shutil.rmtree(self.tool_dir, ignore_errors=True)
+                raise
+        return poetry_exe
+
+    @staticmethod
+    def env(venv_dir):
+        """Environment to run poetry for the project virtualenv.
+
+        :param venv_dir: virtualenv poetry installs into
+        :return: copy of os.environ with the virtualenv activated
+        """
+        venv_dir = os.path.abspath(venv_dir)
+        env = dict(os.environ)
+        env['VIRTUAL_ENV'] = venv_dir
+        env['PATH'] = os.path.join(venv_dir, 'bin') + os.pathsep + \
+            env.get('PATH', '')
+        env['POETRY_VIRTUALENVS_CREATE'] = 'false'
+        return env
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Leave files which are not needed at runtime out of the bundle."""
+from __future__ import unicode_literals, print_function
+import threading
+
+from gcdt.gcdt_logging import getLogger
+
+
+log = getLogger(__name__)
+
+# packages the Lambda runtime provides already
+RUNTIME_PROVIDED = {
+    'python': frozenset(['boto3', 'botocore', 's3transfer']),
+    'nodejs': frozenset(['aws-sdk']),
+}
+_METADATA_SUFFIXES = ('.dist-info', '.egg-info')
+_INSTALLER_METADATA = frozenset(['RECORD', 'INSTALLER', 'REQUESTED'])
+
+
+def _runtime_family(runtime):
+    # python3.6 => python, nodejs8.10 => nodejs
+    return runtime.rstrip('0123456789.x')
+
+
+def _package_parts(parts):
+    # path elements starting with the package (node_modules are skipped)
+    if parts[0] == 'node_modules' and len(parts) > 2:
+        return parts[1:]
+    return parts
+
+
+def _package_name(parts):
+    # top-level package of a path, metadata folders belong to their package
+    name = _package_parts(parts)[0]
+    if name.endswith(_METADATA_SUFFIXES):
+        name = name.rsplit('.', 1)[0].split('-', 1)[0]
+    return name.lower()
+
+
+def _pycache(runtime, parts):
+    return '__pycache__' in parts[:-1] or \
+        parts[-1].endswith(('.pyc', '.pyo'))
+
+
+def _tests(runtime, parts):
+    # test folders within a package (not top-level packages named test)
+    return any(p in ('tests', 'test') for p in _package_parts(parts)[1:-1])
+
+
+def _docs(runtime, parts):
+    return any(p in ('docs', 'doc') for p in _package_parts(parts)[1:-1])
+
+
+def _installer_metadata(runtime, parts):
+    return len(parts) == 2 and parts[0].endswith(_METADATA_SUFFIXES) and \
+        parts[1] in _INSTALLER_METADATA
+
+
+def _runtime_provided(runtime, parts):
+    provided = RUNTIME_PROVIDED.get(_runtime_family(runtime), ())
+    return _package_name(parts) in provided
+
+
+def is_dependency(folder, arcname):
+    """Check if a bundled file is an installed dependency, only dependencies
+    are pruned (the code of the project is bundled as is).
+
+    :param folder: bundling folder {'source': ,'target': } of the file,
+    add_deps_folder flags the site-packages folder with 'dependencies'
+    :param arcname: name of the file within the bundle
+    """
+    return bool(folder.get('dependencies')) or \
+        arcname.startswith('node_modules/')
+
+
+# rule name => function(runtime, path elements of the arcname)
+PRUNE_RULES = {
+    'pycache': _pycache,
+    'tests': _tests,
+    'docs': _docs,
+    'installer_metadata': _installer_metadata,
+    'runtime_provided': _runtime_provided,
+}
+DEFAULT_PRUNE_RULES = {
+    'python': ['pycache', 'tests', 'docs', 'installer_metadata',
+               'runtime_provided'],
+    'nodejs': ['tests', 'docs', 'runtime_provided'],
+}
+
+
+class Pruner(object):
+    """Decide which files to leave out of the bundle and count the bytes
+    saved per rule.
+
+    :param runtime: AWS Lambda runtime i.e. python3.6
+    :param rules: list of rule names (default: rules of the runtime)
+    :param keep: list of packages which are never pruned (i.e. packages
+    reading their own metadata or a newer boto3)
+    """
+
+    def __init__(self, runtime='python2.7', rules=None, keep=None):
+        if rules is None:
+            rules = DEFAULT_PRUNE_RULES.get(_runtime_family(runtime), [])
+        unknown = [rule for rule in rules if rule not in PRUNE_RULES]
+        if unknown:
+            raise ValueError('Unknown prune rules: %s' % ', '.join(unknown))
+        self.runtime = runtime
+        self.rules = list(rules)
+        self.keep = frozenset(name.lower() for name in keep or [])
+        self.stats = dict((rule, [0, 0]) for rule in self.rules)
+        self._lock = threading.Lock()
+
+    def match(self, arcname):
+        """Name of the first rule pruning arcname or None.
+
+        :param arcname: name of the file within the bundle
+        """
+        parts = arcname.split('/')
+        if self.keep and _package_name(parts) in self.keep:
+            return None
+        for rule in self.rules:
+            if PRUNE_RULES[rule](self.runtime, parts):
+                return rule
+        return None
+
+    def keep_file(self, arcname, size=None):
+        """Check if a file is bundled, pruned files are counted.
+
+        :param arcname: name of the file within the bundle
+        :param size: uncompressed size of the file (or a function returning
+        it, only called for pruned files)
+        :return: False if the file is pruned
+        """
+        rule = self.match(arcname)
+        if rule is None:
+            return True
+        if callable(size):
+            size = size()
+        with self._lock:
+            self.stats[rule][0] += 1
+            self.stats[rule][1] += size or 0
+        return False
+
+    def log_stats(self):
+        """Log the number of files and bytes saved per rule."""
+        total = sum(size for _, size in self.stats.values())
+        log.info('pruned %d files (%0.2f MB) from the bundle',
+                 sum(files for files, _ in self.stats.values()),
+                 total / 1000000.0)
+        for rule in self.rules:
+            files, size = self.stats[rule]
+            if files:
+                log.info('prune rule \'%s\': %d files, %0.2f MB', rule, files,
+                         size / 1000000.0)
@@ -1,29 +1,38 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 import os
-import sys
-import tarfile
-import urllib2
-
 import subprocess
 import shutil
-import zipfile
+import threading
 import tempfile
-import time
+from multiprocessing.pool import ThreadPool
 
 from gcdt import gcdt_signals, GcdtError
 from gcdt.gcdt_logging import getLogger
-from gcdt.utils import GracefulExit
-import pip._internal.utils.misc
 import requests
 from tqdm import tqdm
 from lambda_packages import lambda_packages as lambda_packages_orig
 
+from .package_index import PackageIndex
+from .wheel_cache import WheelCache
+from .wheels import download_wheels, install_wheels, install_wheel, \
+    select_wheel, LAMBDA_PLATFORM
+from .pinned import parse_pinned_requirements, verify_hashes
+from .overlay import PrecompiledCache, overlay_tree
+from .dist_index import DistributionIndex, normalize_name
+from .poetry_tool import PoetryTool
+from .cache_utils import makedirs
+
 log = getLogger(__name__)
-# We lower-case lambda package keys to match lower-cased keys in get_installed_packages()
-lambda_packages = {package_name.lower():val for package_name, val in
+# We normalize lambda package keys to match the normalized keys in get_installed_packages()
+lambda_packages = {normalize_name(package_name): val for package_name, val in
                    lambda_packages_orig.items()}
 
+DEFAULT_DOWNLOAD_WORKERS = 8
+_thread_local = threading.local()
+# DistributionIndex per (site_packages, site_packages_64)
+_dist_indexes = {}
+
 
 class VirtualenvError(GcdtError):
     """
@@ -46,9 +55,14 @@ class PoetryDependencyInstallationError(GcdtError):
     fmt = 'Unable to install python dependencies with poetry for your AWS Lambda function.'
 
 
-def _site_packages_dir_in_venv(venv_dir):
-    python_dir = os.listdir(os.path.join(venv_dir, 'lib'))[0]
-    deps_dir = os.path.join(venv_dir, 'lib', python_dir, 'site-packages')
+def _site_packages_dir_in_venv(venv_dir, runtime=None, lib='lib'):
+    # lib/<runtime>/site-packages of the Lambda runtime (if it exists),
+    # otherwise the first python folder of the venv
+    if runtime and os.path.isdir(os.path.join(venv_dir, 'lib', runtime)):
+        python_dir = runtime
+    else:
+        python_dir = os.listdir(os.path.join(venv_dir, 'lib'))[0]
+    deps_dir = os.path.join(venv_dir, lib, python_dir, 'site-packages')
     return deps_dir
 
 
@@ -56,19 +70,15 @@ def _site_packages_dir_in_venv(venv_dir):
 # https://github.com/Miserlou/lambda-packages
 def _get_installed_packages(site_packages, site_packages_64):
     """
-    Returns a dict of installed packages we care about.
+    Returns a dict of installed packages we care about (normalized name =>
+    version), read from the metadata in the site-packages folders of the
+    target venv.
     """
-    package_to_keep = []
-    if os.path.isdir(site_packages):
-        package_to_keep += os.listdir(site_packages)
-    if os.path.isdir(site_packages_64):
-        package_to_keep += os.listdir(site_packages_64)
-
-    installed_packages = {package.project_name.lower(): package.version for package in
-                          pip._internal.utils.misc.get_installed_distributions() if package.project_name in package_to_keep or
-                          package.location in [site_packages, site_packages_64]}
-
-    return installed_packages
+    key = (site_packages, site_packages_64)
+    if key not in _dist_indexes:
+        _dist_indexes[key] = DistributionIndex(site_packages,
+                                               site_packages_64)
+    return _dist_indexes[key].versions()
 
 
 def _have_correct_lambda_package_version(runtime, package_name, package_version):
@@ -89,39 +99,56 @@ def _have_correct_lambda_package_version(runtime, package_name, package_version)
     return True
 
 
-def _extract_lambda_package(runtime, package_name, path):
+def _extract_lambda_package(runtime, package_name, path,
+                            precompiled_cache=None):
     """
     Extracts the lambda package into a given path. Assumes the package exists in lambda packages.
+    The package is extracted once into the precompiled cache and linked into
+    path (replacing the local version).
     """
     lambda_package = lambda_packages[package_name][runtime]
+    if precompiled_cache is None:
+        precompiled_cache = PrecompiledCache()
+    extracted = precompiled_cache.extracted(
+        '%s-%s-%s' % (package_name, lambda_package['version'], runtime),
+        lambda_package['path'])
+    overlay_tree(extracted, path)
+
 
-    # Trash the local version to help with package space saving
-    shutil.rmtree(os.path.join(path, package_name), ignore_errors=True)
+def _get_session():
+    # one requests session (connection pool) per download thread
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        session = _thread_local.session = requests.Session()
+    return session
 
-    tar = tarfile.open(lambda_package['path'], mode="r:gz")
-    for member in tar.getmembers():
-        tar.extract(member, path)
+
+def _get_manylinux_wheel_file(runtime, package_name, package_version,
+                              session=None, package_index=None):
+    """
+    For a given package name, returns the release file info of the manylinux
+    wheel (filename, url, digests, ...), else returns None.
+    """
+    if package_index is None:
+        package_index = PackageIndex()
+    for f in package_index.release_files(package_name, package_version,
+                                         session) or []:
+        if f['filename'].endswith(_get_manylinux_wheel_file_suffix(runtime)):
+            return f
+    return None
 
 
-def _get_manylinux_wheel_url(runtime, package_name, package_version):
+def _get_manylinux_wheel_url(runtime, package_name, package_version,
+                             session=None, package_index=None):
     """
     For a given package name, returns a link to the download URL,
     else returns None.
     Related: https://github.com/Miserlou/Zappa/issues/398
     Examples here: https://gist.github.com/perrygeo/9545f94eaddec18a65fd7b56880adbae
     """
-    url = 'https://pypi.python.org/pypi/{}/json'.format(package_name)
-    try:
-        res = requests.get(url, timeout=1.5)
-        data = res.json()
-        for f in data['releases'][package_version]:
-            if f['filename'].endswith(_get_manylinux_wheel_file_suffix(runtime)):
-                return f['url']
-    except GracefulExit:
-        raise
-    except Exception as e:
-        raise
-    return None
+    wheel = _get_manylinux_wheel_file(runtime, package_name, package_version,
+                                      session, package_index)
+    return wheel['url'] if wheel else None
 
 
 def _get_manylinux_wheel_file_suffix(runtime):
@@ -131,54 +158,80 @@ def _get_manylinux_wheel_file_suffix(runtime):
         return 'cp36m-manylinux1_x86_64.whl'
 
 
-def _download_url_with_progress(url, stream):
+class _DownloadProgress(object):
+    # one progress bar for concurrent downloads
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._progress = tqdm(unit='B', unit_scale=True, total=0)
+
+    def add_total(self, size):
+        with self._lock:
+            self._progress.total += size
+            self._progress.refresh()
+
+    def update(self, size):
+        with self._lock:
+            self._progress.update(size)
+
+    def close(self):
+        self._progress.close()
+
+
+def _download_url_with_progress(url, stream, session=None, progress=None):
     """
     Downloads a given url in chunks and writes to the provided stream (can be any io stream).
     Displays the progress bar for the download.
     """
-    resp = requests.get(url, timeout=2, stream=True)
+    resp = (session or requests).get(url, timeout=2, stream=True)
     resp.raw.decode_content = True
 
-    progress = tqdm(unit='B', unit_scale=True, total=int(resp.headers.get('Content-Length', 0)))
-    for chunk in resp.iter_content(chunk_size=1024):
+    size = int(resp.headers.get('Content-Length', 0))
+    if progress is None:
+        bar = tqdm(unit='B', unit_scale=True, total=size)
+    else:
+        bar = progress
+        bar.add_total(size)
+    for chunk in resp.iter_content(chunk_size=64 * 1024):
         if chunk:
-            progress.update(len(chunk))
+            bar.update(len(chunk))
             stream.write(chunk)
 
-    progress.close()
+    if progress is None:
+        bar.close()
 
 
-def _get_cached_manylinux_wheel(runtime, package_name, package_version):
+def _get_cached_manylinux_wheel(runtime, package_name, package_version,
+                                session=None, progress=None,
+                                package_index=None, wheel_cache=None):
     """
     Gets the locally stored version of a manylinux wheel. If one does not exist, the function downloads it.
     """
-    cached_wheels_dir = os.path.join(tempfile.gettempdir(), 'cached_wheels')
-    if not os.path.isdir(cached_wheels_dir):
-        os.makedirs(cached_wheels_dir)
-
+    if wheel_cache is None:
+        wheel_cache = WheelCache()
     wheel_file = '{0!s}-{1!s}-{2!s}'.format(package_name, package_version,
                                             _get_manylinux_wheel_file_suffix(runtime))
-    wheel_path = os.path.join(cached_wheels_dir, wheel_file)
+    wheel_path = wheel_cache.get(wheel_file)
 
-    if not os.path.exists(wheel_path):
+    if wheel_path is None:
         # The file is not cached, download it.
-        wheel_url = _get_manylinux_wheel_url(runtime, package_name, package_version)
-        if not wheel_url:
+        wheel = _get_manylinux_wheel_file(runtime, package_name,
+                                          package_version, session,
+                                          package_index)
+        if not wheel:
             return None
 
         print(" - {}=={}: Downloading".format(package_name, package_version))
-        with open(wheel_path, 'wb') as f:
-            _download_url_with_progress(wheel_url, f)
+        wheel_path = wheel_cache.fetch(
+            wheel_file,
+            lambda f: _download_url_with_progress(wheel['url'], f, session,
+                                                  progress),
+            sha256=wheel.get('digests', {}).get('sha256'))
     else:
         print(" - {}=={}: Using locally cached manylinux wheel".format(package_name, package_version))
 
     return wheel_path
 
 
-def _get_venv_from_python_version():
-    return 'python' + str(sys.version_info[0]) + '.' + str(sys.version_info[1])
-
-
 def _have_any_lambda_package_version(runtime, package_name):
     """
     Checks if a given package has any lambda package version. We can try and use it with a warning.
@@ -198,65 +251,124 @@ def add_deps_folder(folders, venv_dir):
     deps_dir_missing = True
     for folder in folders:
         if folder['source'] == deps_dir:
+            # the prune rules apply to dependencies only
+            folder['dependencies'] = True
             deps_dir_missing = False
             break
     if deps_dir_missing:
         # add missing deps_dir to folders
         deps_path = {
             'source': deps_dir,
-            'target': ''
+            'target': '',
+            'dependencies': True
         }
         folders.append(deps_path)
 
 
-def install_precompiled_packages(venv_dir, runtime):
+def _fetch_manylinux_wheels(runtime, packages,
+                            workers=DEFAULT_DOWNLOAD_WORKERS,
+                            package_index=None, wheel_cache=None):
+    """Look up and download the manylinux wheels of the packages
+    concurrently (one connection pool per thread, one progress bar).
+
+    :param runtime: AWS Lambda python runtime
+    :param packages: list of (package_name, package_version)
+    :param workers: maximum number of concurrent requests
+    :param package_index: PackageIndex for the release metadata
+    :param wheel_cache: WheelCache for the downloaded wheels
+    :return: dict package_name => wheel path (None if there is no wheel)
+    """
+    if not packages:
+        return {}
+    if package_index is None:
+        package_index = PackageIndex()
+    if wheel_cache is None:
+        wheel_cache = WheelCache()
+    progress = _DownloadProgress()
+
+    def _fetch(package):
+        package_name, package_version = package
+        return package_name, _get_cached_manylinux_wheel(
+            runtime, package_name, package_version, _get_session(), progress,
+            package_index, wheel_cache)
+
+    pool = ThreadPool(max(1, min(workers, len(packages))))
+    try:
+        return dict(pool.imap(_fetch, packages))
+    finally:
+        pool.terminate()
+        pool.join()
+        progress.close()
+        log.debug('wheel cache: %d hits, %d misses', wheel_cache.hits,
+                  wheel_cache.misses)
+
+
+def install_precompiled_packages(venv_dir, runtime,
+                                 workers=DEFAULT_DOWNLOAD_WORKERS,
+                                 package_index=None, wheel_cache=None,
+                                 precompiled_cache=None):
     """
     Check if we need to replace any of the installed packages with a precompiled
     package.
-    
-    :param runtime: 
-    :return: 
+
+    Wheels are looked up and downloaded concurrently. The precompiled
+    packages are extracted once into the precompiled cache and replace the
+    locally built packages in site-packages (hardlinked, one by one sorted
+    by name).
+
+    :param runtime: AWS Lambda python runtime
+    :param workers: maximum number of concurrent downloads
+    :param package_index: PackageIndex for the release metadata
+    :param wheel_cache: WheelCache for the downloaded wheels
+    :param precompiled_cache: PrecompiledCache for the extracted packages
+    :return:
     """
-    site_packages = os.path.join(venv_dir, 'lib', _get_venv_from_python_version(), 'site-packages')
-    site_packages_64 = os.path.join(venv_dir, 'lib64', _get_venv_from_python_version(), 'site-packages')
+    site_packages = _site_packages_dir_in_venv(venv_dir, runtime)
+    site_packages_64 = _site_packages_dir_in_venv(venv_dir, runtime, 'lib64')
+    if precompiled_cache is None:
+        precompiled_cache = PrecompiledCache()
 
     # Then the pre-compiled packages..
     print("Downloading and installing dependencies..")
-    installed_packages = _get_installed_packages(site_packages, site_packages_64)
-    temp_project_path = os.path.join(tempfile.gettempdir(), str(int(time.time())))
-
-    try:
-        for installed_package_name, installed_package_version in installed_packages.items():
-            if _have_correct_lambda_package_version(runtime, installed_package_name, installed_package_version):
-                print(" - %s==%s: Using precompiled lambda package " % (installed_package_name, installed_package_version,))
-                _extract_lambda_package(runtime, installed_package_name, temp_project_path)
-            else:
-                cached_wheel_path = _get_cached_manylinux_wheel(
-                    runtime, installed_package_name, installed_package_version)
-                if cached_wheel_path:
-                    # Otherwise try to use manylinux packages from PyPi..
-                    # Related: https://github.com/Miserlou/Zappa/issues/398
-                    shutil.rmtree(os.path.join(temp_project_path, installed_package_name), ignore_errors=True)
-                    with zipfile.ZipFile(cached_wheel_path) as zfile:
-                        zfile.extractall(temp_project_path)
-
-                elif _have_any_lambda_package_version(
-                        runtime, installed_package_name):
-                    # Finally see if we may have at least one version of the package in lambda packages
-                    # Related: https://github.com/Miserlou/Zappa/issues/855
-                    lambda_version = lambda_packages[installed_package_name][runtime]['version']
-                    print(" - %s==%s: Warning! Using precompiled lambda package version %s instead!" % (installed_package_name, installed_package_version, lambda_version, ))
-                    _extract_lambda_package(runtime, installed_package_name, temp_project_path)
-
-    except GracefulExit:
-        raise
-    except Exception as e:
-        raise
-        # XXX - What should we do here?
+    installed_packages = sorted(
+        _get_installed_packages(site_packages, site_packages_64).items())
+
+    wheels = _fetch_manylinux_wheels(
+        runtime,
+        [(name, version) for name, version in installed_packages
+         if not _have_correct_lambda_package_version(runtime, name,
+                                                     version)],
+        workers, package_index, wheel_cache)
+    for installed_package_name, installed_package_version in installed_packages:
+        if _have_correct_lambda_package_version(runtime, installed_package_name, installed_package_version):
+            print(" - %s==%s: Using precompiled lambda package " % (installed_package_name, installed_package_version,))
+            _extract_lambda_package(runtime, installed_package_name,
+                                    site_packages, precompiled_cache)
+        else:
+            cached_wheel_path = wheels.get(installed_package_name)
+            if cached_wheel_path:
+                # Otherwise try to use manylinux packages from PyPi..
+                # Related: https://github.com/Miserlou/Zappa/issues/398
+                overlay_tree(precompiled_cache.extracted(
+                    os.path.basename(cached_wheel_path)[:-len('.whl')],
+                    cached_wheel_path), site_packages)
+
+            elif _have_any_lambda_package_version(
+                    runtime, installed_package_name):
+                # Finally see if we may have at least one version of the package in lambda packages
+                # Related: https://github.com/Miserlou/Zappa/issues/855
+                lambda_version = lambda_packages[installed_package_name][runtime]['version']
+                print(" - %s==%s: Warning! Using precompiled lambda package version %s instead!" % (installed_package_name, installed_package_version, lambda_version, ))
+                _extract_lambda_package(runtime, installed_package_name,
+                                        site_packages, precompiled_cache)
+    log.debug('precompiled packages: %d extracted, %d reused',
+              precompiled_cache.misses, precompiled_cache.hits)
 
 
 def install_dependencies_with_pip(requirements_file, runtime, venv_dir,
-                                  keep=False):
+                                  keep=False, deps_cache=None,
+                                  package_index=None, wheel_cache=None,
+                                  venv_templates=None, precompiled_cache=None):
     """installs dependencies from a pip requirements_file to a local
     destination_folder
 
@@ -265,11 +377,24 @@ def install_dependencies_with_pip(requirements_file, runtime, venv_dir,
     :param venv_dir: a foldername relative to the current working
     directory
     :param keep: keep / cache installed packages
+    :param deps_cache: DepsCache to restore the installed packages if the
+    requirements_file did not change
+    :param package_index: PackageIndex to look up manylinux wheels
+    :param wheel_cache: WheelCache for the downloaded wheels
+    :param venv_templates: VenvTemplates to clone the virtualenv from
+    :param precompiled_cache: PrecompiledCache for the extracted packages
     """
     if not os.path.isfile(requirements_file):
         return  # 0
 
-    _prepare_virtualenv(runtime, venv_dir, keep)
+    if deps_cache is not None:
+        key = deps_cache.key([requirements_file], runtime)
+        if deps_cache.restore(key, _cached_site_packages_dir(runtime,
+                                                             venv_dir),
+                              replace=venv_dir):
+            return
+
+    _prepare_virtualenv(runtime, venv_dir, keep, venv_templates)
 
     try:
         python_exe = _venv_binary(venv_dir)
@@ -284,69 +409,329 @@ def install_dependencies_with_pip(requirements_file, runtime, venv_dir,
         log.debug('following error: %s' % e.output)
         raise PipDependencyInstallationError()
 
-    install_precompiled_packages(venv_dir, runtime)
+    install_precompiled_packages(venv_dir, runtime,
+                                 package_index=package_index,
+                                 wheel_cache=wheel_cache,
+                                 precompiled_cache=precompiled_cache)
+    if deps_cache is not None:
+        deps_cache.store(key, _site_packages_dir_in_venv(venv_dir),
+                         runtime=runtime, lockfile=requirements_file)
+
+
+def install_dependencies_from_wheels(requirements_file, runtime, venv_dir,
+                                     deps_cache=None):
+    """installs dependencies from a pip requirements_file without a
+    virtualenv: wheels for the Lambda platform are downloaded with
+    'pip download' and unpacked into the site-packages folder of venv_dir
+    (so add_deps_folder works the same way).
+
+    All dependencies need to be available as wheels (manylinux1 or pure
+    python).
+
+    :param requirements_file: path to valid requirements_file
+    :param runtime: AWS Lambda python runtime version to prepare
+    :param venv_dir: a foldername relative to the current working
+    directory
+    :param deps_cache: DepsCache to restore the installed packages if the
+    requirements_file did not change
+    """
+    if not os.path.isfile(requirements_file):
+        return  # 0
+
+    if deps_cache is not None:
+        # unpacked wheels, not the tree of the virtualenv installer
+        key = deps_cache.key([requirements_file], runtime, variant='unpacked')
+    site_packages = _cached_site_packages_dir(runtime, venv_dir)
+    if deps_cache is not None and deps_cache.restore(key, site_packages,
+                                                     replace=venv_dir):
+        return
+    shutil.rmtree(venv_dir, ignore_errors=True)
+
+    download_dir = tempfile.mkdtemp(prefix='gcdt-wheels-')
+    try:
+        wheel_paths = download_wheels(requirements_file, runtime,
+                                      download_dir)
+        count = install_wheels(wheel_paths, site_packages)
+        log.debug('unpacked %d files from %d wheels', count,
+                  len(wheel_paths))
+    except subprocess.CalledProcessError as e:
+        log.debug('Running command: %s resulted in the ' % e.cmd)
+        log.debug('following error: %s' % e.output)
+        raise PipDependencyInstallationError()
+    finally:
+        shutil.rmtree(download_dir, ignore_errors=True)
+
+    if deps_cache is not None:
+        deps_cache.store(key, site_packages, runtime=runtime,
+                         lockfile=requirements_file)
+
+
+def install_dependencies_pinned(requirements_file, runtime, venv_dir,
+                                deps_cache=None, package_index=None,
+                                wheel_cache=None,
+                                workers=DEFAULT_DOWNLOAD_WORKERS):
+    """installs a fully pinned requirements_file (name==version, i.e. from
+    pip freeze or poetry export) without resolving it: the wheels for the
+    Lambda platform are downloaded concurrently, verified against the
+    hashes of the requirements and the index and unpacked in parallel into
+    the site-packages folder of venv_dir. Only requirements without a
+    compatible wheel (sdists) are installed with pip.
+
+    :param requirements_file: path to valid requirements_file
+    :param runtime: AWS Lambda python runtime version to prepare
+    :param venv_dir: a foldername relative to the current working
+    directory
+    :param deps_cache: DepsCache to restore the installed packages if the
+    requirements_file did not change
+    :param package_index: PackageIndex for the release files
+    :param wheel_cache: WheelCache for the downloaded wheels
+    :param workers: maximum number of concurrent downloads and unpacks
+    :raises RequirementsNotPinnedError: if pip needs to resolve the file
+    """
+    if not os.path.isfile(requirements_file):
+        return  # 0
+
+    requirements = parse_pinned_requirements(requirements_file, runtime)
+    if deps_cache is not None:
+        key = deps_cache.key([requirements_file], runtime, variant='pinned')
+    site_packages = _cached_site_packages_dir(runtime, venv_dir)
+    if deps_cache is not None and deps_cache.restore(key, site_packages,
+                                                     replace=venv_dir):
+        return
+    shutil.rmtree(venv_dir, ignore_errors=True)
+
+    if package_index is None:
+        package_index = PackageIndex()
+    if wheel_cache is None:
+        wheel_cache = WheelCache()
+    progress = _DownloadProgress()
+
+    def _fetch(requirement):
+        session = _get_session()
+        wheel = select_wheel(package_index.release_files(
+            requirement.name, requirement.version, session), runtime)
+        if wheel is None:
+            return requirement, None
+        wheel_path = wheel_cache.fetch(
+            wheel['filename'],
+            lambda f: _download_url_with_progress(wheel['url'], f, session,
+                                                  progress),
+            sha256=wheel.get('digests', {}).get('sha256'))
+        verify_hashes(wheel_path, requirement)
+        return requirement, wheel_path
+
+    makedirs(site_packages)
+    pool = ThreadPool(max(1, min(workers, len(requirements))))
+    try:
+        fetched = pool.map(_fetch, requirements)
+        wheel_paths = [path for _, path in fetched if path]
+        count = sum(pool.map(lambda path: len(install_wheel(path,
+                                                            site_packages)),
+                             wheel_paths))
+    finally:
+        pool.terminate()
+        pool.join()
+        progress.close()
+    log.debug('unpacked %d files from %d wheels', count, len(wheel_paths))
+
+    sdists = [requirement for requirement, path in fetched if not path]
+    if sdists:
+        _install_sdists_with_pip(sdists, runtime, site_packages)
+
+    if deps_cache is not None:
+        deps_cache.store(key, site_packages, runtime=runtime,
+                         lockfile=requirements_file)
+
+
+def _install_sdists_with_pip(requirements, runtime, site_packages):
+    # build and install requirements without a wheel for the platform with
+    # the interpreter of the runtime (pip checks the hashes)
+    log.info('installing %s with pip (no wheel for %s)',
+             ', '.join(r.name for r in requirements), runtime)
+    fd, requirements_file = tempfile.mkstemp(prefix='gcdt-sdists-',
+                                             suffix='.txt')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(''.join(r.line + '\n' for r in requirements).encode(
+                'utf-8'))
+        pip_cmd = [runtime, '-m', 'pip', 'install', '--no-deps',
+                   '--target', site_packages, '-r', requirements_file]
+        print(subprocess.check_output(pip_cmd, stderr=subprocess.STDOUT))
+    except subprocess.CalledProcessError as e:
+        log.debug('Running command: %s resulted in the ' % e.cmd)
+        log.debug('following error: %s' % e.output)
+        raise PipDependencyInstallationError()
+    finally:
+        os.remove(requirements_file)
+
+
+def download_dependency_wheels(requirements_file, runtime, venv_dir,
+                               deps_cache=None):
+    """downloads the wheels of a pip requirements_file for the Lambda
+    platform into <venv_dir>/wheels without installing them (the members
+    are copied into the bundle as they are, see make_zip_file).
+
+    :param requirements_file: path to valid requirements_file
+    :param runtime: AWS Lambda python runtime version to prepare
+    :param venv_dir: a foldername relative to the current working
+    directory
+    :param deps_cache: DepsCache to restore the wheels if the
+    requirements_file did not change
+    :return: sorted list of wheel paths
+    """
+    if not os.path.isfile(requirements_file):
+        return []
+
+    wheels_dir = os.path.join(venv_dir, 'wheels')
+    if deps_cache is not None:
+        key = deps_cache.key([requirements_file], runtime,
+                             platform=LAMBDA_PLATFORM, variant='wheels')
+        if deps_cache.restore(key, wheels_dir):
+            return sorted(os.path.join(wheels_dir, f)
+                          for f in os.listdir(wheels_dir)
+                          if f.endswith('.whl'))
+
+    shutil.rmtree(wheels_dir, ignore_errors=True)
+    try:
+        wheel_paths = download_wheels(requirements_file, runtime, wheels_dir)
+    except subprocess.CalledProcessError as e:
+        log.debug('Running command: %s resulted in the ' % e.cmd)
+        log.debug('following error: %s' % e.output)
+        raise PipDependencyInstallationError()
+
+    if deps_cache is not None:
+        deps_cache.store(key, wheels_dir, runtime=runtime,
+                         lockfile=requirements_file)
+    return wheel_paths
+
+
+def install_dependencies_with_poetry(runtime, venv_dir, keep=False,
+                                     deps_cache=None, package_index=None,
+                                     wheel_cache=None, venv_templates=None,
+                                     poetry_tool=None, precompiled_cache=None):
+    """installs the dependencies of a poetry project (pyproject.toml).
 
+    With a poetry.lock the locked dependencies are exported to pinned
+    requirements and installed with pip (no poetry resolution, no dev
+    dependencies), otherwise 'poetry install' runs for the virtualenv.
 
-def install_dependencies_with_poetry(runtime, venv_dir, keep=False):
-    _prepare_virtualenv(runtime, venv_dir, keep)
+    :param runtime: AWS Lambda python runtime version to prepare
+    :param venv_dir: a foldername relative to the current working
+    directory
+    :param keep: keep / cache installed packages
+    :param deps_cache: DepsCache to restore the installed packages if the
+    lock file did not change
+    :param package_index: PackageIndex to look up manylinux wheels
+    :param wheel_cache: WheelCache for the downloaded wheels
+    :param venv_templates: VenvTemplates to clone the virtualenv from
+    :param poetry_tool: PoetryTool providing the poetry executable
+    :param precompiled_cache: PrecompiledCache for the extracted packages
+    """
+    if os.path.isfile('poetry.lock'):
+        requirements_file = export_poetry_requirements(venv_dir, poetry_tool)
+        install_dependencies_with_pip(requirements_file, runtime, venv_dir,
+                                      keep, deps_cache=deps_cache,
+                                      package_index=package_index,
+                                      wheel_cache=wheel_cache,
+                                      venv_templates=venv_templates,
+                                      precompiled_cache=precompiled_cache)
+        return
+
+    if deps_cache is not None:
+        lockfiles = [f for f in ['pyproject.toml', 'poetry.lock']
+                     if os.path.isfile(f)]
+        key = deps_cache.key(lockfiles, runtime)
+        if deps_cache.restore(key, _cached_site_packages_dir(runtime,
+                                                             venv_dir),
+                              replace=venv_dir):
+            return
+
+    _prepare_virtualenv(runtime, venv_dir, keep, venv_templates)
+
+    poetry_exe = _prepare_poetry(poetry_tool)
+
+    try:
+        print(subprocess.check_output([poetry_exe, 'install'],
+                                      stderr=subprocess.STDOUT,
+                                      env=PoetryTool.env(venv_dir)))
+    except subprocess.CalledProcessError as e:
+        log.info('Running command: %s resulted in the ' % e.cmd)
+        log.info('following error: %s' % e.output)
+        raise PoetryDependencyInstallationError()
 
-    poetry_exe = _prepare_poetry(venv_dir)
+    install_precompiled_packages(venv_dir, runtime,
+                                 package_index=package_index,
+                                 wheel_cache=wheel_cache,
+                                 precompiled_cache=precompiled_cache)
+    if deps_cache is not None:
+        deps_cache.store(key, _site_packages_dir_in_venv(venv_dir),
+                         runtime=runtime, lockfile=', '.join(lockfiles))
 
+
+def export_poetry_requirements(venv_dir, poetry_tool=None):
+    """Export poetry.lock to a pinned requirements file with the hashes of
+    the lock file (next to venv_dir, the venv is replaced by the
+    installers).
+
+    :param venv_dir: a foldername relative to the current working
+    directory
+    :param poetry_tool: PoetryTool providing the poetry executable
+    :return: path of the requirements file
+    """
+    requirements_file = os.path.join(
+        os.path.dirname(os.path.abspath(venv_dir)), 'poetry-requirements.txt')
+    makedirs(os.path.dirname(requirements_file))
+    poetry_exe = _prepare_poetry(poetry_tool)
     try:
-        new_path = venv_dir + '/bin:' + os.getenv('PATH')
-        env = {'VIRTUAL_ENV': venv_dir, 'PATH': new_path}
-        os.environ['POETRY_VIRTUALENVS_CREATE'] = False
-        print(subprocess.check_output([poetry_exe, 'install'], stderr=subprocess.STDOUT, env=env))
+        print(subprocess.check_output(
+            [poetry_exe, 'export', '-f', 'requirements.txt',
+             '-o', requirements_file],
+            stderr=subprocess.STDOUT))
     except subprocess.CalledProcessError as e:
         log.info('Running command: %s resulted in the ' % e.cmd)
         log.info('following error: %s' % e.output)
         raise PoetryDependencyInstallationError()
+    return requirements_file
 
-    install_precompiled_packages(venv_dir, runtime)
 
+def _cached_site_packages_dir(runtime, venv_dir):
+    # site-packages folder for dependencies restored from the cache (on a hit
+    # the venv is replaced by the site-packages folder only)
+    return os.path.join(venv_dir, 'lib', runtime, 'site-packages')
 
-def _prepare_virtualenv(runtime, venv_dir, keep):
+
+def _prepare_virtualenv(runtime, venv_dir, keep, venv_templates=None):
     # prepare virtualenv for pip installation if missing or keep == False
-    if not os.path.exists(venv_dir) or keep is False:
+    # (a venv restored from the dependency cache has no python binary)
+    if not os.path.exists(venv_dir) or keep is False or \
+            not os.path.isfile(_venv_binary(venv_dir)):
         log.debug('creating fresh virtualenv in %s', venv_dir)
         shutil.rmtree(venv_dir, ignore_errors=True)
-        try:
-            # in order to intermix gcdt and AWS Lambda venvs and runtimes
-            # we install virtualenv via subprocess so we can use the '-p' option
-            venv_cmd = ['virtualenv', venv_dir, '-p', runtime]
-            print(subprocess.check_output(venv_cmd, stderr=subprocess.STDOUT))
-        except subprocess.CalledProcessError as e:
-            log.debug('Running command: %s resulted in the ' % e.cmd)
-            log.debug('following error: %s' % e.output)
-            raise VirtualenvError()
+        if venv_templates is not None:
+            venv_templates.clone(runtime, venv_dir, _create_virtualenv)
+        else:
+            _create_virtualenv(runtime, venv_dir)
     else:
         log.debug('reusing virtualenv due to \'--keep\' option')
 
 
-def _prepare_poetry(venv_dir):
-    python_exe = _venv_binary(venv_dir)
-    poetry_exe = _venv_binary(venv_dir, 'poetry')
-    get_poetry_py = 'get-poetry.py'
-    poetry_version = os.getenv('POETRY_VERSION', '1.0.2')
-
-    if os.path.isfile(poetry_exe):
-        return poetry_exe
-
-
-    poetry_install_script = 'https://raw.githubusercontent.com/python-poetry/poetry/{}/get-poetry.py'.format(poetry_version)
-    with open(get_poetry_py, 'w') as f:
-        f.write(urllib2.urlopen(poetry_install_script).read())
-
-    install_poetry_cmd = [python_exe, get_poetry_py, '--version', poetry_version]
-
-    if os.getenv('POETRY_PREVIEW') == '1':
-        install_poetry_cmd.append('--preview')
-
-    print(subprocess.check_output(install_poetry_cmd, stderr=subprocess.STDOUT))
+def _create_virtualenv(runtime, venv_dir):
+    try:
+        # in order to intermix gcdt and AWS Lambda venvs and runtimes
+        # we install virtualenv via subprocess so we can use the '-p' option
+        venv_cmd = ['virtualenv', venv_dir, '-p', runtime]
+        print(subprocess.check_output(venv_cmd, stderr=subprocess.STDOUT))
+    except subprocess.CalledProcessError as e:
+        log.debug('Running command: %s resulted in the ' % e.cmd)
+        log.debug('following error: %s' % e.output)
+        raise VirtualenvError()
 
-    os.remove(get_poetry_py)
 
-    return poetry_exe
+def _prepare_poetry(poetry_tool=None):
+    # shared poetry installation (once per POETRY_VERSION)
+    if poetry_tool is None:
+        poetry_tool = PoetryTool()
+    return poetry_tool.executable(_create_virtualenv)
 
 
 # this bundler version shamelessly uses chalice (/github.com/awslabs/chalice/)
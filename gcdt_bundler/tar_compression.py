@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Compressed output streams for tenkai tar bundles."""
+from __future__ import unicode_literals, print_function
+import collections
+import gzip
+import zlib
+from multiprocessing.pool import ThreadPool
+
+from gcdt import GcdtError
+from gcdt.gcdt_logging import getLogger
+
+from .zip_writer import worker_count
+
+
+log = getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+GZIP_LEVEL = 9  # same as tarfile 'w:gz'
+ZSTD_LEVEL = 3
+TAR_COMPRESSIONS = {
+    'gzip': '.tar.gz',
+    'zstd': '.tar.zst',
+}
+
+
+class ZstdNotAvailableError(GcdtError):
+    """
+    The optional zstandard package is missing
+    """
+    fmt = 'zstd compression for bundles requires the \'zstandard\' package.'
+
+
+def _gzip_member(block, level):
+    # compress a block into a complete gzip member (header mtime is 0)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush()
+
+
+class ParallelGzipWriter(object):
+    """Gzip compress a stream block by block on a thread pool (pigz-style).
+
+    Every block is written as a separate gzip member. gunzip and the python
+    gzip module read such a multi-member stream like a single gzip file.
+    The output only depends on block_size and level, not on the number of
+    workers.
+    """
+
+    def __init__(self, fileobj, workers=None, block_size=DEFAULT_BLOCK_SIZE,
+                 level=GZIP_LEVEL):
+        self.fileobj = fileobj
+        self.block_size = block_size
+        self.level = level
+        self._workers = worker_count(workers)
+        self._pool = ThreadPool(self._workers)
+        self._pending = collections.deque()
+        self._buffer = []
+        self._buffered = 0
+        self._size = 0
+
+    def write(self, data):
+        size = len(data)
+        self._buffer.append(data)
+        self._buffered += size
+        self._size += size
+        if self._buffered >= self.block_size:
+            data = b''.join(self._buffer)
+            for start in range(0, len(data) - self.block_size + 1,
+                               self.block_size):
+                self._submit(data[start:start + self.block_size])
+            rest = data[len(data) - len(data) % self.block_size:]
+            self._buffer = [rest] if rest else []
+            self._buffered = len(rest)
+        return size
+
+    def tell(self):
+        return self._size
+
+    def _submit(self, block):
+        self._pending.append(
+            self._pool.apply_async(_gzip_member, (block, self.level)))
+        # limit the number of compressed blocks waiting in memory
+        while len(self._pending) > 2 * self._workers:
+            self.fileobj.write(self._pending.popleft().get())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Compress the remaining data and wait for all blocks."""
+        if self._pool is None:
+            return
+        if self._buffered or not self._size:
+            self._submit(b''.join(self._buffer))
+        self._buffer = []
+        self._buffered = 0
+        try:
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().get())
+        finally:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_compressed_writer(fileobj, compression='gzip', workers=1,
+                           filename=None):
+    """Open a compressing writer for the tar stream.
+
+    :param fileobj: target file object
+    :param compression: 'gzip' or 'zstd'
+    :param workers: number of threads (1: single-threaded standard gzip)
+    :param filename: name to put into the gzip header (single-threaded gzip
+    only), None for a reproducible header without name and mtime 0
+    :return: file object (call close() to finish the stream)
+    """
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ZstdNotAvailableError()
+        threads = worker_count(workers)
+        cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL,
+                                        threads=threads if threads > 1 else 0)
+        try:
+            return cctx.stream_writer(fileobj, closefd=False)
+        except TypeError:
+            # zstandard < 0.15 does not close the fileobj
+            return cctx.stream_writer(fileobj)
+    elif compression != 'gzip':
+        raise ValueError('Unknown compression: %s' % compression)
+
+    if worker_count(workers) > 1:
+        return ParallelGzipWriter(fileobj, workers=workers)
+    if filename is None:
+        return gzip.GzipFile(filename='', mode='wb', fileobj=fileobj,
+                             compresslevel=GZIP_LEVEL, mtime=0)
+    return gzip.GzipFile(filename=filename, mode='wb', fileobj=fileobj,
+                         compresslevel=GZIP_LEVEL)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Pristine virtualenvs per runtime which are cloned instead of creating a
+virtualenv for every build.
+"""
+from __future__ import unicode_literals, print_function
+import errno
+import hashlib
+import os
+import shutil
+import sys
+import time
+
+try:
+    from shutil import which
+except ImportError:  # python 2
+    from distutils.spawn import find_executable as which
+
+from gcdt.gcdt_logging import getLogger
+
+from .cache_utils import get_cache_dir, makedirs, atomic_write, file_lock, \
+    touch
+
+
+log = getLogger(__name__)
+
+# written into the template folder once it is complete
+COMPLETE_MARKER = '.gcdt-template'
+# folders of a venv (relative to the venv) with files containing its path
+# (script shebangs, activate scripts, pyvenv.cfg)
+_REWRITE_DIRS = ('.', 'bin')
+
+
+def _fsencode(path):
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding() or 'utf-8')
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(source, target)
+
+
+def _copy_rewritten(source, target, old, new):
+    # copy a text file with the path of the template replaced, other files
+    # are linked
+    with open(source, 'rb') as f:
+        content = f.read()
+    if b'\0' in content or old not in content:
+        _link_or_copy(source, target)
+        return
+    with open(target, 'wb') as f:
+        f.write(content.replace(old, new))
+    shutil.copystat(source, target)
+
+
+def clone_venv(template_dir, venv_dir):
+    """Clone a virtualenv, files are hardlinked (copied across devices),
+    files referring to the path of the template (scripts in bin, pyvenv.cfg)
+    and absolute symlinks into the template are rewritten.
+
+    :param template_dir: virtualenv to clone
+    :param venv_dir: new virtualenv (must not exist)
+    """
+    template_dir = os.path.abspath(template_dir)
+    venv_dir = os.path.abspath(venv_dir)
+    old, new = _fsencode(template_dir), _fsencode(venv_dir)
+    for dirpath, dirnames, filenames in os.walk(template_dir):
+        rel_dir = os.path.relpath(dirpath, template_dir)
+        target_dir = os.path.normpath(os.path.join(venv_dir, rel_dir))
+        makedirs(target_dir)
+        for name in dirnames + filenames:
+            source = os.path.join(dirpath, name)
+            target = os.path.join(target_dir, name)
+            if os.path.islink(source):
+                # symlinked folders are listed but not walked
+                link = os.readlink(source)
+                if link == template_dir or \
+                        link.startswith(template_dir + os.sep):
+                    link = venv_dir + link[len(template_dir):]
+                os.symlink(link, target)
+            elif name in dirnames or \
+                    (rel_dir == '.' and name == COMPLETE_MARKER):
+                continue
+            elif rel_dir in _REWRITE_DIRS:
+                _copy_rewritten(source, target, old, new)
+            else:
+                _link_or_copy(source, target)
+
+
+def _interpreter_key(runtime):
+    # the template is created again when the interpreter changes
+    python_exe = which(runtime)
+    if python_exe is None:
+        return runtime
+    python_exe = os.path.realpath(python_exe)
+    digest = hashlib.sha1(('%s:%s' % (
+        python_exe, os.stat(python_exe).st_mtime)).encode('utf-8'))
+    return '%s-%s' % (runtime, digest.hexdigest()[:12])
+
+
+class VenvTemplates(object):
+    """Pristine virtualenv per runtime (and interpreter), created once and
+    cloned for each build.
+
+    A template is created under a lock file, concurrent builds wait for it
+    and clone it once it is complete.
+
+    :param cache_dir: folder for the templates
+    """
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = get_cache_dir('venvs')
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def template(self, runtime, create):
+        """Path of the template for a runtime, create it if missing.
+
+        :param runtime: AWS Lambda python runtime i.e. python3.6
+        :param create: function(runtime, venv_dir) creating a virtualenv
+        :return: path of the template
+        """
+        path = os.path.join(self.cache_dir, _interpreter_key(runtime))
+        marker = os.path.join(path, COMPLETE_MARKER)
+        if os.path.isfile(marker):
+            touch(marker)
+            self.hits += 1
+            return path
+        with file_lock(path + '.lock'):
+            if os.path.isfile(marker):
+                # created by a concurrent build
+                self.hits += 1
+                return path
+            self.misses += 1
+            # created in place, the scripts refer to the template path
+            shutil.rmtree(path, ignore_errors=True)
+            try:
+                create(runtime, path)
+                atomic_write(marker, runtime.encode('utf-8'))
+            except BaseException:
+                shutil.rmtree(path, ignore_errors=True)
+                raise
+        return path
+
+    def clone(self, runtime, venv_dir, create):
+        """Create a virtualenv by cloning the template of the runtime.
+
+        :param runtime: AWS Lambda python runtime i.e. python3.6
+        :param venv_dir: new virtualenv (replaced if it exists)
+        :param create: function(runtime, venv_dir) creating a virtualenv
+        (used for the template)
+        """
+        template_dir = self.template(runtime, create)
+        start = time.time()
+        shutil.rmtree(venv_dir, ignore_errors=True)
+        clone_venv(template_dir, venv_dir)
+        log.debug('cloned virtualenv template %s in %0.2f s',
+                  os.path.basename(template_dir), time.time() - start)
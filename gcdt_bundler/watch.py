@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""Keep a ramuda bundle warm and patch it when files change."""
+from __future__ import unicode_literals, print_function
+import collections
+import ctypes
+import ctypes.util
+import errno
+import functools
+import io
+import os
+import select
+import struct
+import sys
+import time
+
+from gcdt.gcdt_logging import getLogger
+from pathlib2 import PurePath
+
+from .bundler_utils import GlobMatcher, get_path_info, scan_dir
+from .cache_utils import atomic_write
+from .pruning import is_dependency
+from .wheels import keep_metadata_file, bundle_wheel_entries
+from .zip_writer import ZipWriter, compress_bytes, compress_file, \
+    imap_entries, normalize_arcname, normalize_entry, CompressionPolicy, \
+    SizeBudget, BundleSizeLimitExceeded
+
+
+log = getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 1.0  # seconds
+DEBOUNCE_INTERVAL = 0.05  # seconds to collect a burst of events
+
+# see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+_STRUCT_EVENT = b'iIII'
+
+
+class InotifyEvents(object):
+    """Changed paths of watched folders reported by inotify (linux only)."""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._watches = {}  # watch descriptor => folder
+
+    def watch(self, folders):
+        """Watch the folders (not recursive), unwatched folders are kept."""
+        for folder in folders:
+            wd = self._libc.inotify_add_watch(
+                self._fd, folder.encode(sys.getfilesystemencoding()),
+                _WATCH_MASK)
+            if wd < 0:
+                log.debug('can not watch \'%s\' (errno %d)', folder,
+                          ctypes.get_errno())
+                continue
+            self._watches[wd] = folder
+
+    def wait(self, timeout):
+        """Wait for changes.
+
+        :param timeout: seconds to wait
+        :return: set of changed paths, empty set on timeout or None if
+        folders changed (rescan needed)
+        """
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return set()
+        paths = set()
+        rescan = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+            rescan = self._parse(data, paths) or rescan
+            # collect the burst of events caused by a single save
+            if not select.select([self._fd], [], [], DEBOUNCE_INTERVAL)[0]:
+                break
+        return None if rescan else paths
+
+    def _parse(self, data, paths):
+        # add the changed paths, returns True if a rescan is needed
+        header_size = struct.calcsize(_STRUCT_EVENT)
+        rescan = False
+        offset = 0
+        while offset + header_size <= len(data):
+            wd, mask, _, length = struct.unpack_from(_STRUCT_EVENT, data,
+                                                     offset)
+            name = data[offset + header_size:offset + header_size + length]
+            offset += header_size + length
+            folder = self._watches.get(wd)
+            if mask & (IN_ISDIR | IN_Q_OVERFLOW | IN_DELETE_SELF |
+                       IN_MOVE_SELF) or folder is None:
+                rescan = True
+                continue
+            name = name.rstrip(b'\0').decode(sys.getfilesystemencoding())
+            paths.add(os.path.join(folder, name))
+        return rescan
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingEvents(object):
+    """Fallback without inotify, every wait asks for a rescan."""
+
+    def watch(self, folders):
+        pass
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return None
+
+    def close(self):
+        pass
+
+
+def get_events():
+    """inotify based events if possible, polling otherwise."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyEvents()
+        except (OSError, AttributeError) as e:
+            log.debug('inotify not available: %s', e)
+    return PollingEvents()
+
+
+class _Root(object):
+    # a configured bundling folder
+    def __init__(self, path, gcdtignore):
+        base, ptz, self.target = get_path_info(path)
+        self.path = path
+        self.base = str(PurePath(base))
+        self.matcher = GlobMatcher([ptz], gcdtignore=gcdtignore)
+
+    def walk(self):
+        """Yield (full_path, arcname) and collect the walked folders."""
+        self.folders = []
+        stack = [(self.base, '', self.matcher.start())]
+        while stack:
+            path, rel_dir, states = stack.pop()
+            self.folders.append(path)
+            files, subdirs = scan_dir(self.matcher, path, rel_dir, states)
+            for name in files:
+                yield (os.path.join(path, name),
+                       normalize_arcname(self.target + rel_dir + name))
+            stack.extend((os.path.join(path, name), rel_dir + name + '/',
+                          sub_states) for name, sub_states in reversed(subdirs))
+
+    def match(self, full_path):
+        """arcname of full_path or None if it is not bundled."""
+        if not full_path.startswith(self.base + '/'):
+            return None
+        parts = full_path[len(self.base) + 1:].split('/')
+        states = self.matcher.start()
+        path = self.base
+        rel_dir = ''
+        for part in parts[:-1]:
+            path = os.path.join(path, part)
+            states = self.matcher.descend(states, part, os.path.islink(path))
+            if states is None or self.matcher.prune_dir(path, rel_dir + part):
+                return None
+            rel_dir += part + '/'
+        if self.matcher.match_file(states, parts[-1], full_path,
+                                   rel_dir + parts[-1]):
+            return normalize_arcname(self.target + rel_dir + parts[-1])
+
+
+def _file_size(full_path):
+    try:
+        return os.path.getsize(full_path)
+    except OSError:
+        return 0
+
+
+def _stat_key(full_path):
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime, st.st_ino
+
+
+class BundleWatcher(object):
+    """Keep the compressed entries of a bundle in memory and rebuild the zip
+    from them when files change. Only changed files are compressed again.
+
+    :param paths: list of path => {'source': ,'target': }
+    :param gcdtignore: list of ignore patterns (gitwildcard format)
+    :param artifacts: list of artifacts => {'content': ,'target': , 'attr': }
+    :param outfile: path to write the bundle to after every change
+    :param workers: number of threads used to compress files
+    :param compression: compression profile (see make_zip_file)
+    :param events: InotifyEvents or PollingEvents (default: get_events())
+    :param wheels: list of wheel paths copied into the bundle root
+    :param dist_info: 'keep', 'minimal' or 'strip' (see make_zip_file)
+    :param pruner: Pruner to leave files out of the bundle
+    :param deterministic: reproducible archive (see make_zip_file)
+    :param size_limits: dict with the 'compressed' and 'uncompressed' limit
+    in MB (see get_size_limits), a bundle crossing a limit is not written
+    :param entry_cache: ZipEntryCache to reuse compressed entries
+    :param compiler: BytecodeCompiler to add the compiled python files of
+    changed files
+    """
+
+    def __init__(self, paths, gcdtignore=None, artifacts=None, outfile=None,
+                 workers=1, compression=None, events=None, wheels=None,
+                 dist_info='keep', pruner=None, deterministic=False,
+                 size_limits=None, entry_cache=None, compiler=None):
+        self.roots = [_Root(path, gcdtignore) for path in paths]
+        self.outfile = outfile
+        self.workers = workers
+        self.policy = CompressionPolicy(compression) \
+            if compression is not None else None
+        self.events = events if events is not None else get_events()
+        self.dist_info = dist_info
+        self.pruner = pruner
+        self.deterministic = deterministic
+        self.size_limits = size_limits
+        self.entry_cache = entry_cache
+        self.compiler = compiler
+        self.bundle = None
+        self.stats = {'builds': 0, 'compressed': 0}
+        # full_path => (key, arcname, entries of the file and its bytecode)
+        self._entries = collections.OrderedDict()
+        # pruned files are counted once
+        self._pruned = set()
+        # entries which do not change while watching, project files take
+        # precedence over wheel members
+        self._wheel_members = [
+            entry for entry in bundle_wheel_entries(wheels or [],
+                                                    dist_info=dist_info)
+            if self._bundled(entry.arcname, size=entry.file_size)]
+        if compiler is not None and self._wheel_members:
+            self._wheel_members = compiler.compile_entries(
+                self._wheel_members, deterministic)
+        self._artifacts = []
+        for artifact in artifacts or []:
+            content = artifact['content']
+            if not isinstance(content, bytes):
+                content = content.encode('utf-8')
+            attr = artifact.get('attr', None)
+            self._artifacts.append(compress_bytes(
+                artifact['target'], content,
+                external_attr=(attr << 16) if attr else 0))
+
+    def _bundled(self, arcname, folder=None, full_path=None, size=None):
+        # dist-info policy and prune rules (for dependencies, folder is None
+        # for wheel members)
+        if not keep_metadata_file(arcname, self.dist_info):
+            return False
+        if self.pruner is None or \
+                (folder is not None and not is_dependency(folder, arcname)):
+            return True
+        if full_path in self._pruned:
+            return False
+        if full_path is not None:
+            size = functools.partial(_file_size, full_path)
+        if self.pruner.keep_file(arcname, size):
+            return True
+        if full_path is not None:
+            self._pruned.add(full_path)
+        return False
+
+    def _compress(self, full_path, arcname):
+        if self.entry_cache is not None:
+            return self.entry_cache.compress_file(full_path, arcname,
+                                                  policy=self.policy)
+        return compress_file(full_path, arcname, policy=self.policy)
+
+    def _compile(self, tasks):
+        # arcname => ZipEntry of the compiled file
+        compiled = self.compiler.compile_files(tasks, self.deterministic)
+        pyc_arcname = self.compiler.pyc_arcname
+        return dict((arcname, compress_file(pyc_path, pyc_arcname(arcname)))
+                    for arcname, pyc_path in compiled.items())
+
+    def refresh(self, paths=None):
+        """Patch the bundle.
+
+        :param paths: changed paths, None to check all files
+        :return: True if the bundle changed
+        """
+        if paths is None:
+            files = collections.OrderedDict()
+            for root in self.roots:
+                for full_path, arcname in root.walk():
+                    if self._bundled(arcname, root.path, full_path):
+                        files[full_path] = arcname
+                self.events.watch(root.folders)
+            removed = [p for p in self._entries if p not in files]
+        else:
+            files = {}
+            removed = []
+            for full_path in paths:
+                root, arcname = next(
+                    ((r, a) for r, a in ((r, r.match(full_path))
+                                         for r in self.roots) if a),
+                    (None, None))
+                if arcname is not None and os.path.isfile(full_path) and \
+                        self._bundled(arcname, root.path, full_path):
+                    files[full_path] = arcname
+                elif full_path in self._entries:
+                    removed.append(full_path)
+
+        tasks = []
+        keys = {}
+        for full_path, arcname in files.items():
+            key = _stat_key(full_path)
+            known = self._entries.get(full_path)
+            if key is None:
+                removed.append(full_path)
+            elif known is None or known[0] != key or known[1] != arcname:
+                tasks.append((full_path, arcname))
+                keys[full_path] = key
+
+        for full_path in removed:
+            self._entries.pop(full_path, None)
+        compiled = self._compile(tasks) if self.compiler is not None else {}
+        for (full_path, arcname), entry in zip(tasks, imap_entries(
+                self._compress, tasks, workers=self.workers)):
+            entries = [entry]
+            if arcname in compiled:
+                if self.compiler.pyc_only:
+                    entries = []
+                entries.append(compiled[arcname])
+            self._entries[full_path] = (keys[full_path], arcname, entries)
+        self.stats['compressed'] += len(tasks)
+        if self.entry_cache is not None and tasks:
+            self.entry_cache.flush()
+
+        if paths is None and list(self._entries) != list(files):
+            # keep the walk order
+            self._entries = collections.OrderedDict(
+                (p, self._entries[p]) for p in files if p in self._entries)
+        elif not tasks and not removed and self.bundle is not None:
+            return False
+        self._write()
+        return True
+
+    def _write(self):
+        # same order as make_zip_file: files, wheel members, artifacts
+        entries = [entry for _, _, file_entries in self._entries.values()
+                   for entry in file_entries]
+        if self.deterministic:
+            entries.sort(key=lambda e: e.arcname)
+        arcnames = set(entry.arcname for entry in entries)
+        entries.extend(entry for entry in self._wheel_members
+                       if entry.arcname not in arcnames)
+        entries.extend(self._artifacts)
+        budget = SizeBudget(**self.size_limits) \
+            if self.size_limits is not None else None
+        buf = io.BytesIO()
+        with ZipWriter(buf) as z:
+            for entry in entries:
+                if self.deterministic:
+                    normalize_entry(entry)
+                if budget is not None:
+                    budget.add(entry)
+                z.add(entry)
+        self.bundle = buf.getvalue()
+        self.stats['builds'] += 1
+        if self.outfile:
+            atomic_write(self.outfile, self.bundle)
+
+    def _patch(self, paths=None):
+        # refresh, a bundle crossing a size limit is reported and not written
+        try:
+            return self.refresh(paths)
+        except BundleSizeLimitExceeded as e:
+            log.error(str(e))
+            return False
+
+    def run(self, callback=None, poll_interval=DEFAULT_POLL_INTERVAL,
+            should_stop=None):
+        """Build the bundle and patch it on every change until stopped.
+
+        :param callback: called with the watcher after each change
+        :param poll_interval: seconds between checks
+        :param should_stop: function returning True to stop watching
+        """
+        try:
+            if self._patch():
+                if self.pruner is not None:
+                    self.pruner.log_stats()
+                if self.compiler is not None:
+                    self.compiler.log_stats()
+                if callback:
+                    callback(self)
+            while not (should_stop and should_stop()):
+                paths = self.events.wait(poll_interval)
+                if paths is not None and not paths:
+                    continue
+                start = time.time()
+                if self._patch(paths):
+                    log.info('bundle updated in %0.0f ms (%d bytes)',
+                             (time.time() - start) * 1000, len(self.bundle))
+                    if callback:
+                        callback(self)
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop watching and remove the compiled files."""
+        self.events.close()
+        if self.compiler is not None:
+            self.compiler.close()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Shared cache of downloaded wheels."""
+from __future__ import unicode_literals, print_function
+import os
+import tempfile
+import threading
+
+from gcdt import GcdtError
+from gcdt.gcdt_logging import getLogger
+
+from .bundler_utils import HashingWriter
+from .cache_utils import get_cache_dir, touch, prune_lru, remove_file, \
+    file_lock
+
+
+log = getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024  # 1 GB
+LOCK_SUFFIX = '.lock'
+
+
+class WheelDigestMismatchError(GcdtError):
+    """
+    The downloaded file does not match the digest of the index
+    """
+    fmt = 'sha256 of \'{filename}\' does not match the index ({sha256}).'
+
+
+class WheelCache(object):
+    """Downloaded files shared by concurrent bundling processes.
+
+    Downloads are written to a temporary file, verified against the sha256
+    of the index and renamed into place, so a file in the cache is always
+    complete. A lock file per wheel makes sure only one process downloads
+    it. The cache is bounded by max_size (least recently used wheels are
+    evicted).
+
+    :param cache_dir: folder for the wheels
+    :param max_size: maximum total size in bytes (None for no limit)
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        if cache_dir is None:
+            cache_dir = get_cache_dir('wheels')
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _path(self, filename):
+        return os.path.join(self.cache_dir, filename)
+
+    def _count(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, filename):
+        """Path of a cached file (a miss is counted by fetch).
+
+        :param filename: name of the wheel
+        :return: path or None if the file is not cached
+        """
+        path = self._path(filename)
+        if os.path.isfile(path):
+            touch(path)
+            self._count(True)
+            return path
+        return None
+
+    def fetch(self, filename, download, sha256=None):
+        """Path of a cached file, download it if it is missing.
+
+        :param filename: name of the wheel
+        :param download: function writing the content into a file object
+        :param sha256: expected hex digest (not verified if None)
+        :return: path of the file
+        """
+        path = self._path(filename)
+        with file_lock(self._path(filename) + LOCK_SUFFIX):
+            if os.path.isfile(path):
+                # cached or downloaded by a concurrent process
+                touch(path)
+                self._count(True)
+                return path
+            self._count(False)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir,
+                                            prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    writer = HashingWriter(f)
+                    download(writer)
+                if sha256 and writer.sha256 != sha256.lower():
+                    raise WheelDigestMismatchError(filename=filename,
+                                                   sha256=sha256)
+                os.rename(tmp_path, path)
+            except BaseException:
+                remove_file(tmp_path)
+                raise
+        if self.max_size is not None:
+            self.prune()
+        return path
+
+    def prune(self, max_size=None):
+        """Evict least recently used wheels exceeding max_size (and their
+        lock files).
+
+        :param max_size: size in bytes (default: max_size of the cache)
+        :return: list of removed paths
+        """
+        if max_size is None:
+            max_size = self.max_size
+        removed = prune_lru(self.cache_dir, max_size,
+                            suffixes=('.whl', '.tar.gz', '.zip'))
+        for path in removed:
+            # a concurrent fetch holding the lock at worst downloads the
+            # wheel twice (both downloads are renamed into place)
+            remove_file(path + LOCK_SUFFIX)
+        return removed
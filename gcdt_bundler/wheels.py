@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""Resolve wheels for the AWS Lambda platform and unpack them without a
+virtualenv.
+"""
+from __future__ import unicode_literals, print_function
+import os
+import re
+import shutil
+import stat
+import subprocess
+import sys
+import zipfile
+
+from gcdt.gcdt_logging import getLogger
+
+from .cache_utils import makedirs
+from .zip_writer import normalize_arcname, read_raw_entries
+
+
+log = getLogger(__name__)
+
+LAMBDA_PLATFORM = 'manylinux1_x86_64'
+# platform tags of wheels which run on AWS Lambda (glibc 2.17)
+_LAMBDA_PLATFORMS = ('manylinux1_x86_64', 'manylinux2010_x86_64',
+                     'manylinux2014_x86_64') + tuple(
+    'manylinux_2_%d_x86_64' % minor for minor in range(5, 18))
+# wheel data folders which end up in site-packages
+_SITE_PACKAGES_SCHEMES = ('purelib', 'platlib')
+_DATA_DIR = re.compile(r'^[^/]+\.data/([^/]+)/(.*)$')
+# handling of .dist-info / .egg-info files in the bundle:
+# keep: all files, minimal: files read at runtime (metadata, entry points)
+# strip: no metadata at all
+DIST_INFO_POLICIES = ('keep', 'minimal', 'strip')
+_RUNTIME_METADATA = frozenset([
+    'METADATA', 'PKG-INFO', 'entry_points.txt', 'top_level.txt',
+    'namespace_packages.txt'
+])
+
+
+def target_platform(runtime):
+    """pip download options for the interpreter of a Lambda runtime.
+
+    :param runtime: AWS Lambda python runtime i.e. python3.6
+    :return: dict with platform, python_version, implementation and abi
+    """
+    major, minor = [int(v) for v in runtime[len('python'):].split('.')[:2]]
+    if major == 2:
+        abi = 'cp27mu'
+    elif (major, minor) < (3, 8):
+        abi = 'cp%d%dm' % (major, minor)
+    else:
+        abi = 'cp%d%d' % (major, minor)
+    return {
+        'platform': LAMBDA_PLATFORM,
+        'python_version': '%d%d' % (major, minor),
+        'implementation': 'cp',
+        'abi': abi
+    }
+
+
+def supported_tags(runtime):
+    """Wheel tags the interpreter of a Lambda runtime can install.
+
+    :param runtime: AWS Lambda python runtime i.e. python3.6
+    :return: dict with the sets 'python', 'abi3_python' (interpreters of
+    abi3 wheels), 'abi' and 'platform' and the 'exact_abi'
+    """
+    target = target_platform(runtime)
+    major = int(target['python_version'][0])
+    minor = int(target['python_version'][1:])
+    pythons = set(['cp%d%d' % (major, minor), 'py%d' % major])
+    pythons.update('py%d%d' % (major, m) for m in range(minor + 1))
+    abis = set([target['abi'], 'none'])
+    if major == 3:
+        abis.add('abi3')
+    return {
+        'python': pythons,
+        'abi3_python': set('cp%d%d' % (major, m) for m in range(minor + 1)),
+        'abi': abis,
+        'platform': set(_LAMBDA_PLATFORMS + ('any',)),
+        'exact_abi': target['abi'],
+    }
+
+
+def wheel_rank(filename, tags):
+    """Rank of a wheel for the supported tags, lower is better (platform
+    specific wheels and the exact abi first).
+
+    :param filename: wheel filename
+    :param tags: supported_tags() of the runtime
+    :return: rank (tuple) or None if the wheel is not compatible
+    """
+    parts = filename[:-len('.whl')].split('-')
+    if len(parts) not in (5, 6):
+        return None
+    pythons, abis, platforms = [p.split('.') for p in parts[-3:]]
+    ranks = []
+    for abi in abis:
+        if abi not in tags['abi']:
+            continue
+        allowed = tags['abi3_python'] if abi == 'abi3' else tags['python']
+        if not any(python in allowed for python in pythons):
+            continue
+        for platform in platforms:
+            if platform in tags['platform']:
+                ranks.append((
+                    0 if abi == tags['exact_abi'] else
+                    1 if abi == 'abi3' else 2,
+                    1 if platform == 'any' else 0))
+    return min(ranks) if ranks else None
+
+
+def select_wheel(files, runtime):
+    """Best wheel for a Lambda runtime from the files of a release.
+
+    :param files: release files of the package index (dicts with filename)
+    :param runtime: AWS Lambda python runtime i.e. python3.6
+    :return: file dict or None if there is no compatible wheel
+    """
+    tags = supported_tags(runtime)
+    ranked = []
+    for f in files or []:
+        if f['filename'].endswith('.whl'):
+            rank = wheel_rank(f['filename'], tags)
+            if rank is not None:
+                ranked.append((rank, f['filename'], f))
+    if not ranked:
+        return None
+    return min(ranked, key=lambda r: r[:2])[2]
+
+
+def download_wheels(requirements_file, runtime, dest_dir, python_exe=None):
+    """Resolve the requirements for the Lambda platform and download the
+    wheels (pip download, no sdists are built).
+
+    :param requirements_file: path to a pip requirements file
+    :param runtime: AWS Lambda python runtime i.e. python3.6
+    :param dest_dir: folder for the downloaded wheels
+    :param python_exe: python with pip (default: the running python)
+    :return: sorted list of wheel paths
+    """
+    target = target_platform(runtime)
+    cmd = [python_exe or sys.executable, '-m', 'pip', 'download',
+           '-r', requirements_file, '--dest', dest_dir,
+           '--only-binary=:all:',
+           '--platform', target['platform'],
+           '--python-version', target['python_version'],
+           '--implementation', target['implementation'],
+           '--abi', target['abi']]
+    makedirs(dest_dir)
+    print(subprocess.check_output(cmd, stderr=subprocess.STDOUT))
+    return sorted(os.path.join(dest_dir, f) for f in os.listdir(dest_dir)
+                  if f.endswith('.whl'))
+
+
+def wheel_member_target(name):
+    """Path of a wheel member within site-packages.
+
+    Files of the purelib and platlib data folders are moved to the top
+    level, other data (scripts, headers, data) is not installed.
+
+    :param name: name of the member in the wheel
+    :return: relative path or None if the member is not installed
+    """
+    if name.startswith('/') or '..' in name.split('/'):
+        log.warning('skipping wheel member \'%s\' outside of site-packages',
+                    name)
+        return None
+    m = _DATA_DIR.match(name)
+    if m is None:
+        return name
+    if m.group(1) in _SITE_PACKAGES_SCHEMES:
+        return m.group(2)
+    return None
+
+
+def install_wheel(wheel_path, target_dir):
+    """Unpack a wheel into a site-packages folder.
+
+    :param wheel_path: path of the wheel
+    :param target_dir: site-packages folder
+    :return: list of the installed files (relative paths)
+    """
+    installed = []
+    with zipfile.ZipFile(wheel_path) as z:
+        for info in z.infolist():
+            if info.filename.endswith('/'):
+                continue
+            rel_path = wheel_member_target(info.filename)
+            if not rel_path:
+                continue
+            path = os.path.join(target_dir, *rel_path.split('/'))
+            makedirs(os.path.dirname(path))
+            with z.open(info) as source, open(path, 'wb') as f:
+                shutil.copyfileobj(source, f)
+            mode = (info.external_attr >> 16) & 0o777
+            if mode & stat.S_IXUSR:
+                os.chmod(path, mode | 0o644)
+            installed.append(rel_path)
+    return installed
+
+
+def install_wheels(wheel_paths, target_dir):
+    """Unpack wheels into a flat site-packages folder.
+
+    :param wheel_paths: list of wheel paths
+    :param target_dir: site-packages folder
+    :return: number of installed files
+    """
+    makedirs(target_dir)
+    count = 0
+    for wheel_path in wheel_paths:
+        log.debug('unpacking %s', os.path.basename(wheel_path))
+        count += len(install_wheel(wheel_path, target_dir))
+    return count
+
+
+def keep_metadata_file(arcname, dist_info='keep'):
+    """Check if a file is bundled according to the dist-info policy.
+
+    :param arcname: name of the file within the bundle
+    :param dist_info: 'keep', 'minimal' or 'strip'
+    :return: False if the file is dropped
+    """
+    if dist_info == 'keep':
+        return True
+    parts = arcname.split('/')
+    if not any(p.endswith(('.dist-info', '.egg-info')) for p in parts[:-1]):
+        return True
+    return dist_info == 'minimal' and parts[-1] in _RUNTIME_METADATA
+
+
+def wheel_entries(wheel_path, target='', dist_info='keep'):
+    """Members of a wheel as they are installed into site-packages, the
+    compressed data is copied without decompressing it.
+
+    :param wheel_path: path of the wheel
+    :param target: folder within the bundle
+    :param dist_info: 'keep', 'minimal' or 'strip'
+    :return: iterator of ZipEntry
+    """
+    for entry in read_raw_entries(wheel_path):
+        rel_path = wheel_member_target(entry.arcname)
+        if not rel_path or not keep_metadata_file(rel_path, dist_info):
+            continue
+        entry.arcname = normalize_arcname(target + rel_path)
+        yield entry
+
+
+def bundle_wheel_entries(wheel_paths, target='', dist_info='keep',
+                         exclude=None):
+    """Members of several wheels as they are installed into one
+    site-packages: there is one entry per file, the member of a later wheel
+    replaces the one of an earlier wheel (as unpacking overwrites it).
+
+    :param wheel_paths: list of wheel paths
+    :param target: folder within the bundle
+    :param dist_info: 'keep', 'minimal' or 'strip'
+    :param exclude: set of arcnames which are already bundled (i.e. the
+    project files), it is checked when the members are read
+    :return: iterator of ZipEntry
+    """
+    # arcname => index of the last wheel containing it
+    owners = {}
+    for index, wheel_path in enumerate(wheel_paths):
+        with zipfile.ZipFile(wheel_path) as z:
+            for name in z.namelist():
+                rel_path = wheel_member_target(name)
+                if rel_path and not name.endswith('/'):
+                    owners[normalize_arcname(target + rel_path)] = index
+    for index, wheel_path in enumerate(wheel_paths):
+        for entry in wheel_entries(wheel_path, target, dist_info):
+            if owners.get(entry.arcname) != index:
+                log.debug('\'%s\' of %s is replaced by a later wheel',
+                          entry.arcname, os.path.basename(wheel_path))
+                continue
+            del owners[entry.arcname]
+            if exclude is not None and entry.arcname in exclude:
+                log.debug('\'%s\' of %s is replaced by a project file',
+                          entry.arcname, os.path.basename(wheel_path))
+                continue
+            yield entry
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Persistent cache of compressed zip entries for incremental bundling."""
+from __future__ import unicode_literals, print_function
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+
+from gcdt.gcdt_logging import getLogger
+
+from .cache_utils import get_cache_dir, atomic_write, touch, prune_lru, \
+    file_lock
+from .zip_writer import ZipEntry, DEFAULT_COMPRESS_LEVEL, READ_CHUNK_SIZE, \
+    SAMPLE_SIZE, compress_bytes, file_attributes
+
+
+log = getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024  # 512 MB
+_STRUCT_BLOB_HEADER = b'<LQB'
+LOCK_SUFFIX = '.lock'
+
+
+class ZipEntryCache(object):
+    """Cache deflated file content so unchanged files are not recompressed.
+
+    Entries are stored by content hash and compression level. An index maps
+    each file path to its size, mtime and content hash so unchanged files do
+    not even need to be hashed again. The index is shared by concurrent
+    processes (flush merges it under a lock file). The cache is bounded by
+    max_size (least recently used entries are evicted).
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        if cache_dir is None:
+            cache_dir = get_cache_dir('zip_entries')
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._index_file = os.path.join(cache_dir, 'index.json')
+        self._entries_dir = os.path.join(cache_dir, 'entries')
+        self._lock = threading.Lock()
+        self._index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self._index_file, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _blob_path(self, digest, level):
+        # the same content is stored or deflated depending on the arcname
+        return os.path.join(self._entries_dir, digest[:2], '%s-%s' % (
+            digest, 'stored' if level is None else 'deflate%d' % level))
+
+    def compress_file(self, full_path, arcname, policy=None):
+        """Get the ZipEntry for a file, from the cache if possible.
+
+        :param full_path: path of the file to compress
+        :param arcname: name of the member within the archive
+        :param policy: CompressionPolicy (see zip_writer.compress_file)
+        :return: ZipEntry
+        """
+        start = time.time()
+        st = os.stat(full_path)
+        date_time, external_attr = file_attributes(st)
+        content = None
+        with self._lock:
+            known = self._index.get(full_path)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime:
+            digest = known[2]
+            sample = b''
+            if policy is not None:
+                with open(full_path, 'rb') as f:
+                    sample = f.read(SAMPLE_SIZE)
+        else:
+            with open(full_path, 'rb') as f:
+                content = f.read()
+            digest = hashlib.sha256(content).hexdigest()
+            sample = content[:READ_CHUNK_SIZE]
+        if policy is None:
+            level = DEFAULT_COMPRESS_LEVEL
+        else:
+            level = policy.choose(arcname, sample)
+
+        blob_path = self._blob_path(digest, level)
+        entry = self._read_blob(blob_path, arcname, date_time, external_attr)
+        if entry is not None:
+            touch(blob_path)
+            with self._lock:
+                self.hits += 1
+        else:
+            if content is None:
+                with open(full_path, 'rb') as f:
+                    content = f.read()
+            entry = compress_bytes(arcname, content, date_time,
+                                   external_attr, level)
+            if policy is not None:
+                policy.record(level, entry, time.time() - start)
+            atomic_write(blob_path, struct.pack(
+                _STRUCT_BLOB_HEADER, entry.crc, entry.file_size,
+                entry.compress_type) + entry.data)
+            with self._lock:
+                self.misses += 1
+
+        with self._lock:
+            self._index[full_path] = [st.st_size, st.st_mtime, digest]
+        return entry
+
+    def _read_blob(self, blob_path, arcname, date_time, external_attr):
+        try:
+            with open(blob_path, 'rb') as f:
+                blob = f.read()
+        except (IOError, OSError):
+            return None
+        header_size = struct.calcsize(_STRUCT_BLOB_HEADER)
+        if len(blob) < header_size:
+            return None
+        crc, file_size, compress_type = struct.unpack(
+            _STRUCT_BLOB_HEADER, blob[:header_size])
+        return ZipEntry(arcname, blob[header_size:], crc, file_size,
+                        compress_type, date_time, external_attr)
+
+    def flush(self):
+        """Persist the index and evict entries exceeding max_size.
+
+        The index is merged with the records flushed by concurrent
+        processes in the meantime.
+        """
+        prune_lru(self._entries_dir, self.max_size)
+        cached = set()
+        for _, _, filenames in os.walk(self._entries_dir):
+            cached.update(name.split('-')[0] for name in filenames)
+        with file_lock(self._index_file + LOCK_SUFFIX):
+            index = self._load_index()
+            with self._lock:
+                index.update(self._index)
+                # forget index records of evicted entries
+                self._index = dict((path, known)
+                                   for path, known in index.items()
+                                   if known[2] in cached)
+                atomic_write(self._index_file,
+                             json.dumps(self._index).encode('utf-8'))
+        log.debug('zip entry cache: %d hits, %d misses', self.hits,
+                  self.misses)
@@ -0,0 +1,562 @@
+# -*- coding: utf-8 -*-
+"""Zip archive writer working on pre-compressed entries.
+
+Compression happens outside of the writer (optionally on a thread pool) so
+the writer only has to put local headers, entry data and the central
+directory in place. The target file object only needs a write() method.
+"""
+from __future__ import unicode_literals, print_function
+import hashlib
+import mmap
+import os
+import stat
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from zipfile import ZIP_DEFLATED, ZIP_STORED
+
+from gcdt import GcdtError
+from gcdt.gcdt_logging import getLogger
+
+
+log = getLogger(__name__)
+
+# structures as used in Lib/zipfile.py
+_STRUCT_FILE_HEADER = b'<4s2B4HL2L2H'
+_STRING_FILE_HEADER = b'PK\003\004'
+_STRUCT_CENTRAL_DIR = b'<4s4B4HL2L5H2L'
+_STRING_CENTRAL_DIR = b'PK\001\002'
+_STRUCT_END_ARCHIVE = b'<4s4H2LH'
+_STRING_END_ARCHIVE = b'PK\005\006'
+_STRUCT_END_ARCHIVE64 = b'<4sQ2H2L4Q'
+_STRING_END_ARCHIVE64 = b'PK\006\006'
+_STRUCT_END_ARCHIVE64_LOCATOR = b'<4sLQL'
+_STRING_END_ARCHIVE64_LOCATOR = b'PK\006\007'
+
+_ZIP_VERSION = 20  # deflate
+_ZIP64_VERSION = 45
+_CREATE_SYSTEM_UNIX = 3
+_FLAG_UTF8 = 0x800
+_FILE_HEADER_SIZE = struct.calcsize(_STRUCT_FILE_HEADER)
+_CENTRAL_DIR_SIZE = struct.calcsize(_STRUCT_CENTRAL_DIR)
+_END_ARCHIVE_SIZE = struct.calcsize(_STRUCT_END_ARCHIVE)
+_ZIP64_LIMIT = (1 << 31) - 1
+_ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+
+DEFAULT_COMPRESS_LEVEL = zlib.Z_DEFAULT_COMPRESSION
+READ_CHUNK_SIZE = 1024 * 1024
+# file types which are compressed already
+STORED_EXTENSIONS = frozenset([
+    '.whl', '.egg', '.zip', '.jar', '.gz', '.tgz', '.bz2', '.xz', '.lzma',
+    '.zst', '.7z', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp3', '.mp4',
+    '.woff', '.woff2', '.pdf'
+])
+SAMPLE_SIZE = 4096
+MIN_SAMPLE_SIZE = 512
+# profile => (deflate level, max. sample_ratio of files to deflate)
+COMPRESSION_PROFILES = {
+    'fast': (1, 0.9),
+    'balanced': (6, 0.95),
+    'max': (9, 0.98),
+}
+# used for all entries of reproducible bundles (earliest zip timestamp)
+DETERMINISTIC_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class BundleSizeLimitExceeded(GcdtError):
+    """
+    The bundle crossed one of its size limits
+    """
+    fmt = 'Deployment bundle exceeds the {kind} size limit of {limit:0.0f}MB ' \
+          '(largest contributors: {contributors})'
+
+
+class ZipEntry(object):
+    """A single archive member with its data already compressed."""
+    __slots__ = ('arcname', 'data', 'crc', 'file_size', 'compress_type',
+                 'date_time', 'external_attr')
+
+    def __init__(self, arcname, data, crc, file_size,
+                 compress_type=ZIP_DEFLATED, date_time=(1980, 1, 1, 0, 0, 0),
+                 external_attr=0):
+        self.arcname = normalize_arcname(arcname)
+        self.data = data
+        self.crc = crc
+        self.file_size = file_size
+        self.compress_type = compress_type
+        self.date_time = date_time
+        self.external_attr = external_attr
+
+    @property
+    def compress_size(self):
+        return len(self.data)
+
+
+def normalize_arcname(arcname):
+    """Normalize an archive name the same way ZipFile.write does.
+
+    :param arcname: name of the member within the archive
+    :return: relative archive name using '/' as separator
+    """
+    arcname = os.path.normpath(os.path.splitdrive(arcname)[1])
+    while arcname and arcname[0] in (os.sep, os.altsep):
+        arcname = arcname[1:]
+    if os.sep != '/':
+        arcname = arcname.replace(os.sep, '/')
+    return arcname
+
+
+def compress_bytes(arcname, content, date_time=(1980, 1, 1, 0, 0, 0),
+                   external_attr=0, level=DEFAULT_COMPRESS_LEVEL):
+    """Deflate content into a ZipEntry.
+
+    :param arcname: name of the member within the archive
+    :param content: uncompressed data (bytes)
+    :param date_time: modification time tuple (year, month, day, h, m, s)
+    :param external_attr: zip external attributes (mode << 16)
+    :param level: zlib compression level (None: store uncompressed)
+    :return: ZipEntry
+    """
+    crc = zlib.crc32(content) & 0xffffffff
+    if level is None:
+        return ZipEntry(arcname, content, crc, len(content), ZIP_STORED,
+                        date_time, external_attr)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(content) + compressor.flush()
+    return ZipEntry(arcname, data, crc, len(content), ZIP_DEFLATED,
+                    date_time, external_attr)
+
+
+def compress_file(full_path, arcname, policy=None):
+    """Read and deflate a file from disk into a ZipEntry.
+
+    :param full_path: path of the file to compress
+    :param arcname: name of the member within the archive
+    :param policy: CompressionPolicy to choose the compression per file
+    (default: deflate everything with the default level)
+    :return: ZipEntry
+    """
+    start = time.time()
+    st = os.stat(full_path)
+    crc = 0
+    file_size = 0
+    chunks = []
+    compressor = None
+    with open(full_path, 'rb') as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if compressor is None:
+                # decide based on the first block of the file
+                if policy is None:
+                    level = DEFAULT_COMPRESS_LEVEL
+                else:
+                    level = policy.choose(arcname, chunk)
+                if level is not None:
+                    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+                else:
+                    compressor = _StoreCompressor()
+            if not chunk:
+                break
+            file_size += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            chunks.append(compressor.compress(chunk))
+    chunks.append(compressor.flush())
+    date_time, external_attr = file_attributes(st)
+    entry = ZipEntry(arcname, b''.join(chunks), crc & 0xffffffff, file_size,
+                     ZIP_STORED if level is None else ZIP_DEFLATED,
+                     date_time, external_attr)
+    if policy is not None:
+        policy.record(level, entry, time.time() - start)
+    return entry
+
+
+def read_raw_entries(zip_path):
+    """Read the members of a zip archive (i.e. a wheel) as ZipEntry without
+    decompressing them, the compressed data and crc are copied as they are.
+    Members using other compression methods are decompressed and deflated.
+
+    :param zip_path: path of the archive
+    :return: iterator of ZipEntry (directories are skipped)
+    """
+    with zipfile.ZipFile(zip_path) as z, open(zip_path, 'rb') as f:
+        for info in z.infolist():
+            if info.filename.endswith('/'):
+                continue
+            external_attr = info.external_attr
+            if not external_attr >> 16:
+                # no unix permissions in the archive
+                external_attr = (stat.S_IFREG | 0o644) << 16
+            if info.compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+                yield compress_bytes(info.filename, z.read(info),
+                                     info.date_time, external_attr)
+                continue
+            f.seek(info.header_offset)
+            header = struct.unpack(_STRUCT_FILE_HEADER,
+                                   f.read(_FILE_HEADER_SIZE))
+            if header[0] != _STRING_FILE_HEADER:
+                raise zipfile.BadZipfile(
+                    'Bad local header of \'%s\' in %s' % (info.filename,
+                                                          zip_path))
+            # skip name and extra field of the local header
+            f.seek(header[10] + header[11], os.SEEK_CUR)
+            data = f.read(info.compress_size)
+            yield ZipEntry(info.filename, data, info.CRC, info.file_size,
+                           info.compress_type, info.date_time, external_attr)
+
+
+class _StoreCompressor(object):
+    # compressobj interface for stored entries
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+def sample_ratio(sample):
+    """Estimate the entropy of a data sample by compressing it quickly.
+
+    :param sample: bytes
+    :return: compressed size / size (about 1.0 for incompressible data)
+    """
+    if not sample:
+        return 0.0
+    return len(zlib.compress(sample, 1)) / float(len(sample))
+
+
+class CompressionPolicy(object):
+    """Choose the compression per file (STORED or a deflate level).
+
+    Files with a known compressed format (see STORED_EXTENSIONS) and files
+    whose first block does not compress (see sample_ratio) are stored, all
+    other files are deflated with the level of the profile.
+    """
+
+    def __init__(self, profile='balanced'):
+        if profile not in COMPRESSION_PROFILES:
+            raise ValueError('Unknown compression profile: %s' % profile)
+        self.profile = profile
+        self.level, self.max_ratio = COMPRESSION_PROFILES[profile]
+        # level (None: stored) => [files, bytes, compressed bytes, seconds]
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def choose(self, arcname, sample):
+        """Compression for a file.
+
+        :param arcname: name of the member within the archive
+        :param sample: first block of the file content
+        :return: zlib compression level or None to store the file
+        """
+        if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+            return None
+        if len(sample) >= MIN_SAMPLE_SIZE and \
+                sample_ratio(sample[:SAMPLE_SIZE]) > self.max_ratio:
+            return None
+        return self.level
+
+    def record(self, level, entry, seconds):
+        """Collect statistics about a compressed entry."""
+        with self._lock:
+            stats = self.stats.setdefault(level, [0, 0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += entry.file_size
+            stats[2] += entry.compress_size
+            stats[3] += seconds
+
+    def log_stats(self):
+        for level, (files, size, compress_size, seconds) in \
+                sorted(self.stats.items(), key=lambda s: s[0] or 0):
+            log.debug('compression \'%s\' %s: %d files, %0.2f MB -> '
+                      '%0.2f MB in %0.2f s', self.profile,
+                      'stored' if level is None else 'level %d' % level,
+                      files, size / 1000000.0, compress_size / 1000000.0,
+                      seconds)
+
+
+def file_attributes(st):
+    """Zip date_time and external_attr for a file like ZipFile.write.
+
+    :param st: os.stat result of the file
+    :return: tuple (date_time, external_attr)
+    """
+    date_time = time.localtime(st.st_mtime)[0:6]
+    if date_time[0] < 1980:
+        # zip can not represent timestamps before 1980
+        date_time = (1980, 1, 1, 0, 0, 0)
+    return date_time, (st.st_mode & 0xFFFF) << 16
+
+
+def normalize_entry(entry):
+    """Remove host specific metadata (mtime, permissions) from an entry.
+
+    Executable files get mode 0755, all other files 0644.
+
+    :param entry: ZipEntry (modified in place)
+    :return: entry
+    """
+    mode = (entry.external_attr >> 16) & 0xFFFF
+    if mode & 0o111:
+        mode = stat.S_IFREG | 0o755
+    else:
+        mode = stat.S_IFREG | 0o644
+    entry.date_time = DETERMINISTIC_DATE_TIME
+    entry.external_attr = mode << 16
+    return entry
+
+
+def _dos_date_time(date_time):
+    dosdate = (date_time[0] - 1980) << 9 | date_time[1] << 5 | date_time[2]
+    dostime = date_time[3] << 11 | date_time[4] << 5 | (date_time[5] // 2)
+    return dosdate, dostime
+
+
+def _encode_arcname(arcname):
+    if isinstance(arcname, bytes):
+        return arcname, 0
+    try:
+        return arcname.encode('ascii'), 0
+    except UnicodeEncodeError:
+        return arcname.encode('utf-8'), _FLAG_UTF8
+
+
+def worker_count(workers):
+    """Number of worker threads to use (None: one per cpu)."""
+    if workers is None:
+        return cpu_count()
+    return max(1, int(workers))
+
+
+def imap_entries(func, tasks, workers=1, chunksize=16):
+    """Run func(*task) for each task and yield the results in task order.
+
+    :param func: function creating a ZipEntry
+    :param tasks: iterable of argument tuples for func
+    :param workers: number of threads to use (None: one per cpu)
+    :param chunksize: number of tasks handed to a worker at once
+    :return: iterator of func results
+    """
+    workers = worker_count(workers)
+    if workers == 1:
+        for task in tasks:
+            yield func(*task)
+        return
+
+    # zlib releases the GIL while compressing so threads scale with cores
+    pool = ThreadPool(workers)
+    try:
+        for result in pool.imap(lambda args: func(*args), tasks, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class ZipWriter(object):
+    """Write ZipEntry instances in order to a file object."""
+
+    def __init__(self, fileobj):
+        self._fp = fileobj
+        self._offset = 0
+        self._central_dir = []
+        self._sha256 = hashlib.sha256()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+    @property
+    def offset(self):
+        """Number of bytes written so far."""
+        return self._offset
+
+    @property
+    def sha256(self):
+        """Hex digest of the bytes written so far."""
+        return self._sha256.hexdigest()
+
+    def _write(self, data):
+        self._fp.write(data)
+        self._sha256.update(data)
+        self._offset += len(data)
+
+    def add(self, entry):
+        """Append an entry to the archive.
+
+        :param entry: ZipEntry
+        """
+        if entry.file_size > _ZIP64_LIMIT or \
+                entry.compress_size > _ZIP64_LIMIT:
+            raise ValueError('File size too large: %s' % entry.arcname)
+        name, flags = _encode_arcname(entry.arcname)
+        dosdate, dostime = _dos_date_time(entry.date_time)
+        header_offset = self._offset
+        self._write(struct.pack(
+            _STRUCT_FILE_HEADER, _STRING_FILE_HEADER, _ZIP_VERSION, 0,
+            flags, entry.compress_type, dostime, dosdate, entry.crc,
+            entry.compress_size, entry.file_size, len(name), 0))
+        self._write(name)
+        self._write(entry.data)
+        # only keep what is needed for the central directory
+        self._central_dir.append(
+            (name, flags, entry.compress_type, dostime, dosdate, entry.crc,
+             entry.compress_size, entry.file_size, entry.external_attr,
+             header_offset))
+
+    def close(self):
+        """Write the central directory."""
+        start_dir = self._offset
+        for (name, flags, compress_type, dostime, dosdate, crc, compress_size,
+             file_size, external_attr, header_offset) in self._central_dir:
+            if header_offset > _ZIP64_LIMIT:
+                raise ValueError('Archive too large for zip format')
+            self._write(struct.pack(
+                _STRUCT_CENTRAL_DIR, _STRING_CENTRAL_DIR, _ZIP_VERSION,
+                _CREATE_SYSTEM_UNIX, _ZIP_VERSION, 0, flags, compress_type,
+                dostime, dosdate, crc, compress_size, file_size, len(name),
+                0, 0, 0, 0, external_attr, header_offset))
+            self._write(name)
+
+        count = len(self._central_dir)
+        size_dir = self._offset - start_dir
+        offset_dir = start_dir
+        if count > _ZIP_FILECOUNT_LIMIT or start_dir > _ZIP64_LIMIT:
+            # too many entries for the classic end record
+            zip64_end = self._offset
+            self._write(struct.pack(
+                _STRUCT_END_ARCHIVE64, _STRING_END_ARCHIVE64, 44,
+                _ZIP64_VERSION, _ZIP64_VERSION, 0, 0, count, count,
+                size_dir, start_dir))
+            self._write(struct.pack(
+                _STRUCT_END_ARCHIVE64_LOCATOR, _STRING_END_ARCHIVE64_LOCATOR,
+                0, zip64_end, 1))
+            count = min(count, 0xFFFF)
+            offset_dir = min(start_dir, 0xFFFFFFFF)
+        self._write(struct.pack(
+            _STRUCT_END_ARCHIVE, _STRING_END_ARCHIVE, 0, 0, count, count,
+            size_dir, offset_dir, 0))
+        if hasattr(self._fp, 'flush'):
+            self._fp.flush()
+
+
+class ZipBundle(object):
+    """Handle to a finished bundle written to a file object.
+
+    The bundle data stays in the file; use getvalue() where bytes are
+    required (e.g. for backwards compatibility).
+    """
+
+    def __init__(self, fileobj, size, sha256):
+        self.fileobj = fileobj
+        self.size = size
+        self.sha256 = sha256
+        self._mmap = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def path(self):
+        """Path of the bundle file or None if the file has no name."""
+        name = getattr(self.fileobj, 'name', None)
+        if isinstance(name, (bytes, type(''))):
+            return name
+        return None
+
+    def getvalue(self):
+        """Read the whole bundle into memory.
+
+        :return: bundle as bytes
+        """
+        self.fileobj.seek(0)
+        return self.fileobj.read()
+
+    def getbuffer(self):
+        """Memory mapped view of the bundle (falls back to getvalue()). The
+        mapping is closed with the bundle, release the views before.
+
+        :return: memoryview
+        """
+        if self._mmap is None:
+            try:
+                self._mmap = mmap.mmap(self.fileobj.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+            except (AttributeError, IOError, OSError, ValueError):
+                # no file descriptor (i.e. BytesIO) or empty file
+                return memoryview(self.getvalue())
+        try:
+            return memoryview(self._mmap)
+        except TypeError:
+            # python 2: mmap does not support memoryview
+            return memoryview(self._mmap[:])
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # views are still exported, unmapped once they are released
+                pass
+            self._mmap = None
+        self.fileobj.close()
+
+
+class SizeBudget(object):
+    """Track the size of a bundle while it is written.
+
+    Sizes are in MB (1000000 bytes) like the Lambda limits. As soon as a
+    limit is crossed BundleSizeLimitExceeded is raised so the remaining
+    files are not compressed.
+    """
+
+    def __init__(self, compressed=None, uncompressed=None):
+        self.limits = {'compressed': compressed, 'uncompressed': uncompressed}
+        self.sizes = {'compressed': _END_ARCHIVE_SIZE, 'uncompressed': 0}
+        self.contributors = {}
+
+    def add(self, entry):
+        """Account for an entry before it is written.
+
+        :param entry: ZipEntry
+        """
+        name = _encode_arcname(entry.arcname)[0]
+        compressed = _FILE_HEADER_SIZE + _CENTRAL_DIR_SIZE + 2 * len(name) + \
+            entry.compress_size
+        self.sizes['compressed'] += compressed
+        self.sizes['uncompressed'] += entry.file_size
+
+        top_level = entry.arcname.split('/', 1)[0]
+        sizes = self.contributors.setdefault(top_level, [0, 0])
+        sizes[0] += compressed
+        sizes[1] += entry.file_size
+
+        for kind in ['compressed', 'uncompressed']:
+            limit = self.limits[kind]
+            if limit is not None and self.sizes[kind] / 1000000.0 >= limit:
+                raise BundleSizeLimitExceeded(
+                    kind=kind, limit=limit,
+                    contributors=self.format_contributors(kind))
+
+    def largest_contributors(self, kind='compressed', count=5):
+        """Top-level folders / packages contributing most to the bundle.
+
+        :param kind: 'compressed' or 'uncompressed'
+        :param count: number of contributors
+        :return: list of (name, size in bytes)
+        """
+        idx = 0 if kind == 'compressed' else 1
+        contributors = sorted(self.contributors.items(),
+                              key=lambda c: c[1][idx], reverse=True)
+        return [(name, sizes[idx]) for name, sizes in contributors[:count]]
+
+    def format_contributors(self, kind='compressed', count=5):
+        return ', '.join(
+            '%s (%0.2f MB)' % (name, size / 1000000.0)
+            for name, size in self.largest_contributors(kind, count))
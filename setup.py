@@ -47,5 +47,9 @@ setup(
         'gcdt10': [
             'bundler=gcdt_bundler.bundler',
         ],
+        'console_scripts': [
+            'gcdt-bundler-cache=gcdt_bundler.deps_cache:main',
+            'gcdt-bundler-watch=gcdt_bundler.bundler:watch_main',
+        ],
     }
 )
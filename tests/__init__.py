@@ -5,3 +5,14 @@ import os
 
 def here(p):
     return os.path.abspath(os.path.join(os.path.dirname(__file__), p))
+
+
+def write_file(path, content, mode=None):
+    # create a text file including its folder
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(path, 'w') as f:
+        f.write(content)
+    if mode is not None:
+        os.chmod(path, mode)
@@ -3,18 +3,32 @@ from __future__ import unicode_literals, print_function
 import tarfile
 import os
 import io
+import hashlib
 import textwrap
 import logging
-from zipfile import ZipFile
-
+import random
+import time
+import calendar
+import subprocess
+import sys
+from multiprocessing import cpu_count
+from zipfile import ZipFile, ZIP_DEFLATED
+
+import mock
 import pytest
 from gcdt_testtools.helpers import temp_folder, create_tempfile, get_size, \
     cleanup_tempfiles, list_zip
 from gcdt_testtools import helpers
 
 from gcdt_bundler.bundler import bundle_revision, _install_dependencies_with_npm, \
-    get_zipped_file, prebundle, make_zip_file_bytes
-from . import here
+    get_zipped_file, prebundle, make_zip_file_bytes, make_zip_file, \
+    get_size_limits, compare_compression_profiles, bundle, \
+    check_buffer_exceeds_limit
+from gcdt_bundler.wheels import install_wheels
+from gcdt_bundler.pruning import Pruner
+from gcdt_bundler.bytecode import BytecodeCompiler
+from gcdt_bundler.tar_compression import ParallelGzipWriter
+from . import here, write_file
 
 log = logging.getLogger(__name__)
 
@@ -169,6 +183,49 @@ def test_get_zipped_file_exceeds_limit(temp_folder):
     # TODO add proper log capture that works!
 
 
+def test_get_zipped_file_size_limits(temp_folder):
+    folders_from_file = [
+        {'source': './impl', 'target': 'impl'}
+    ]
+    os.mkdir('./impl')
+    with open('./handler.py', 'w') as req:
+        req.write('# this is my lambda handler\n')
+    with open('./impl/bigfile', 'wb') as bigfile:
+        bigfile.write(os.urandom(1000000))  # 1 MB
+
+    size_limits = {'python2.7': {'compressed': 0.5}}
+    assert get_zipped_file('handler.py', list(folders_from_file),
+                           size_limits=size_limits) is None
+    assert get_zipped_file('handler.py', list(folders_from_file),
+                           runtime='python3.6',
+                           size_limits=size_limits) is not None
+
+
+def test_get_size_limits():
+    size_limits = {
+        'default': {'uncompressed': 200},
+        'python3.6': {'compressed': 10}
+    }
+    assert get_size_limits('python2.7') == \
+        {'compressed': 50.0, 'uncompressed': 250.0}
+    assert get_size_limits('python2.7', size_limits) == \
+        {'compressed': 50.0, 'uncompressed': 200}
+    assert get_size_limits('python3.6', size_limits) == \
+        {'compressed': 10, 'uncompressed': 200}
+
+
+def test_check_buffer_exceeds_limit_deprecated():
+    size_limits = {'python3.6': {'compressed': 1}}
+    with pytest.warns(DeprecationWarning):
+        assert check_buffer_exceeds_limit(b'x' * 1000000) is False
+    with pytest.warns(DeprecationWarning):
+        assert check_buffer_exceeds_limit(
+            b'x' * 1000000, 'python3.6', size_limits) is True
+    with pytest.warns(DeprecationWarning):
+        assert check_buffer_exceeds_limit(
+            b'x' * 999999, 'python3.6', size_limits) is False
+
+
 def test_get_zipped_file_empty_requirements_txt(temp_folder):
     def list_zip(input_zip):
         # use string as buffer
@@ -304,3 +361,499 @@ def test_make_zip_file_bytes_add_artifact():
 
     assert len(actual_files) == 1
     assert 'settings.conf' in actual_files
+
+
+def test_make_zip_file_bytes_workers(temp_folder):
+    # the archive must not depend on the number of workers
+    os.mkdir('./root')
+    for i in range(50):
+        create_tempfile('some content for my file %d\n' % i * 50,
+                        dir=temp_folder[0] + '/root')
+    folders_from_file = [
+        {'source': 'root/**', 'target': 'blub/'}
+    ]
+
+    sequential = make_zip_file_bytes(folders_from_file)
+    parallel = make_zip_file_bytes(folders_from_file, workers=4)
+
+    assert sequential == parallel
+    assert ZipFile(io.BytesIO(parallel)).testzip() is None
+    assert len(list(list_zip(parallel))) == 50
+
+
+def _touch_all(folder, mtime):
+    for dirpath, _, filenames in os.walk(folder):
+        for filename in filenames:
+            os.utime(os.path.join(dirpath, filename), (mtime, mtime))
+
+
+def test_make_zip_file_deterministic(temp_folder):
+    os.mkdir('./root')
+    for i in range(10):
+        create_tempfile('some content for my file %d' % i,
+                        dir=temp_folder[0] + '/root')
+    folders_from_file = [
+        {'source': 'root/**', 'target': 'blub/'}
+    ]
+
+    _touch_all('./root', 1500000000)
+    first = make_zip_file(folders_from_file, deterministic=True)
+    _touch_all('./root', 1600000000)
+    os.chmod('./root/' + os.listdir('./root')[0], 0o600)
+    second = make_zip_file(folders_from_file, deterministic=True)
+
+    assert first.sha256 == second.sha256
+    assert first.getvalue() == second.getvalue()
+    names = list(list_zip(first.getvalue()))
+    assert names == sorted(names)
+    info = ZipFile(io.BytesIO(first.getvalue())).infolist()[0]
+    assert info.date_time == (1980, 1, 1, 0, 0, 0)
+    assert info.external_attr >> 16 == 0o100644
+
+
+def test_bundle_revision_deterministic(temp_folder):
+    folders = [{
+        'source': here('resources/simple_codedeploy/**'),
+        'target': ''
+    }]
+    artifacts = [{
+        'content': 'some content',
+        'target': 'stack_output.yml',
+        'attr': 0o644  # permissions -rw-r--r--
+    }]
+
+    os.mkdir('./first')
+    os.mkdir('./second')
+    first = bundle_revision(folders, outputpath=temp_folder[0] + '/first',
+                            artifacts=artifacts, deterministic=True)
+    second = bundle_revision(folders, outputpath=temp_folder[0] + '/second',
+                             artifacts=artifacts, deterministic=True)
+
+    with open(first, 'rb') as f1, open(second, 'rb') as f2:
+        assert f1.read() == f2.read()
+    tar = tarfile.open(first)
+    names = [t.name for t in tar.getmembers()]
+    assert names[:-1] == sorted(names[:-1])
+    assert names[-1] == 'stack_output.yml'
+    assert set(t.mtime for t in tar.getmembers()) == {315532800}
+
+
+def test_bundle_revision_parallel_gzip(temp_folder):
+    folders = [{
+        'source': here('resources/simple_codedeploy/**'),
+        'target': ''
+    }]
+    tarfile_name = bundle_revision(folders, outputpath=temp_folder[0],
+                                   workers=2)
+    assert tarfile_name.endswith('.tar.gz')
+    tar = tarfile.open(tarfile_name)
+    assert sorted(tar.getnames()) == sorted(tarfile.open(
+        bundle_revision(folders, outputpath=temp_folder[0])).getnames())
+
+
+def test_compare_compression_profiles(temp_folder):
+    os.mkdir('./root')
+    for i in range(10):
+        create_tempfile('some content for my file %d\n' % i * 100,
+                        dir=temp_folder[0] + '/root')
+    with open('./root/image.png', 'wb') as f:
+        f.write(os.urandom(100000))
+    folders_from_file = [
+        {'source': 'root/**', 'target': ''}
+    ]
+
+    results = compare_compression_profiles(folders_from_file)
+
+    assert [r['profile'] for r in results] == \
+        [None, 'balanced', 'fast', 'max']
+    assert results[0]['bytes_saved'] == 0
+    # the png is stored instead of deflated
+    assert ZipFile(io.BytesIO(make_zip_file_bytes(
+        folders_from_file, compression='balanced'))).getinfo(
+        'image.png').compress_type == 0
+
+
+def test_make_zip_file_to_path(temp_folder):
+    settings_file = {
+        'content': b'this is my settings file content',
+        'target': 'settings.conf',
+        'attr': 0o644  # permissions -r-wr--r--
+    }
+    bundle = make_zip_file([], artifacts=[settings_file],
+                           outfile=temp_folder[0] + '/bundle.zip')
+    bundle.close()
+
+    assert bundle.path == temp_folder[0] + '/bundle.zip'
+    with open(bundle.path, 'rb') as f:
+        content = f.read()
+    assert bundle.size == len(content)
+    assert bundle.sha256 == hashlib.sha256(content).hexdigest()
+    assert list(list_zip(content)) == ['settings.conf']
+
+
+def test_make_zip_file_to_writable():
+    settings_file = {
+        'content': b'this is my settings file content',
+        'target': 'settings.conf'
+    }
+    buf = io.BytesIO()
+    bundle = make_zip_file([], artifacts=[settings_file], outfile=buf)
+
+    assert bundle.path is None
+    assert bundle.getvalue() == buf.getvalue()
+    assert bundle.getbuffer().tobytes() == buf.getvalue()
+    assert len(bundle) == len(buf.getvalue())
+
+
+def test_make_zip_file_tempfile():
+    settings_file = {
+        'content': 'this is my settings file content',
+        'target': 'settings.conf'
+    }
+    bundle = make_zip_file([], artifacts=[settings_file])
+    path = bundle.path
+
+    assert os.path.isfile(path)
+    assert bundle.getbuffer().tobytes() == bundle.getvalue()
+    assert bundle.sha256 == hashlib.sha256(bundle.getvalue()).hexdigest()
+    bundle.close()
+    assert not os.path.exists(path)
+
+
+def test_get_zipped_file_return_bundle(temp_folder):
+    with open('./handler.py', 'w') as req:
+        req.write('# this is my lambda handler\n')
+
+    bundle = get_zipped_file('handler.py', [], return_bundle=True)
+
+    assert list(list_zip(bundle.getvalue())) == ['handler.py']
+    bundle.close()
+
+
+def test_bundle_ramuda_closes_bundle(temp_folder, monkeypatch):
+    monkeypatch.setenv('GCDT_BUNDLER_CACHE_DIR', temp_folder[0] + '/cache')
+    write_file('./handler.py', '# this is my lambda handler\n')
+    bundles = []
+
+    def _get_zipped_file(*args, **kwargs):
+        bundles.append(get_zipped_file(*args, **kwargs))
+        return bundles[-1]
+
+    context = {'tool': 'ramuda', 'command': 'bundle',
+               '_arguments': {'--keep': False}}
+    config = {'ramuda': {'lambda': {'runtime': 'python3.6',
+                                    'handlerFile': 'handler.py'},
+                         'bundling': {'folders': []}}}
+    with mock.patch('gcdt_bundler.bundler.get_zipped_file',
+                    side_effect=_get_zipped_file):
+        bundle((context, config))
+
+    assert list(list_zip(context['_zipfile'])) == ['handler.py']
+    assert context['_zipfile_sha256'] == \
+        hashlib.sha256(context['_zipfile']).hexdigest()
+    # the temporary file of the bundle is removed
+    assert bundles[0].fileobj.closed
+    assert '_zipfile_bundle' not in context
+
+
+@pytest.mark.slow
+def test_make_zip_file_bytes_workers_benchmark(temp_folder):
+    # 10k files with ~4KB of compressible content each
+    words = ['%08x' % random.getrandbits(32) for _ in range(512)]
+    for d in range(100):
+        folder = './site-packages/package_%d' % d
+        os.makedirs(folder)
+        for f in range(100):
+            with open('%s/module_%d.py' % (folder, f), 'w') as mod:
+                mod.write(' '.join(words[(d * f + i) % 512]
+                                   for i in range(450)))
+    folders_from_file = [
+        {'source': 'site-packages', 'target': ''}
+    ]
+
+    parallel_workers = max(2, cpu_count())
+    timings = {}
+    results = {}
+    for workers in [1, parallel_workers]:
+        start = time.time()
+        results[workers] = make_zip_file_bytes(folders_from_file,
+                                               workers=workers)
+        timings[workers] = time.time() - start
+        log.info('workers: %d, %0.2f s', workers, timings[workers])
+
+    assert len(set(results.values())) == 1
+    assert len(list(list_zip(results[1]))) == 10000
+    log.info('speedup: %0.2fx', timings[1] / timings[parallel_workers])
+    # not slower than a single worker (tolerance for noisy machines)
+    assert timings[parallel_workers] <= timings[1] * 1.2
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_bundle_revision_error_removes_bundle(temp_folder, workers):
+    write_file('./codedeploy/sample.txt', 'sample')
+    os.mkdir('./out')
+    with mock.patch('gcdt_bundler.tar_compression.ParallelGzipWriter.close',
+                    autospec=True, side_effect=ParallelGzipWriter.close) \
+            as close:
+        with pytest.raises(AttributeError):
+            bundle_revision([{'source': 'codedeploy', 'target': ''}],
+                            outputpath=temp_folder[0] + '/out',
+                            artifacts=[{'content': None, 'target': 'x'}],
+                            workers=workers)
+        # the compression threads are stopped
+        assert close.called == (workers > 1)
+    assert os.listdir('./out') == []
+
+
+@pytest.mark.slow
+def test_bundle_revision_workers_benchmark(temp_folder):
+    # ~40MB of compressible content
+    words = ['%08x' % random.getrandbits(32) for _ in range(512)]
+    for d in range(10):
+        folder = './data/package_%d' % d
+        os.makedirs(folder)
+        for f in range(10):
+            with open('%s/file_%d.txt' % (folder, f), 'w') as data:
+                data.write(' '.join(random.choice(words)
+                                    for i in range(45000)))
+    folders = [{'source': 'data/**', 'target': ''}]
+
+    size = sum(os.path.getsize(os.path.join(dirpath, f))
+               for dirpath, _, filenames in os.walk('./data')
+               for f in filenames)
+
+    parallel_workers = max(2, cpu_count())
+    cases = [('gzip', 1), ('gzip', parallel_workers)]
+    try:
+        import zstandard
+        cases += [('zstd', 1), ('zstd', parallel_workers)]
+    except ImportError:
+        zstandard = None
+        log.info('zstandard is not installed, skipping zstd')
+    timings = {}
+    for compression, workers in cases:
+        outputpath = '%s/out_%s_%d' % (temp_folder[0], compression, workers)
+        os.mkdir(outputpath)
+        start = time.time()
+        tarfile_name = bundle_revision(
+            folders, outputpath=outputpath, compression=compression,
+            workers=workers)
+        timings[(compression, workers)] = time.time() - start
+        log.info('%s, workers: %d, %0.2f s (%0.1f MB/s), %d bytes',
+                 compression, workers, timings[(compression, workers)],
+                 size / 1000000.0 / timings[(compression, workers)],
+                 os.path.getsize(tarfile_name))
+        if compression == 'zstd':
+            with open(tarfile_name, 'rb') as f:
+                reader = zstandard.ZstdDecompressor().stream_reader(f)
+                with tarfile.open(fileobj=reader, mode='r|') as tar:
+                    assert len(tar.getnames()) == 100
+        else:
+            with tarfile.open(tarfile_name) as tar:
+                assert len(tar.getnames()) == 100
+    log.info('gzip speedup: %0.2fx',
+             timings[('gzip', 1)] / timings[('gzip', parallel_workers)])
+    if zstandard is not None:
+        log.info('zstd vs. gzip (%d workers): %0.2fx', parallel_workers,
+                 timings[('gzip', parallel_workers)] /
+                 timings[('zstd', parallel_workers)])
+
+
+def _write_wheel(path, package, modules, content, members=None):
+    with ZipFile(path, 'w', ZIP_DEFLATED) as z:
+        for i in range(modules):
+            z.writestr('%s/module_%d.py' % (package, i),
+                       content.encode('utf-8'))
+        for name, data in members or []:
+            z.writestr(name, data.encode('utf-8'))
+        z.writestr('%s-1.0.dist-info/METADATA' % package,
+                   ('Name: %s' % package).encode('utf-8'))
+        z.writestr('%s-1.0.dist-info/RECORD' % package, b'')
+
+
+def test_make_zip_file_with_wheels(temp_folder):
+    os.mkdir('./impl')
+    with open('./impl/handler.py', 'w') as f:
+        f.write('# handler')
+    os.mkdir('./wheels')
+    _write_wheel('./wheels/pkg-1.0-py3-none-any.whl', 'pkg', 2, 'x = 1\n')
+
+    bundle = make_zip_file([{'source': './impl', 'target': ''}],
+                           wheels=['./wheels/pkg-1.0-py3-none-any.whl'],
+                           dist_info='minimal')
+    zfile = ZipFile(io.BytesIO(bundle.getvalue()))
+    assert zfile.testzip() is None
+    assert zfile.namelist() == [
+        'handler.py', 'pkg/module_0.py', 'pkg/module_1.py',
+        'pkg-1.0.dist-info/METADATA']
+    assert zfile.read('pkg/module_1.py') == b'x = 1\n'
+
+
+@pytest.mark.parametrize('deterministic', [False, True])
+def test_make_zip_file_with_wheels_overlapping(temp_folder, deterministic):
+    # namespace package in two wheels, a project file shadows a member
+    write_file('./impl/pkg/module_0.py', 'project')
+    os.mkdir('./wheels')
+    wheels = ['./wheels/google_auth-1.0-py3-none-any.whl',
+              './wheels/google_api-1.0-py3-none-any.whl',
+              './wheels/pkg-1.0-py3-none-any.whl']
+    _write_wheel(wheels[0], 'google_auth', 0, '',
+                 members=[('google/__init__.py', 'auth'),
+                          ('google/auth.py', 'auth')])
+    _write_wheel(wheels[1], 'google_api', 0, '',
+                 members=[('google/__init__.py', 'api'),
+                          ('google/api.py', 'api')])
+    _write_wheel(wheels[2], 'pkg', 2, 'wheel')
+
+    bundle = make_zip_file([{'source': './impl', 'target': ''}],
+                           wheels=wheels, dist_info='strip',
+                           deterministic=deterministic)
+    zfile = ZipFile(io.BytesIO(bundle.getvalue()))
+    assert sorted(zfile.namelist()) == [
+        'google/__init__.py', 'google/api.py', 'google/auth.py',
+        'pkg/module_0.py', 'pkg/module_1.py']
+    # the last wheel wins as if they were unpacked
+    assert zfile.read('google/__init__.py') == b'api'
+    assert zfile.read('pkg/module_0.py') == b'project'
+    assert zfile.read('pkg/module_1.py') == b'wheel'
+
+
+@pytest.mark.slow
+def test_make_zip_file_wheel_passthrough_benchmark(temp_folder):
+    # 20 wheels with 250 modules (~8KB each)
+    words = ['%08x' % random.getrandbits(32) for _ in range(512)]
+    os.mkdir('./wheels')
+    wheels = []
+    for w in range(20):
+        wheels.append('./wheels/package_%d-1.0-py3-none-any.whl' % w)
+        _write_wheel(wheels[-1], 'package_%d' % w, 250,
+                     ' '.join(random.choice(words) for _ in range(900)))
+
+    start = time.time()
+    install_wheels(wheels, './site-packages')
+    unpacked = make_zip_file([{'source': './site-packages', 'target': ''}])
+    unpack_time = time.time() - start
+
+    start = time.time()
+    passthrough = make_zip_file([], wheels=wheels)
+    passthrough_time = time.time() - start
+
+    log.info('unpack and compress: %0.2f s, passthrough: %0.2f s (%0.1fx)',
+             unpack_time, passthrough_time, unpack_time / passthrough_time)
+    names = sorted(ZipFile(io.BytesIO(passthrough.getvalue())).namelist())
+    assert names == sorted(
+        ZipFile(io.BytesIO(unpacked.getvalue())).namelist())
+    assert passthrough_time < unpack_time
+
+
+def test_make_zip_file_with_pruner(temp_folder):
+    for name in ['werkzeug/__init__.py', 'werkzeug/tests/test_x.py',
+                 'werkzeug/__pycache__/__init__.cpython-36.pyc',
+                 'boto3/__init__.py', 'Werkzeug-0.14.1.dist-info/RECORD']:
+        path = os.path.join('./site-packages', name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('content')
+    # project code is not pruned
+    for name in ['myapp/__init__.py', 'myapp/docs/index.py',
+                 'myapp/test/fixtures.py']:
+        path = os.path.join('./impl', name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('content')
+    pruner = Pruner('python3.6')
+
+    bundle = make_zip_file([{'source': './impl', 'target': ''},
+                            {'source': './site-packages', 'target': '',
+                             'dependencies': True}],
+                           pruner=pruner)
+
+    assert sorted(ZipFile(io.BytesIO(bundle.getvalue())).namelist()) == [
+        'myapp/__init__.py', 'myapp/docs/index.py', 'myapp/test/fixtures.py',
+        'werkzeug/__init__.py']
+    assert sum(files for files, _ in pruner.stats.values()) == 4
+    assert sum(size for _, size in pruner.stats.values()) == 4 * 7
+
+
+def _unzip_like_lambda(bundle, folder):
+    # extract with the mtimes of the entries (UTC) like on AWS Lambda
+    with ZipFile(io.BytesIO(bundle.getvalue())) as zfile:
+        for info in zfile.infolist():
+            path = zfile.extract(info, folder)
+            mtime = calendar.timegm(info.date_time + (0, 0, 0))
+            os.utime(path, (mtime, mtime))
+
+
+def _import_time(folder, module):
+    # import time with a read-only bundle (no bytecode is written)
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    output = subprocess.check_output(
+        [sys.executable, '-c',
+         'import time; start = time.time(); import %s; '
+         'print(time.time() - start)' % module],
+        cwd=folder, env=env)
+    return float(output.decode('utf-8'))
+
+
+def test_make_zip_file_with_compiler(temp_folder):
+    os.mkdir('./impl')
+    with open('./impl/handler.py', 'w') as f:
+        f.write('def handle(event, context):\n    return 42\n')
+    runtime = 'python%d.%d' % sys.version_info[:2]
+    compiler = BytecodeCompiler(runtime, python_exe=sys.executable)
+
+    bundle = make_zip_file([{'source': './impl', 'target': ''}],
+                           compiler=compiler, deterministic=True)
+    assert compiler.pyc_arcname('handler.py') in \
+        ZipFile(io.BytesIO(bundle.getvalue())).namelist()
+    _unzip_like_lambda(bundle, './unzipped')
+
+    # the bundled bytecode is valid for the unzipped source: a source with
+    # the same size and mtime but another result is not compiled again
+    path = './unzipped/handler.py'
+    st = os.stat(path)
+    with open(path, 'w') as f:
+        f.write('def handle(event, context):\n    return 43\n')
+    os.utime(path, (st.st_atime, st.st_mtime))
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    output = subprocess.check_output(
+        [sys.executable, '-c',
+         'import handler; print(handler.handle(None, None))'],
+        cwd='./unzipped', env=env)
+    assert output.strip() == b'42'
+
+
+@pytest.mark.slow
+def test_make_zip_file_compiler_import_benchmark(temp_folder):
+    # package with 200 modules (~50 functions each) imported at once
+    os.makedirs('./impl/bench_pkg')
+    with open('./impl/bench_pkg/__init__.py', 'w') as f:
+        f.write(''.join('from . import module_%d\n' % m for m in range(200)))
+    for m in range(200):
+        with open('./impl/bench_pkg/module_%d.py' % m, 'w') as f:
+            for i in range(50):
+                f.write(textwrap.dedent("""
+                    def function_%d(a, b=%d):
+                        result = [x * b for x in range(a) if x %% 3]
+                        return {'sum': sum(result), 'name': 'f%d'}
+                    """) % (i, i, i))
+    runtime = 'python%d.%d' % sys.version_info[:2]
+    paths = [{'source': './impl', 'target': ''}]
+    results = {}
+    for mode, compiler in [
+            ('source', None),
+            ('bytecode', BytecodeCompiler(runtime, python_exe=sys.executable)),
+            ('pyc_only', BytecodeCompiler(runtime, python_exe=sys.executable,
+                                          pyc_only=True))]:
+        _unzip_like_lambda(make_zip_file(paths, compiler=compiler),
+                           './' + mode)
+        results[mode] = min(_import_time('./' + mode, 'bench_pkg')
+                            for _ in range(3))
+
+    log.info('import time source: %0.3f s, bytecode: %0.3f s, '
+             'pyc only: %0.3f s', results['source'], results['bytecode'],
+             results['pyc_only'])
+    assert results['bytecode'] < results['source']
+    assert results['pyc_only'] < results['source']
@@ -3,6 +3,11 @@ from __future__ import unicode_literals, print_function
 import os
 import fnmatch
 import logging
+import time
+
+import pytest
+from pathlib2 import Path
+from gcdt_testtools.helpers import temp_folder
 
 from gcdt_bundler.bundler_utils import glob_files, get_path_info
 from . import here
@@ -55,6 +60,107 @@ def test_exclude_file_with_gcdtignore():
     ]
 
 
+def _make_tree(files):
+    for f in files:
+        folder = os.path.dirname(f)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(f, 'w') as fh:
+            fh.write(f)
+
+
+def _pathlib_glob(root_dir, pattern):
+    # reference: the former implementation for a single include
+    if pattern.endswith('**'):
+        pattern += '/*'
+    return sorted(str(m.relative_to(root_dir))
+                  for m in Path(root_dir).glob(pattern) if not m.is_dir())
+
+
+@pytest.mark.parametrize('pattern', [
+    '**', '*', '*.py', 'a/**', 'a/*', '**/*.txt', 'a/**/c/*.txt', '*/b/**',
+    'handler.py', 'a/b', '[ab]*/**', '.hidden/**'
+])
+def test_glob_files_same_as_pathlib(temp_folder, pattern):
+    _make_tree(['handler.py', 'x.txt', 'a/a.txt', 'a/a.py', 'a/b/b.txt',
+                'a/b/c/c.txt', 'a/c/c.txt', 'b/b/b.txt', 'b/x.py',
+                '.hidden/h.txt'])
+    result = sorted(rel for _, rel in glob_files(temp_folder[0], [pattern]))
+    assert result == _pathlib_glob(temp_folder[0], pattern)
+
+
+def test_glob_files_later_include_once(temp_folder):
+    _make_tree(['a/aa.txt', 'a/sub/x.txt', 'b/ba.txt'])
+    result = list(glob_files(temp_folder[0], ['**', 'a/**']))
+    assert [rel for _, rel in result] == ['a/aa.txt', 'a/sub/x.txt',
+                                          'b/ba.txt']
+    assert result[0] == (temp_folder[0] + '/a/aa.txt', 'a/aa.txt')
+
+
+def test_glob_files_exclude_patterns(temp_folder):
+    _make_tree(['a/aa.txt', 'a/sub/aa.txt', 'a/ab.py'])
+    result = [rel for _, rel in
+              glob_files(temp_folder[0], ['**'], ['*.py', 'sub/*'])]
+    assert result == ['a/aa.txt']
+
+
+def test_glob_files_symlinked_folder(temp_folder):
+    _make_tree(['real/a.txt'])
+    os.symlink(temp_folder[0] + '/real', temp_folder[0] + '/link')
+    # like pathlib '**' does not follow symlinked folders
+    assert [rel for _, rel in glob_files(temp_folder[0], ['**'])] == \
+        ['real/a.txt']
+    assert [rel for _, rel in glob_files(temp_folder[0], ['link/*'])] == \
+        ['link/a.txt']
+
+
+def test_glob_files_prunes_ignored_folders(temp_folder):
+    _make_tree(['handler.py', '.git/config', '.git/objects/a/b',
+                'tests/test_handler.py', 'node_modules/.cache/x.js',
+                'node_modules/lib/index.js', 'lib/tests.py'])
+    stats = {}
+    result = list(glob_files(temp_folder[0], ['**'],
+                             gcdtignore=['.git/', 'tests/',
+                                         'node_modules/.cache/', '*.pyc'],
+                             stats=stats))
+    assert [rel for _, rel in result] == ['handler.py', 'lib/tests.py',
+                                          'node_modules/lib/index.js']
+    assert stats == {'dirs_pruned': 3, 'files_skipped': 0}
+
+
+def test_glob_files_gcdtignore_negated_pattern(temp_folder):
+    _make_tree(['handler.py', 'tests/test_handler.py', 'tests/keep.py'])
+    stats = {}
+    result = list(glob_files(temp_folder[0], ['**'],
+                             gcdtignore=['tests/*', '!keep.py'],
+                             stats=stats))
+    assert [rel for _, rel in result] == ['handler.py', 'tests/keep.py']
+    assert stats == {'dirs_pruned': 0, 'files_skipped': 1}
+
+
+@pytest.mark.slow
+def test_glob_files_benchmark(temp_folder):
+    # 50k files in 500 folders
+    for d in range(50):
+        for s in range(10):
+            folder = 'package_%d/sub_%d' % (d, s)
+            os.makedirs(folder)
+            for f in range(100):
+                open('%s/module_%d.py' % (folder, f), 'w').close()
+    gcdtignore = ['*.pyc', '.git/', 'tests/', '*.md']
+
+    start = time.time()
+    result = list(glob_files(temp_folder[0], ['**'], gcdtignore=gcdtignore))
+    duration = time.time() - start
+    assert len(result) == 50000
+    log.info('glob_files: %d files in %0.2f s', len(result), duration)
+
+    start = time.time()
+    reference = _pathlib_glob(temp_folder[0], '**')
+    log.info('pathlib glob: %0.2f s', time.time() - start)
+    assert sorted(rel for _, rel in result) == reference
+
+
 def test_how_crazy_is_it():
     f = '/a/b/c/d.txt'
     p = '/a/**/d.txt'
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import struct
+import sys
+import zipfile
+import logging
+
+import pytest
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler.zip_writer import read_raw_entries
+from gcdt_bundler.bytecode import BytecodeCompiler, \
+    InterpreterMismatchError, _source_mtime
+from . import write_file
+
+log = logging.getLogger(__name__)
+
+RUNTIME = 'python%d.%d' % sys.version_info[:2]
+
+
+@pytest.mark.parametrize('runtime, pyc_only, expected', [
+    ('python2.7', False, 'pkg/mod.pyc'),
+    ('python3.6', False, 'pkg/__pycache__/mod.cpython-36.pyc'),
+    ('python3.6', True, 'pkg/mod.pyc'),
+])
+def test_pyc_arcname(runtime, pyc_only, expected):
+    compiler = BytecodeCompiler(runtime, pyc_only=pyc_only)
+    assert compiler.pyc_arcname('pkg/mod.py') == expected
+
+
+def test_source_mtime():
+    # 2018-06-27 12:30:00 UTC, zip times are rounded down to even seconds
+    assert _source_mtime((2018, 6, 27, 12, 30, 1)) == 1530102600
+
+
+def test_compile_tasks(temp_folder):
+    write_file('./src/pkg/__init__.py', 'x = 1\n')
+    write_file('./src/pkg/broken.py', 'def (\n')
+    write_file('./src/pkg/data.json', '{}')
+    tasks = [('./src/pkg/__init__.py', 'pkg/__init__.py'),
+             ('./src/pkg/broken.py', 'pkg/broken.py'),
+             ('./src/pkg/data.json', 'pkg/data.json')]
+    compiler = BytecodeCompiler(RUNTIME, python_exe=sys.executable,
+                                workers=2)
+    try:
+        result = compiler.compile_tasks(tasks, deterministic=True)
+        pyc_arcname = compiler.pyc_arcname('pkg/__init__.py')
+        assert [arcname for _, arcname in result] == [
+            'pkg/__init__.py', 'pkg/broken.py', 'pkg/data.json', pyc_arcname]
+        with open(result[-1][0], 'rb') as f:
+            header = f.read(16)
+        offset = 8 if sys.version_info >= (3, 7) else 4
+        # mtime of the source unzipped from a deterministic bundle
+        assert struct.unpack('<I', header[offset:offset + 4])[0] == 315532800
+        assert compiler.stats['compiled'] == 1
+        assert compiler.stats['failed'] == 1
+    finally:
+        compiler.close()
+    assert not os.path.exists(result[-1][0])
+
+
+def test_compile_tasks_pyc_only(temp_folder):
+    write_file('./src/handler.py', 'x = 1\n')
+    write_file('./src/broken.py', 'def (\n')
+    compiler = BytecodeCompiler(RUNTIME, python_exe=sys.executable,
+                                pyc_only=True)
+    try:
+        result = compiler.compile_tasks([('./src/handler.py', 'handler.py'),
+                                         ('./src/broken.py', 'broken.py')])
+        # sources which do not compile are kept
+        assert [arcname for _, arcname in result] == [
+            'broken.py', 'handler.pyc']
+    finally:
+        compiler.close()
+
+
+def test_compile_entries(temp_folder):
+    with zipfile.ZipFile('./pkg-1.0-py3-none-any.whl', 'w',
+                         zipfile.ZIP_DEFLATED) as z:
+        z.writestr('pkg/__init__.py', b'x = 1\n')
+        z.writestr('pkg-1.0.dist-info/METADATA', b'Name: pkg')
+    compiler = BytecodeCompiler(RUNTIME, python_exe=sys.executable,
+                                pyc_only=True)
+    try:
+        entries = compiler.compile_entries(
+            read_raw_entries('./pkg-1.0-py3-none-any.whl'))
+        assert [e.arcname for e in entries] == [
+            'pkg-1.0.dist-info/METADATA', 'pkg/__init__.pyc']
+    finally:
+        compiler.close()
+
+
+def test_interpreter_mismatch():
+    compiler = BytecodeCompiler('python2.6', python_exe=sys.executable)
+    with pytest.raises(InterpreterMismatchError):
+        compiler.compile([('handler.py', 'handler.py', (2018, 1, 1, 0, 0, 0))])
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import stat
+import time
+import logging
+
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler.deps_cache import DepsCache, main
+from . import write_file
+
+log = logging.getLogger(__name__)
+
+
+def test_deps_cache_key(temp_folder):
+    write_file('./requirements.txt', 'werkzeug==0.14.1\n')
+    cache = DepsCache(temp_folder[0] + '/cache')
+    key = cache.key(['requirements.txt'], 'python3.6')
+    assert key == cache.key(['requirements.txt'], 'python3.6')
+    assert key != cache.key(['requirements.txt'], 'python2.7')
+    assert key != cache.key(['requirements.txt'], 'python3.6',
+                            platform='macosx_10_13_x86_64')
+    assert key != cache.key(['requirements.txt'], 'python3.6',
+                            variant='wheels')
+    write_file('./requirements.txt', 'werkzeug==0.14.2\n')
+    assert key != cache.key(['requirements.txt'], 'python3.6')
+
+
+def test_deps_cache_store_and_restore(temp_folder):
+    write_file('./site-packages/werkzeug/__init__.py', 'version = 1')
+    write_file('./site-packages/bin/tool', '#!/bin/sh')
+    os.chmod('./site-packages/bin/tool', 0o755)
+    cache = DepsCache(temp_folder[0] + '/cache')
+
+    assert not cache.restore('somekey', './restored')
+    cache.store('somekey', './site-packages', runtime='python3.6')
+    write_file('./restored/stale.py', 'stale')
+    assert cache.restore('somekey', './restored')
+
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert sorted(os.listdir('./restored')) == ['bin', 'werkzeug']
+    with open('./restored/werkzeug/__init__.py') as f:
+        assert f.read() == 'version = 1'
+    assert stat.S_IMODE(os.stat('./restored/bin/tool').st_mode) == 0o755
+    entries = cache.entries()
+    assert [(m['key'], m['files'], m['runtime']) for m in entries] == \
+        [('somekey', 2, 'python3.6')]
+
+
+def test_deps_cache_prune(temp_folder):
+    cache_dir = temp_folder[0] + '/cache'
+    cache = DepsCache(cache_dir)
+    for i in range(3):
+        write_file('./site-packages_%d/module.py' % i, 'module %d' % i)
+        cache.store('key_%d' % i, './site-packages_%d' % i)
+        os.utime(os.path.join(cache_dir, 'key_%d.zip' % i),
+                 (time.time() - 100 + i, time.time() - 100 + i))
+    size = os.path.getsize(os.path.join(cache_dir, 'key_2.zip'))
+
+    assert cache.prune(size + 100) == ['key_0', 'key_1']
+    assert [m['key'] for m in cache.entries()] == ['key_2']
+    assert sorted(os.listdir(cache_dir)) == ['key_2.json', 'key_2.zip']
+
+
+def test_deps_cache_cli(temp_folder, monkeypatch, capsys):
+    monkeypatch.setenv('GCDT_BUNDLER_CACHE_DIR', temp_folder[0] + '/cache')
+    write_file('./site-packages/module.py', 'module')
+    DepsCache().store('somekey', './site-packages', runtime='python3.6')
+
+    assert main(['list']) == 0
+    out = capsys.readouterr()[0]
+    assert 'somekey'[:12] in out
+    assert 'python3.6' in out
+
+    assert main(['clear']) == 0
+    assert DepsCache().entries() == []
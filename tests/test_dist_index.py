@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import logging
+
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler.dist_index import DistributionIndex, normalize_name, \
+    read_distribution
+from . import write_file
+
+log = logging.getLogger(__name__)
+
+
+def test_normalize_name():
+    assert normalize_name('MySQL_python') == 'mysql-python'
+    assert normalize_name('zope.interface') == 'zope-interface'
+    assert normalize_name('Werkzeug') == 'werkzeug'
+
+
+def test_read_distribution(temp_folder):
+    write_file('./Werkzeug-0.14.1.dist-info/METADATA',
+           'Metadata-Version: 2.0\nName: Werkzeug\nVersion: 0.14.1\n\n'
+           'Version: 1.0 in the description\n')
+    write_file('./six-1.11.0-py3.6.egg-info/PKG-INFO',
+           'Metadata-Version: 1.1\nName: six\nVersion: 1.11.0\n')
+    write_file('./simplejson-3.16.0-py3.6.egg-info', 'Name: simplejson\n'
+           'Version: 3.16.0\n')
+    os.mkdir('./attrs-18.1.0.dist-info')  # no METADATA
+
+    assert read_distribution('./Werkzeug-0.14.1.dist-info') == \
+        ('Werkzeug', '0.14.1')
+    assert read_distribution('./six-1.11.0-py3.6.egg-info') == \
+        ('six', '1.11.0')
+    assert read_distribution('./simplejson-3.16.0-py3.6.egg-info') == \
+        ('simplejson', '3.16.0')
+    assert read_distribution('./attrs-18.1.0.dist-info') == \
+        ('attrs', '18.1.0')
+
+
+def test_distribution_index(temp_folder):
+    write_file('./lib/site-packages/werkzeug/__init__.py', '')
+    write_file('./lib/site-packages/Werkzeug-0.14.1.dist-info/METADATA',
+           'Name: Werkzeug\nVersion: 0.14.1\n')
+    write_file('./lib64/site-packages/psycopg2-2.7.1.dist-info/METADATA',
+           'Name: psycopg2\nVersion: 2.7.1\n')
+    index = DistributionIndex('./lib/site-packages', './lib64/site-packages',
+                              './missing/site-packages')
+
+    assert index.versions() == {'werkzeug': '0.14.1', 'psycopg2': '2.7.1'}
+    assert index.get('WERKZEUG')[:2] == ('Werkzeug', '0.14.1')
+    assert index.distributions() is index.distributions()  # cached
+
+    # rescanned after the folder changed
+    os.rename('./lib/site-packages/Werkzeug-0.14.1.dist-info',
+              './lib/site-packages/Werkzeug-0.15.0.dist-info')
+    write_file('./lib/site-packages/Werkzeug-0.15.0.dist-info/METADATA',
+           'Name: Werkzeug\nVersion: 0.15.0\n')
+    os.utime('./lib/site-packages', (0, 0))
+    assert index.versions()['werkzeug'] == '0.15.0'
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import time
+import logging
+
+import pytest
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler.bundler import make_zip_file_bytes
+from gcdt_bundler.bundler_utils import glob_files
+from gcdt_bundler.manifest import ManifestIndex
+
+log = logging.getLogger(__name__)
+
+
+def _create_tree(root, files):
+    for f in files:
+        path = os.path.join(root, f)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fh:
+            fh.write(f)
+
+
+def _age_tree(root, seconds=100):
+    # mtimes of the last second are not trusted by the manifest
+    past = time.time() - seconds
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            os.utime(os.path.join(dirpath, name), (past, past))
+        os.utime(dirpath, (past, past))
+
+
+def _glob(cache_dir, root, **kwargs):
+    manifest = ManifestIndex(cache_dir)
+    result = list(manifest.glob_files(root, **kwargs))
+    manifest.flush()
+    return manifest, result
+
+
+def test_manifest_same_as_glob_files(temp_folder):
+    root = temp_folder[0] + '/root'
+    _create_tree(root, ['handler.py', 'a/a.txt', 'a/b/b.txt', 'tests/t.py'])
+    cache_dir = temp_folder[0] + '/cache'
+    _age_tree(root)
+
+    for _ in range(2):
+        manifest, result = _glob(cache_dir, root, gcdtignore=['tests/'])
+        assert result == list(glob_files(root, gcdtignore=['tests/']))
+
+
+def test_manifest_detects_changes(temp_folder):
+    root = temp_folder[0] + '/root'
+    _create_tree(root, ['handler.py', 'a/a.txt', 'a/b/b.txt', 'c/c.txt'])
+    cache_dir = temp_folder[0] + '/cache'
+    _age_tree(root)
+
+    manifest, _ = _glob(cache_dir, root)
+    assert len(manifest.changed) == 4
+    assert manifest.stats['dirs_scanned'] == 4
+
+    manifest, _ = _glob(cache_dir, root)
+    assert manifest.changed == set()
+    assert manifest.stats == {'dirs_scanned': 0, 'dirs_reused': 4,
+                              'files_hashed': 0}
+
+    with open(root + '/a/a.txt', 'w') as f:
+        f.write('changed')
+    _create_tree(root, ['a/b/new.txt'])
+    os.remove(root + '/c/c.txt')
+    # touched but same content
+    os.utime(root + '/handler.py', None)
+
+    manifest, result = _glob(cache_dir, root)
+    assert manifest.changed == {root + '/a/a.txt', root + '/a/b/new.txt'}
+    assert manifest.removed == {root + '/c/c.txt'}
+    assert manifest.stats['dirs_scanned'] == 2  # a/b and c
+    assert [rel for _, rel in result] == ['handler.py', 'a/a.txt',
+                                          'a/b/b.txt', 'a/b/new.txt']
+
+
+def test_manifest_invalidated_by_config(temp_folder):
+    root = temp_folder[0] + '/root'
+    _create_tree(root, ['handler.py', 'tests/t.py'])
+    cache_dir = temp_folder[0] + '/cache'
+    _age_tree(root)
+
+    _glob(cache_dir, root, gcdtignore=['tests/'])
+    manifest, result = _glob(cache_dir, root)
+    assert manifest.stats['dirs_scanned'] == 2
+    assert [rel for _, rel in result] == ['handler.py', 'tests/t.py']
+    assert manifest.changed == {root + '/handler.py', root + '/tests/t.py'}
+
+
+def test_make_zip_file_with_manifest(temp_folder):
+    _create_tree(temp_folder[0], ['root/handler.py', 'root/a/a.txt'])
+    _age_tree(temp_folder[0] + '/root')
+    folders_from_file = [{'source': 'root/**', 'target': ''}]
+    manifest = ManifestIndex(temp_folder[0] + '/cache')
+    assert make_zip_file_bytes(folders_from_file, manifest=manifest) == \
+        make_zip_file_bytes(folders_from_file)
+    assert len(manifest.changed) == 2
+
+
+@pytest.mark.slow
+def test_manifest_benchmark(temp_folder):
+    root = temp_folder[0] + '/root'
+    for d in range(50):
+        for s in range(10):
+            folder = '%s/package_%d/sub_%d' % (root, d, s)
+            os.makedirs(folder)
+            for f in range(100):
+                open('%s/module_%d.py' % (folder, f), 'w').close()
+    _age_tree(root)
+    cache_dir = temp_folder[0] + '/cache'
+
+    start = time.time()
+    assert len(list(glob_files(root))) == 50000
+    log.info('glob_files: %0.2f s', time.time() - start)
+
+    start = time.time()
+    _glob(cache_dir, root)
+    cold = time.time() - start
+    start = time.time()
+    manifest, result = _glob(cache_dir, root)
+    warm = time.time() - start
+    log.info('manifest: %0.2f s (cold), %0.2f s (unchanged)', cold, warm)
+    assert len(result) == 50000
+    assert manifest.stats['dirs_scanned'] == 0
+    assert manifest.stats['files_hashed'] == 0
+    assert warm < cold
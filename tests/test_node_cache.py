@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import hashlib
+import io
+import logging
+import os
+import subprocess
+import tarfile
+import textwrap
+import threading
+import time
+
+import pytest
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler import node_cache
+from gcdt_bundler.node_cache import NodeDistributions, archive_name, \
+    NodeChecksumMissingError, NodeDigestMismatchError, \
+    UnsafeArchiveMemberError, COMPLETE_MARKER
+from gcdt_bundler.bundler import _install_dependencies_with_npm
+
+log = logging.getLogger(__name__)
+
+VERSION = '8.10.0'
+# fake npm: records the arguments and creates node_modules
+NPM_CLI = textwrap.dedent('''\
+    #!/bin/sh
+    mkdir -p node_modules/fake
+    echo "$@" > node_modules/fake/args
+    ''').encode('utf-8')
+NODE = b'#!/bin/sh\necho v' + VERSION.encode('utf-8') + b'\n'
+
+
+def _add(tar, name, data=None, mode=0o644, linkname=None):
+    info = tarfile.TarInfo(name)
+    info.mtime = 1500000000
+    info.mode = mode
+    if linkname is not None:
+        info.type = tarfile.SYMTYPE
+        info.linkname = linkname
+        tar.addfile(info)
+    elif data is None:
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        tar.addfile(info)
+    else:
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+def _node_archive(version=VERSION, members=None, links=None):
+    # prebuilt distribution: bin/node, bin/npm -> lib/node_modules/npm
+    prefix = 'node-v%s-linux-x64/' % version
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        _add(tar, prefix)
+        _add(tar, prefix + 'bin')
+        _add(tar, prefix + 'bin/node', NODE, mode=0o755)
+        _add(tar, prefix + 'bin/npm',
+             linkname='../lib/node_modules/npm/bin/npm-cli.js')
+        _add(tar, prefix + 'lib/node_modules/npm/bin/npm-cli.js', NPM_CLI,
+             mode=0o755)
+        _add(tar, prefix + 'include/node/node.h', b'/* node */\n')
+        _add(tar, prefix + 'README.md', b'node\n')
+        for name, linkname in (links or []):
+            _add(tar, name, linkname=linkname)
+        for name, data in (members or []):
+            _add(tar, name, data)
+    return buf.getvalue()
+
+
+def _serve_archive(state, archive):
+    # replace the archive, SHASUMS256.txt lists its digest
+    state['files'][state['filename']] = archive
+    state['files']['SHASUMS256.txt'] = ('%s  %s\n' % (
+        hashlib.sha256(archive).hexdigest(), state['filename'])).encode('utf-8')
+
+
+@pytest.fixture(scope='function')
+def node_dist_server(http_server):
+    # local stand-in for https://nodejs.org/dist
+    filename = archive_name(VERSION)
+    archive = _node_archive()
+    state = {'requests': [], 'files': {
+        filename: archive,
+        'SHASUMS256.txt': ('%s  %s\n%s  node-v%s.tar.gz\n' % (
+            hashlib.sha256(archive).hexdigest(), filename,
+            hashlib.sha256(b'src').hexdigest(), VERSION)).encode('utf-8')
+    }}
+
+    def do_get(request):
+        state['requests'].append(request.path)
+        data = state['files'].get(request.path.rsplit('/', 1)[-1])
+        if data is None or not request.path.startswith('/v%s/' % VERSION):
+            return 404, None, None
+        return 200, None, data
+
+    state['url'] = http_server(do_get)
+    state['filename'] = filename
+    return state
+
+
+def test_node_distribution_download(node_dist_server, temp_folder):
+    cache_dir = temp_folder[0] + '/node'
+    os.makedirs(cache_dir)
+    nodes = NodeDistributions(cache_dir, dist_url=node_dist_server['url'])
+    path = nodes.distribution(VERSION)
+
+    assert path == os.path.join(cache_dir, VERSION)
+    assert os.path.isfile(os.path.join(path, COMPLETE_MARKER))
+    assert os.access(os.path.join(path, 'bin', 'node'), os.X_OK)
+    assert os.path.islink(os.path.join(path, 'bin', 'npm'))
+    # no temporary folders are left behind
+    assert sorted(os.listdir(cache_dir)) == [VERSION, VERSION + '.lock']
+
+    # cached
+    assert nodes.distribution(VERSION) == path
+    assert len(node_dist_server['requests']) == 2  # SHASUMS256.txt, archive
+    assert (nodes.hits, nodes.misses) == (1, 1)
+
+
+def test_node_distribution_digest_mismatch(node_dist_server, temp_folder):
+    cache_dir = temp_folder[0] + '/node'
+    os.makedirs(cache_dir)
+    node_dist_server['files'][node_dist_server['filename']] = \
+        _node_archive(members=[('node-v%s-linux-x64/evil' % VERSION, b'x')])
+    nodes = NodeDistributions(cache_dir, dist_url=node_dist_server['url'])
+
+    with pytest.raises(NodeDigestMismatchError):
+        nodes.distribution(VERSION)
+    assert os.listdir(cache_dir) == [VERSION + '.lock']
+
+
+def test_node_distribution_checksum_missing(node_dist_server, temp_folder):
+    cache_dir = temp_folder[0] + '/node'
+    os.makedirs(cache_dir)
+    node_dist_server['files']['SHASUMS256.txt'] = b''
+    nodes = NodeDistributions(cache_dir, dist_url=node_dist_server['url'])
+
+    with pytest.raises(NodeChecksumMissingError):
+        nodes.distribution(VERSION)
+    # the archive is not downloaded without a checksum
+    assert len(node_dist_server['requests']) == 1
+
+
+def test_node_distribution_unsafe_member(node_dist_server, temp_folder):
+    cache_dir = temp_folder[0] + '/node'
+    os.makedirs(cache_dir)
+    _serve_archive(node_dist_server,
+                   _node_archive(members=[('../escaped', b'x')]))
+    nodes = NodeDistributions(cache_dir, dist_url=node_dist_server['url'])
+
+    with pytest.raises(UnsafeArchiveMemberError):
+        nodes.distribution(VERSION)
+    assert not os.path.exists(temp_folder[0] + '/escaped')
+    assert os.listdir(cache_dir) == [VERSION + '.lock']
+
+
+@pytest.mark.parametrize('linkname', [
+    '{victim}',  # absolute
+    '../../victim',
+    '../bin/../../victim',
+    '.',  # the top folder
+])
+def test_node_distribution_unsafe_symlink(node_dist_server, temp_folder,
+                                          monkeypatch, linkname):
+    # tarfile does not filter links before python 3.12
+    monkeypatch.setattr(node_cache, '_EXTRACT_OPTIONS', {})
+    cache_dir = temp_folder[0] + '/node'
+    victim = temp_folder[0] + '/victim'
+    os.makedirs(cache_dir)
+    os.makedirs(victim)
+    prefix = 'node-v%s-linux-x64/' % VERSION
+    name = prefix + 'x' if linkname != '.' else prefix.rstrip('/')
+    _serve_archive(node_dist_server, _node_archive(
+        links=[(name, linkname.format(victim=victim))],
+        members=[(prefix + 'x/evil', b'x')]))
+    nodes = NodeDistributions(cache_dir, dist_url=node_dist_server['url'])
+
+    with pytest.raises(UnsafeArchiveMemberError):
+        nodes.distribution(VERSION)
+    assert os.listdir(victim) == []
+    assert os.listdir(cache_dir) == [VERSION + '.lock']
+
+
+def test_node_distribution_symlinks_within(node_dist_server, temp_folder,
+                                           monkeypatch):
+    monkeypatch.setattr(node_cache, '_EXTRACT_OPTIONS', {})
+    cache_dir = temp_folder[0] + '/node'
+    os.makedirs(cache_dir)
+    prefix = 'node-v%s-linux-x64/' % VERSION
+    _serve_archive(node_dist_server, _node_archive(
+        links=[(prefix + 'include/latest', 'node'),
+               (prefix + 'include/node/top', '../..')]))
+    nodes = NodeDistributions(cache_dir, dist_url=node_dist_server['url'])
+
+    path = nodes.distribution(VERSION)
+    assert os.path.isfile(os.path.join(path, 'include/latest/node.h'))
+    assert os.path.isfile(os.path.join(path, 'include/node/top/README.md'))
+
+
+def test_node_distribution_concurrent(node_dist_server, temp_folder):
+    cache_dir = temp_folder[0] + '/node'
+    os.makedirs(cache_dir)
+    nodes = [NodeDistributions(cache_dir, dist_url=node_dist_server['url'])
+             for _ in range(4)]
+    threads = [threading.Thread(target=n.distribution, args=(VERSION,))
+               for n in nodes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(node_dist_server['requests']) == 2
+    assert sum(n.misses for n in nodes) == 1
+
+
+def test_node_create_env(node_dist_server, temp_folder):
+    cache_dir = temp_folder[0] + '/node'
+    os.makedirs(cache_dir)
+    nodes = NodeDistributions(cache_dir, dist_url=node_dist_server['url'])
+    nodes.create_env(VERSION, 'nodeenv')
+    dist_dir = os.path.join(cache_dir, VERSION)
+
+    assert os.path.isdir('nodeenv/bin') and not os.path.islink('nodeenv/bin')
+    assert os.path.realpath('nodeenv/lib') == os.path.realpath(
+        os.path.join(dist_dir, 'lib'))
+    assert os.path.realpath('nodeenv/bin/npm') == os.path.realpath(
+        os.path.join(dist_dir, 'lib/node_modules/npm/bin/npm-cli.js'))
+    assert not os.path.exists(os.path.join('nodeenv', COMPLETE_MARKER))
+    output = subprocess.check_output(['node'],
+                                     env=NodeDistributions.env('nodeenv'))
+    assert output.strip() == b'v' + VERSION.encode('utf-8')
+
+    # replaced, the distribution is not touched
+    with open('nodeenv/bin/extra', 'w') as f:
+        f.write('extra')
+    nodes.create_env(VERSION, 'nodeenv')
+    assert not os.path.exists('nodeenv/bin/extra')
+    assert os.path.isfile(os.path.join(dist_dir, 'bin', 'node'))
+
+
+def test_node_create_env_relative_cache_dir(node_dist_server, temp_folder):
+    nodes = NodeDistributions('node', dist_url=node_dist_server['url'])
+    nodes.create_env(VERSION, 'nodeenv')
+
+    assert os.path.isabs(os.readlink('nodeenv/lib'))
+    output = subprocess.check_output(['node'],
+                                     env=NodeDistributions.env('nodeenv'))
+    assert output.strip() == b'v' + VERSION.encode('utf-8')
+
+
+def test_install_dependencies_with_npm_node_cache(node_dist_server,
+                                                  temp_folder):
+    with open('package.json', 'w') as f:
+        f.write('{"name": "my-sample-lambda", "version": "0.0.1"}')
+    nodes = NodeDistributions(temp_folder[0] + '/node',
+                              dist_url=node_dist_server['url'])
+
+    _install_dependencies_with_npm('nodejs8.10', node_distributions=nodes)
+    with open('node_modules/fake/args') as f:
+        assert f.read().split() == ['install', '--only=prod', '--unsafe-perm']
+
+    # the next build links the cached distribution
+    _install_dependencies_with_npm('nodejs8.10', node_distributions=nodes)
+    assert len(node_dist_server['requests']) == 2
+    assert (nodes.hits, nodes.misses) == (1, 1)
+
+
+@pytest.mark.slow
+def test_node_create_env_benchmark(node_dist_server, temp_folder):
+    # a fresh nodeenv from the cache vs downloading and extracting
+    nodes = NodeDistributions(temp_folder[0] + '/node',
+                              dist_url=node_dist_server['url'])
+    start = time.time()
+    nodes.create_env(VERSION, 'nodeenv')
+    download = time.time() - start
+    start = time.time()
+    for _ in range(10):
+        nodes.create_env(VERSION, 'nodeenv')
+    linked = (time.time() - start) / 10
+    log.info('nodeenv: download %0.4f s, from cache %0.4f s', download,
+             linked)
+    assert linked < download
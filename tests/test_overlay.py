@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import tarfile
+import threading
+import time
+import zipfile
+import logging
+
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler.overlay import PrecompiledCache, overlay_tree
+from . import write_file
+
+log = logging.getLogger(__name__)
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def _make_tarball(path, source_dir):
+    with tarfile.open(path, 'w:gz') as tar:
+        for name in os.listdir(source_dir):
+            tar.add(os.path.join(source_dir, name), arcname=name)
+    return path
+
+
+def test_precompiled_cache_extracts_once(temp_folder):
+    write_file('./build/psycopg2/__init__.py', 'precompiled')
+    write_file('./build/psycopg2/_psycopg.so', 'ELF')
+    tarball = _make_tarball('./psycopg2.tar.gz', './build')
+    cache = PrecompiledCache(temp_folder[0] + '/cache')
+
+    path = cache.extracted('psycopg2-2.7.1-python3.6', tarball)
+    assert sorted(os.listdir(os.path.join(path, 'psycopg2'))) == [
+        '__init__.py', '_psycopg.so']
+    os.remove(tarball)
+    assert cache.extracted('psycopg2-2.7.1-python3.6', tarball) == path
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert not [f for f in os.listdir(cache.cache_dir)
+                if f.startswith('.tmp-')]
+
+
+def test_precompiled_cache_extracts_wheels(temp_folder):
+    with zipfile.ZipFile('./pkg-1.0-cp36-cp36m-manylinux1_x86_64.whl',
+                         'w') as z:
+        z.writestr('pkg/__init__.py', b'')
+        z.writestr('pkg-1.0.data/platlib/pkg/_speedups.so', b'ELF')
+    cache = PrecompiledCache(temp_folder[0] + '/cache')
+    path = cache.extracted('pkg-1.0-cp36-cp36m-manylinux1_x86_64',
+                           './pkg-1.0-cp36-cp36m-manylinux1_x86_64.whl')
+    assert sorted(os.listdir(os.path.join(path, 'pkg'))) == [
+        '__init__.py', '_speedups.so']
+
+
+def test_precompiled_cache_concurrent(temp_folder):
+    write_file('./build/psycopg2/__init__.py', 'precompiled')
+    tarball = _make_tarball('./psycopg2.tar.gz', './build')
+    caches = [PrecompiledCache(temp_folder[0] + '/cache') for _ in range(4)]
+    threads = [threading.Thread(target=c.extracted,
+                                args=('psycopg2-2.7.1-python3.6', tarball))
+               for c in caches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(c.misses for c in caches) == 1
+    assert sorted(os.listdir(caches[0].cache_dir)) == [
+        'psycopg2-2.7.1-python3.6', 'psycopg2-2.7.1-python3.6.lock']
+
+
+def test_precompiled_cache_prune(temp_folder):
+    cache = PrecompiledCache(temp_folder[0] + '/cache', max_size=2500)
+    for i, key in enumerate(['a-1.0-python3.6', 'b-1.0-python3.6',
+                             'c-1.0-python3.6']):
+        write_file('./build/%s/pkg/data.bin' % key, 'x' * 1000)
+        tarball = _make_tarball('./%s.tar.gz' % key, './build/%s' % key)
+        path = cache.extracted(key, tarball)
+        mtime = time.time() - 100 + i
+        os.utime(path, (mtime, mtime))
+        if i == 1:
+            # a hit marks it as recently used
+            assert cache.extracted('a-1.0-python3.6', tarball)
+
+    # the least recently used folder and its lock file are evicted
+    assert sorted(os.listdir(cache.cache_dir)) == [
+        'a-1.0-python3.6', 'a-1.0-python3.6.lock',
+        'c-1.0-python3.6', 'c-1.0-python3.6.lock']
+    assert cache.prune(0) == ['c-1.0-python3.6', 'a-1.0-python3.6']
+    assert os.listdir(cache.cache_dir) == []
+
+
+def test_overlay_tree(temp_folder):
+    write_file('./site-packages/psycopg2/__init__.py', 'local build')
+    write_file('./site-packages/psycopg2/_local_only.py', 'local build')
+    write_file('./site-packages/werkzeug/__init__.py', 'untouched')
+    write_file('./extracted/psycopg2/__init__.py', 'precompiled')
+    write_file('./extracted/psycopg2/extensions/__init__.py', 'precompiled')
+    write_file('./extracted/psycopg2-2.7.1.dist-info/METADATA', 'Name: psycopg2')
+
+    replaced = overlay_tree('./extracted', './site-packages')
+
+    assert replaced == ['psycopg2', 'psycopg2-2.7.1.dist-info']
+    assert sorted(os.listdir('./site-packages')) == [
+        'psycopg2', 'psycopg2-2.7.1.dist-info', 'werkzeug']
+    assert sorted(os.listdir('./site-packages/psycopg2')) == [
+        '__init__.py', 'extensions']
+    assert _read('./site-packages/psycopg2/__init__.py') == 'precompiled'
+    assert _read('./site-packages/werkzeug/__init__.py') == 'untouched'
+    # hardlinked, not copied
+    assert os.stat('./site-packages/psycopg2/__init__.py').st_ino == \
+        os.stat('./extracted/psycopg2/__init__.py').st_ino
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import json
+import threading
+import logging
+
+import pytest
+import requests
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler.package_index import PackageIndex
+
+log = logging.getLogger(__name__)
+
+RELEASES = {'releases': {'1.0': [{'filename': 'somepackage-1.0.tar.gz',
+                                  'url': 'http://files/somepackage-1.0.tar.gz'}]}}
+
+
+@pytest.fixture(scope='function')
+def json_api(http_server):
+    # json api answering conditional requests with 304
+    state = {'requests': [], 'etag': '"v1"', 'status': None}
+
+    def do_get(request):
+        etag = request.headers.get('If-None-Match')
+        state['requests'].append((request.path, etag))
+        if state['status'] is not None:
+            return state['status'], None, None
+        elif request.path != '/pypi/somepackage/json':
+            return 404, None, None
+        elif etag == state['etag']:
+            return 304, None, None
+        return 200, {'ETag': state['etag']}, \
+            json.dumps(RELEASES).encode('utf-8')
+
+    state['url'] = http_server(do_get) + '/pypi'
+    return state
+
+
+def test_package_index_uses_fresh_cache(json_api, temp_folder):
+    index = PackageIndex(json_api['url'], cache_dir=temp_folder[0])
+    assert index.release_files('somepackage', '1.0') == \
+        RELEASES['releases']['1.0']
+    assert index.release_files('somepackage', '2.0') is None
+    assert len(json_api['requests']) == 1
+
+    # cached on disk for other instances (processes)
+    index = PackageIndex(json_api['url'], cache_dir=temp_folder[0])
+    assert index.get_json('somepackage') == RELEASES
+    assert len(json_api['requests']) == 1
+    assert index.stats['fresh'] == 1
+
+
+def test_package_index_revalidates_after_ttl(json_api, temp_folder):
+    PackageIndex(json_api['url'], cache_dir=temp_folder[0]).get_json(
+        'somepackage')
+    index = PackageIndex(json_api['url'], cache_dir=temp_folder[0], ttl=0)
+    assert index.get_json('somepackage') == RELEASES
+    assert json_api['requests'][-1] == ('/pypi/somepackage/json', '"v1"')
+    assert index.stats['revalidated'] == 1
+
+    json_api['etag'] = '"v2"'
+    assert index.get_json('somepackage') == RELEASES
+    assert index.stats['downloaded'] == 1
+
+
+def test_package_index_unknown_package(json_api, temp_folder):
+    index = PackageIndex(json_api['url'], cache_dir=temp_folder[0])
+    assert index.get_json('unknown') is None
+    assert index.release_files('unknown', '1.0') is None
+    # the 404 is cached, too
+    assert len(json_api['requests']) == 1
+
+
+def test_package_index_offline(json_api, temp_folder):
+    PackageIndex(json_api['url'], cache_dir=temp_folder[0]).get_json(
+        'somepackage')
+    index = PackageIndex(json_api['url'], cache_dir=temp_folder[0], ttl=0,
+                         offline=True)
+    assert index.get_json('somepackage') == RELEASES
+    assert index.get_json('otherpackage') is None
+    assert len(json_api['requests']) == 1
+    assert index.stats['missing'] == 1
+
+
+def test_package_index_stale_if_unreachable(json_api, temp_folder):
+    PackageIndex(json_api['url'], cache_dir=temp_folder[0]).get_json(
+        'somepackage')
+    index = PackageIndex('http://127.0.0.1:1/pypi', cache_dir=temp_folder[0],
+                         ttl=0)
+    assert index.get_json('somepackage') == RELEASES
+    assert index.stats['stale'] == 1
+    # nothing cached
+    with pytest.raises(requests.RequestException):
+        index.get_json('otherpackage')
+
+
+def test_package_index_stale_on_server_error(json_api, temp_folder):
+    index = PackageIndex(json_api['url'], cache_dir=temp_folder[0], ttl=0)
+    index.get_json('somepackage')
+    json_api['status'] = 503
+    assert index.get_json('somepackage') == RELEASES
+    assert index.stats['stale'] == 1
+    # nothing cached
+    with pytest.raises(requests.HTTPError):
+        index.get_json('otherpackage')
+
+
+def test_package_index_stats_threads(json_api, temp_folder):
+    index = PackageIndex(json_api['url'], cache_dir=temp_folder[0])
+    index.get_json('somepackage')
+    threads = [threading.Thread(
+        target=lambda: [index.get_json('somepackage') for _ in range(200)])
+        for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert index.stats['fresh'] == 1600
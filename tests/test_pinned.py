@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import hashlib
+import logging
+
+import pytest
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler.pinned import parse_pinned_requirements, verify_hashes, \
+    marker_environment, PinnedRequirement, RequirementsNotPinnedError, \
+    RequirementHashMismatchError
+from . import write_file
+
+log = logging.getLogger(__name__)
+
+
+def test_marker_environment():
+    env = marker_environment('python3.6')
+    assert (env['python_version'], env['sys_platform']) == ('3.6', 'linux')
+
+
+def test_parse_pinned_requirements(temp_folder):
+    write_file('requirements.txt', '\n'.join([
+        '# pip freeze',
+        'Werkzeug==0.14.1',
+        'requests[security]==2.18.4  # comment',
+        'six==1.11.0 \\',
+        '    --hash=sha256:832DC0E10FEB1AA2C68DCC57DBB658F1C7E65B9B61AF69048'
+        'ABC87A2DB00A0EB \\',
+        '    --hash=sha256:70e8a77beed4562e7f14fe23a786b54f6296e34344c23bc42f'
+        '07b15018ff98e9',
+        'enum34==1.1.6; python_version < "3.4"',
+        '',
+    ]))
+    requirements = parse_pinned_requirements('requirements.txt', 'python3.6')
+
+    assert [(r.name, r.version) for r in requirements] == [
+        ('Werkzeug', '0.14.1'), ('requests', '2.18.4'), ('six', '1.11.0')]
+    assert requirements[2].sha256 == frozenset([
+        '832dc0e10feb1aa2c68dcc57dbb658f1c7e65b9b61af69048abc87a2db00a0eb',
+        '70e8a77beed4562e7f14fe23a786b54f6296e34344c23bc42f07b15018ff98e9'])
+    assert [r.name for r in parse_pinned_requirements(
+        'requirements.txt', 'python2.7')][-1] == 'enum34'
+
+
+@pytest.mark.parametrize('line', [
+    'werkzeug', 'werkzeug>=0.14', 'werkzeug==0.*', '-r base.txt',
+    '-e git+https://github.com/pallets/werkzeug.git#egg=werkzeug',
+    '--index-url https://pypi.example.com/simple',
+    'https://example.com/werkzeug-0.14.1.tar.gz',
+])
+def test_parse_not_pinned_requirements(temp_folder, line):
+    write_file('requirements.txt', 'six==1.11.0\n%s\n' % line)
+    with pytest.raises(RequirementsNotPinnedError):
+        parse_pinned_requirements('requirements.txt', 'python3.6')
+
+
+def test_verify_hashes(temp_folder):
+    write_file('six.whl', 'wheel')
+    digest = hashlib.sha256(b'wheel').hexdigest()
+    verify_hashes('six.whl', PinnedRequirement('six', '1.11.0', frozenset(),
+                                               'six==1.11.0'))
+    verify_hashes('six.whl', PinnedRequirement(
+        'six', '1.11.0', frozenset([digest]), 'six==1.11.0'))
+    with pytest.raises(RequirementHashMismatchError):
+        verify_hashes('six.whl', PinnedRequirement(
+            'six', '1.11.0', frozenset(['0' * 64]), 'six==1.11.0'))
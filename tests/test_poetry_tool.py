@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import logging
+
+import mock
+import pytest
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler.poetry_tool import PoetryTool
+
+log = logging.getLogger(__name__)
+
+
+def _fake_virtualenv(python, venv_dir):
+    os.makedirs(os.path.join(venv_dir, 'bin'))
+
+
+def _pip_install(cmd, **kwargs):
+    # pip install poetry==<version> into the tool virtualenv
+    bin_dir = os.path.dirname(cmd[0])
+    with open(os.path.join(bin_dir, 'poetry'), 'w') as f:
+        f.write(cmd[-1])
+    return b''
+
+
+def test_poetry_tool_installs_once_per_version(temp_folder):
+    cache_dir = temp_folder[0] + '/poetry'
+    with mock.patch('subprocess.check_output',
+                    side_effect=_pip_install) as check_output:
+        tool = PoetryTool('1.0.2', cache_dir)
+        poetry_exe = tool.executable(_fake_virtualenv)
+        assert tool.executable(_fake_virtualenv) == poetry_exe
+        assert PoetryTool('1.0.2', cache_dir).executable(
+            _fake_virtualenv) == poetry_exe
+        assert check_output.call_count == 1
+
+        other = PoetryTool('1.0.5', cache_dir).executable(_fake_virtualenv)
+        assert check_output.call_count == 2
+    with open(poetry_exe) as f:
+        assert f.read() == 'poetry==1.0.2'
+    assert other != poetry_exe
+
+
+def test_poetry_tool_failed_install(temp_folder):
+    tool = PoetryTool('1.0.2', temp_folder[0] + '/poetry')
+    with mock.patch('subprocess.check_output', side_effect=OSError):
+        with pytest.raises(OSError):
+            tool.executable(_fake_virtualenv)
+    assert not os.path.exists(tool.tool_dir)
+
+
+def test_poetry_tool_env(temp_folder):
+    with mock.patch.dict(os.environ, {'PATH': '/usr/bin', 'HOME': '/home/x'}):
+        env = PoetryTool.env('.gcdt/venv')
+    venv_dir = os.path.abspath('.gcdt/venv')
+    assert env['VIRTUAL_ENV'] == venv_dir
+    assert env['PATH'] == venv_dir + '/bin' + os.pathsep + '/usr/bin'
+    assert env['POETRY_VIRTUALENVS_CREATE'] == 'false'
+    assert env['HOME'] == '/home/x'  # the environment is inherited
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import logging
+
+import pytest
+
+from gcdt_bundler.pruning import Pruner, is_dependency
+
+log = logging.getLogger(__name__)
+
+
+@pytest.mark.parametrize('arcname, rule', [
+    ('handler.py', None),
+    ('werkzeug/__init__.py', None),
+    ('werkzeug/__pycache__/__init__.cpython-36.pyc', 'pycache'),
+    ('werkzeug/routing.pyc', 'pycache'),
+    ('werkzeug/tests/test_routing.py', 'tests'),
+    ('test/__init__.py', None),
+    ('werkzeug/testsuite.py', None),
+    ('werkzeug/docs/index.rst', 'docs'),
+    ('Werkzeug-0.14.1.dist-info/RECORD', 'installer_metadata'),
+    ('Werkzeug-0.14.1.dist-info/METADATA', None),
+    ('boto3/session.py', 'runtime_provided'),
+    ('botocore-1.10.0.dist-info/METADATA', 'runtime_provided'),
+])
+def test_pruner_default_python_rules(arcname, rule):
+    assert Pruner('python3.6').match(arcname) == rule
+
+
+def test_pruner_nodejs_rules():
+    pruner = Pruner('nodejs8.10')
+    assert pruner.match('node_modules/aws-sdk/index.js') == 'runtime_provided'
+    assert pruner.match('node_modules/lodash/test/index.js') == 'tests'
+    assert pruner.match('node_modules/lodash/index.js') is None
+    assert pruner.match('lib/__pycache__/x.pyc') is None
+
+
+def test_pruner_keep_and_rules():
+    pruner = Pruner('python3.6', rules=['installer_metadata',
+                                        'runtime_provided'],
+                    keep=['boto3'])
+    assert pruner.match('boto3/session.py') is None
+    assert pruner.match('boto3-1.7.0.dist-info/RECORD') is None
+    assert pruner.match('botocore/client.py') == 'runtime_provided'
+    assert pruner.match('werkzeug/tests/test_routing.py') is None
+
+    with pytest.raises(ValueError):
+        Pruner('python3.6', rules=['unknown'])
+
+
+def test_is_dependency():
+    deps = {'source': '.gcdt/venv/lib/python3.6/site-packages', 'target': '',
+            'dependencies': True}
+    assert is_dependency(deps, 'werkzeug/tests/test_routing.py')
+    assert not is_dependency({'source': './impl', 'target': ''},
+                             'myapp/tests/test_handler.py')
+    assert is_dependency({'source': './', 'target': ''},
+                         'node_modules/lodash/test/index.js')
+
+
+def test_pruner_stats():
+    pruner = Pruner('python3.6')
+    assert pruner.keep_file('werkzeug/__init__.py', lambda: 1 / 0)
+    assert not pruner.keep_file('werkzeug/routing.pyc', 100)
+    assert not pruner.keep_file('werkzeug/__pycache__/x.pyc', lambda: 50)
+    assert not pruner.keep_file('boto3/session.py', 10)
+    assert pruner.stats['pycache'] == [2, 150]
+    assert pruner.stats['runtime_provided'] == [1, 10]
+    pruner.log_stats()
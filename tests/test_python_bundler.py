@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 import os
+import hashlib
+import io
+import json
 import logging
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+import zipfile
 from textwrap import dedent
 
-import collections
 
 import pytest
 import mock
@@ -14,6 +22,14 @@ from gcdt_bundler.python_bundler import _get_cached_manylinux_wheel, \
     _have_correct_lambda_package_version, _site_packages_dir_in_venv, \
     _have_any_lambda_package_version, _get_installed_packages, \
     install_dependencies_with_pip, PipDependencyInstallationError, install_dependencies_with_poetry
+from gcdt_bundler.python_bundler import install_dependencies_from_wheels, \
+    add_deps_folder, install_dependencies_pinned
+from gcdt_bundler.pinned import RequirementHashMismatchError
+from gcdt_bundler.deps_cache import DepsCache
+from gcdt_bundler import python_bundler
+from gcdt_bundler.package_index import PackageIndex
+from gcdt_bundler.wheel_cache import WheelCache
+from gcdt_bundler.overlay import PrecompiledCache
 
 from . import here
 
@@ -22,6 +38,55 @@ import pip
 log = logging.getLogger(__name__)
 
 
+@pytest.fixture(scope='function')
+def index_server(http_server):
+    # local stand-in for the PyPI json api and file hosting
+    state = {'requests': 0, 'active': 0, 'max_active': 0, 'delay': 0.2,
+             'packages': {}, 'files': {}}
+    lock = threading.Lock()
+
+    def do_get(request):
+        with lock:
+            state['requests'] += 1
+            state['active'] += 1
+            state['max_active'] = max(state['max_active'], state['active'])
+        try:
+            time.sleep(state['delay'])
+            parts = request.path.strip('/').split('/')
+            if parts[0] == 'pypi' and parts[1] in state['packages']:
+                releases = {}
+                for version, filename in state['packages'][parts[1]]:
+                    releases.setdefault(version, []).append({
+                        'filename': filename,
+                        'digests': {'sha256': hashlib.sha256(
+                            state['files'].get(filename) or
+                            _wheel(parts[1])).hexdigest()},
+                        'url': '%s/files/%s' % (base_url, filename)
+                    })
+                return 200, None, json.dumps({'releases': releases}).encode(
+                    'utf-8')
+            elif parts[0] == 'files':
+                return 200, None, state['files'].get(parts[1]) or \
+                    _wheel(parts[1].split('-')[0])
+            return 404, None, None
+        finally:
+            with lock:
+                state['active'] -= 1
+
+    base_url = http_server(do_get)
+    state['url'] = base_url + '/pypi'
+    return state
+
+
+def _wheel(package_name):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as z:
+        z.writestr(zipfile.ZipInfo('%s/__init__.py' % package_name,
+                                   (2018, 1, 1, 0, 0, 0)),
+                   ('name = %r' % package_name).encode('utf-8'))
+    return buf.getvalue()
+
+
 @pytest.mark.slow
 @pytest.mark.parametrize('runtime', ['python2.7', 'python3.6'])
 def test_install_dependencies_with_pip(runtime, temp_folder, cleanup_tempfiles):
@@ -42,6 +107,115 @@ def test_install_dependencies_with_pip(runtime, temp_folder, cleanup_tempfiles):
     assert 'werkzeug' in packages
 
 
+def test_install_dependencies_with_pip_deps_cache_hit(temp_folder, cleanup_tempfiles):
+    venv_dir = '%s/.gcdt/venv' % temp_folder[0]
+    requirements_txt = create_tempfile('werkzeug\n')
+    cleanup_tempfiles.append(requirements_txt)
+    os.makedirs('./site-packages/werkzeug')
+    with open('./site-packages/werkzeug/__init__.py', 'w') as f:
+        f.write('')
+    deps_cache = DepsCache(temp_folder[0] + '/cache')
+    deps_cache.store(deps_cache.key([requirements_txt], 'python3.6'),
+                     './site-packages')
+
+    with mock.patch('subprocess.check_output') as check_output:
+        install_dependencies_with_pip(requirements_txt, 'python3.6', venv_dir,
+                                      False, deps_cache=deps_cache)
+        assert not check_output.called
+
+    assert deps_cache.hits == 1
+    assert os.listdir(_site_packages_dir_in_venv(venv_dir)) == ['werkzeug']
+
+
+def test_install_dependencies_with_pip_deps_cache_miss_keep(temp_folder,
+                                                           cleanup_tempfiles):
+    venv_dir = '%s/.gcdt/venv' % temp_folder[0]
+    requirements_txt = create_tempfile('werkzeug\n')
+    cleanup_tempfiles.append(requirements_txt)
+    # kept virtualenv with an installed package
+    os.makedirs(venv_dir + '/bin')
+    with open(venv_dir + '/bin/python', 'w') as f:
+        f.write('')
+    os.makedirs(venv_dir + '/lib/python3.6/site-packages/werkzeug')
+    deps_cache = DepsCache(temp_folder[0] + '/cache')
+
+    with mock.patch('subprocess.check_output', return_value=b'') \
+            as check_output, \
+            mock.patch('gcdt_bundler.python_bundler._create_virtualenv') \
+            as create_virtualenv, \
+            mock.patch('gcdt_bundler.python_bundler.'
+                       'install_precompiled_packages'), \
+            mock.patch.object(deps_cache, 'store'):
+        install_dependencies_with_pip(requirements_txt, 'python3.6', venv_dir,
+                                      True, deps_cache=deps_cache)
+        assert not create_virtualenv.called
+        # pip installs into the kept virtualenv
+        assert check_output.call_args[0][0][0] == venv_dir + '/bin/python'
+
+    assert deps_cache.misses == 1
+    assert os.path.isfile(venv_dir + '/bin/python')
+    assert os.listdir(_site_packages_dir_in_venv(venv_dir)) == ['werkzeug']
+
+
+def test_install_dependencies_from_wheels(temp_folder, cleanup_tempfiles):
+    venv_dir = '%s/.gcdt/venv' % temp_folder[0]
+    requirements_txt = create_tempfile('werkzeug\n')
+    cleanup_tempfiles.append(requirements_txt)
+
+    def _pip_download(cmd, **kwargs):
+        assert cmd[3] == 'download'
+        dest_dir = cmd[cmd.index('--dest') + 1]
+        with zipfile.ZipFile(dest_dir + '/werkzeug-0.14.1-py2.py3-none-any.whl',
+                             'w') as z:
+            z.writestr('werkzeug/__init__.py', b'')
+        return b''
+
+    with mock.patch('subprocess.check_output',
+                    side_effect=_pip_download) as check_output:
+        install_dependencies_from_wheels(requirements_txt, 'python3.6',
+                                         venv_dir)
+        assert check_output.call_count == 1  # no virtualenv
+
+    folders = []
+    add_deps_folder(folders, venv_dir)
+    assert folders == [{'source': _site_packages_dir_in_venv(venv_dir),
+                        'target': '', 'dependencies': True}]
+    assert os.listdir(folders[0]['source']) == ['werkzeug']
+
+
+def test_install_dependencies_from_wheels_deps_cache(temp_folder,
+                                                   cleanup_tempfiles):
+    venv_dir = '%s/.gcdt/venv' % temp_folder[0]
+    requirements_txt = create_tempfile('werkzeug\n')
+    cleanup_tempfiles.append(requirements_txt)
+    # layer of the virtualenv installer (pip, setuptools)
+    os.makedirs('./site-packages/pip')
+    deps_cache = DepsCache(temp_folder[0] + '/cache')
+    deps_cache.store(deps_cache.key([requirements_txt], 'python3.6'),
+                     './site-packages')
+
+    def _pip_download(cmd, **kwargs):
+        dest_dir = cmd[cmd.index('--dest') + 1]
+        with zipfile.ZipFile(dest_dir + '/werkzeug-0.14.1-py2.py3-none-any.whl',
+                             'w') as z:
+            z.writestr('werkzeug/__init__.py', b'')
+        return b''
+
+    with mock.patch('subprocess.check_output', side_effect=_pip_download):
+        install_dependencies_from_wheels(requirements_txt, 'python3.6',
+                                         venv_dir, deps_cache=deps_cache)
+    assert (deps_cache.hits, deps_cache.misses) == (0, 1)
+    assert os.listdir(_site_packages_dir_in_venv(venv_dir)) == ['werkzeug']
+
+    # the unpacked layer is not restored for the virtualenv installer
+    assert deps_cache.key([requirements_txt], 'python3.6') != \
+        deps_cache.key([requirements_txt], 'python3.6', variant='unpacked')
+    with mock.patch('subprocess.check_output', side_effect=_pip_download):
+        install_dependencies_from_wheels(requirements_txt, 'python3.6',
+                                         venv_dir, deps_cache=deps_cache)
+    assert deps_cache.hits == 1
+
+
 @pytest.mark.slow
 @pytest.mark.parametrize('runtime', ['python2.7', 'python3.6'])
 def test_install_dependencies_with_pip_not_found(runtime, temp_folder, cleanup_tempfiles):
@@ -129,6 +303,40 @@ def test_get_manylinux_python36():
     '''
 
 
+def test_fetch_manylinux_wheels_concurrently(index_server, temp_folder):
+    suffix = python_bundler._get_manylinux_wheel_file_suffix('python3.6')
+    packages = [('package%d' % i, '1.0') for i in range(8)]
+    for name, version in packages:
+        index_server['packages'][name] = [
+            (version, '%s-%s-%s' % (name, version, suffix))]
+    index_server['packages']['nowheel'] = [('2.0', 'nowheel-2.0.tar.gz')]
+
+    package_index = PackageIndex(index_server['url'],
+                                 cache_dir=temp_folder[0] + '/pypi')
+    wheel_cache = WheelCache(temp_folder[0] + '/wheels')
+    start = time.time()
+    wheels = python_bundler._fetch_manylinux_wheels(
+        'python3.6', packages + [('nowheel', '2.0')], workers=4,
+        package_index=package_index, wheel_cache=wheel_cache)
+    log.info('fetched %d wheels in %0.2f s', len(packages), time.time() - start)
+
+    assert wheels['nowheel'] is None
+    for name, _ in packages:
+        with zipfile.ZipFile(wheels[name]) as z:
+            assert z.namelist() == ['%s/__init__.py' % name]
+    assert index_server['requests'] == 2 * len(packages) + 1
+    assert index_server['max_active'] > 1
+
+    # downloaded wheels are reused
+    python_bundler._fetch_manylinux_wheels('python3.6', packages, workers=4,
+                                           package_index=package_index,
+                                           wheel_cache=wheel_cache)
+    assert index_server['requests'] == 2 * len(packages) + 1
+    # a miss is a download (nowheel has no wheel to download)
+    assert (wheel_cache.hits, wheel_cache.misses) == \
+        (len(packages), len(packages))
+
+
 def test_should_use_lambda_packages():
     #z = Zappa(runtime='python2.7')
 
@@ -143,18 +351,78 @@ def test_should_use_lambda_packages():
     assert _have_any_lambda_package_version('python2.7', 'no_package') is False
 
 
-def test_getting_installed_packages():
-    #z = Zappa(runtime='python2.7')
+def test_getting_installed_packages(temp_folder):
+    site_packages = temp_folder[0] + '/lib/python3.6/site-packages'
+    site_packages_64 = temp_folder[0] + '/lib64/python3.6/site-packages'
+    os.makedirs(site_packages + '/Super_Package-0.1.dist-info')
+    with open(site_packages + '/Super_Package-0.1.dist-info/METADATA',
+              'w') as f:
+        f.write('Metadata-Version: 2.0\nName: Super_Package\nVersion: 0.1\n')
+    os.makedirs(site_packages_64)
+    with open(site_packages_64 + '/psycopg2-2.7.1-py3.6.egg-info', 'w') as f:
+        f.write('Metadata-Version: 1.1\nName: psycopg2\nVersion: 2.7.1\n')
+
+    assert _get_installed_packages(site_packages, site_packages_64) == {
+        'super-package': '0.1', 'psycopg2': '2.7.1'}
 
-    # mock pip packages call to be same as what our mocked site packages dir has
-    mock_package = collections.namedtuple('mock_package', ['project_name', 'version'])
-    mock_pip_installed_packages = [mock_package('super_package', '0.1')]
 
-    with mock.patch('os.path.isdir', return_value=True):
-        with mock.patch('os.listdir', return_value=['super_package']):
-            #import pip  # this gets called in non-test Zappa mode
-            with mock.patch('pip._internal.utils.misc.get_installed_distributions', return_value=mock_pip_installed_packages):
-                assert _get_installed_packages('', '') == {'super_package' : '0.1'}
+def test_install_precompiled_packages_overlay(temp_folder, monkeypatch):
+    venv_dir = '%s/.gcdt/venv' % temp_folder[0]
+    site_packages = venv_dir + '/lib/python3.6/site-packages'
+    os.makedirs(site_packages + '/psycopg2')
+    with open(site_packages + '/psycopg2/__init__.py', 'w') as f:
+        f.write('local build')
+    os.makedirs('./build/psycopg2')
+    with open('./build/psycopg2/__init__.py', 'w') as f:
+        f.write('precompiled')
+    with tarfile.open('./psycopg2.tar.gz', 'w:gz') as tar:
+        tar.add('./build/psycopg2', arcname='psycopg2')
+    monkeypatch.setitem(python_bundler.lambda_packages, 'psycopg2', {
+        'python3.6': {'version': '2.7.1',
+                      'path': os.path.abspath('./psycopg2.tar.gz')}})
+    precompiled_cache = PrecompiledCache(temp_folder[0] + '/precompiled')
+
+    with mock.patch('gcdt_bundler.python_bundler._get_installed_packages',
+                    return_value={'psycopg2': '2.7.1'}):
+        for _ in range(2):
+            python_bundler.install_precompiled_packages(
+                venv_dir, 'python3.6', precompiled_cache=precompiled_cache)
+
+    with open(site_packages + '/psycopg2/__init__.py') as f:
+        assert f.read() == 'precompiled'
+    assert (precompiled_cache.hits, precompiled_cache.misses) == (1, 1)
+    assert os.listdir(site_packages) == ['psycopg2']
+
+
+def test_install_dependencies_with_poetry_lock(temp_folder):
+    venv_dir = '%s/.gcdt/venv' % temp_folder[0]
+    with open('pyproject.toml', 'w') as f:
+        f.write('[tool.poetry]\nname = "hello"\n')
+    with open('poetry.lock', 'w') as f:
+        f.write('[[package]]\nname = "werkzeug"\nversion = "0.14.1"\n')
+
+    def _export(cmd, **kwargs):
+        with open(cmd[cmd.index('-o') + 1], 'w') as f:
+            f.write('werkzeug==0.14.1\n')
+        return b''
+
+    with mock.patch('gcdt_bundler.python_bundler._prepare_poetry',
+                    return_value='/poetry/bin/poetry'), \
+            mock.patch('subprocess.check_output',
+                       side_effect=_export) as check_output, \
+            mock.patch('gcdt_bundler.python_bundler.'
+                       'install_dependencies_with_pip') as install:
+        install_dependencies_with_poetry('python3.6', venv_dir)
+
+    cmd = check_output.call_args[0][0]
+    assert cmd[:2] == ['/poetry/bin/poetry', 'export']
+    # the hashes of the lock file are verified by the installers
+    assert '--without-hashes' not in cmd
+    requirements_file = install.call_args[0][0]
+    assert requirements_file == '%s/.gcdt/poetry-requirements.txt' % \
+        temp_folder[0]
+    with open(requirements_file) as f:
+        assert f.read() == 'werkzeug==0.14.1\n'
 
 
 @pytest.mark.slow
@@ -188,3 +456,127 @@ def test_install_dependencies_with_poetry(runtime, temp_folder, cleanup_tempfile
         log.debug(package)
 
     assert 'werkzeug' in packages
+
+
+def _dist_wheel(name, version, modules=1, content='x = 1\n'):
+    # wheel with the metadata pip needs (WHEEL, METADATA, RECORD)
+    dist_info = '%s-%s.dist-info' % (name, version)
+    files = [('%s/__init__.py' % name, '')]
+    files += [('%s/module_%d.py' % (name, m), content) for m in range(modules)]
+    files += [
+        ('%s/METADATA' % dist_info,
+         'Metadata-Version: 2.1\nName: %s\nVersion: %s\n' % (name, version)),
+        ('%s/WHEEL' % dist_info, 'Wheel-Version: 1.0\nGenerator: test\n'
+                                 'Root-Is-Purelib: true\nTag: py3-none-any\n'),
+    ]
+    record = ''.join('%s,,\n' % path for path, _ in files)
+    files.append(('%s/RECORD' % dist_info, record + '%s/RECORD,,\n' % dist_info))
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+        for path, data in files:
+            z.writestr(zipfile.ZipInfo(path, (2018, 1, 1, 0, 0, 0)),
+                       data.encode('utf-8'))
+    return buf.getvalue()
+
+
+def _serve_wheels(index_server, packages, **kwargs):
+    # publish a wheel per (name, version) on the index server
+    for name, version in packages:
+        filename = '%s-%s-py3-none-any.whl' % (name, version)
+        index_server['packages'][name] = [(version, filename)]
+        index_server['files'][filename] = _dist_wheel(name, version, **kwargs)
+    return index_server['files']
+
+
+def test_install_dependencies_pinned(index_server, temp_folder):
+    venv_dir = '%s/.gcdt/venv' % temp_folder[0]
+    packages = [('package%d' % i, '1.0') for i in range(6)]
+    files = _serve_wheels(index_server, packages)
+    index_server['packages']['sdistonly'] = [('2.0', 'sdistonly-2.0.tar.gz')]
+    digest = hashlib.sha256(files['package0-1.0-py3-none-any.whl']).hexdigest()
+    with open('requirements.txt', 'w') as f:
+        f.write('package0==1.0 --hash=sha256:%s\n' % digest)
+        f.write(''.join('%s==%s\n' % p for p in packages[1:]))
+        f.write('sdistonly==2.0\n')
+
+    with mock.patch('gcdt_bundler.python_bundler._install_sdists_with_pip') \
+            as install_sdists:
+        install_dependencies_pinned(
+            'requirements.txt', 'python3.6', venv_dir,
+            package_index=PackageIndex(index_server['url'],
+                                       cache_dir=temp_folder[0] + '/pypi'),
+            wheel_cache=WheelCache(temp_folder[0] + '/wheels'), workers=4)
+
+    site_packages = venv_dir + '/lib/python3.6/site-packages'
+    assert sorted(os.listdir(site_packages)) == sorted(
+        ['package%d' % i for i in range(6)] +
+        ['package%d-1.0.dist-info' % i for i in range(6)])
+    assert index_server['max_active'] > 1
+    # only the requirement without a wheel is installed by pip
+    assert [r.name for r in install_sdists.call_args[0][0]] == ['sdistonly']
+
+
+def test_install_dependencies_pinned_hash_mismatch(index_server, temp_folder):
+    _serve_wheels(index_server, [('package0', '1.0')])
+    with open('requirements.txt', 'w') as f:
+        f.write('package0==1.0 --hash=sha256:%s\n' % ('0' * 64))
+
+    with pytest.raises(RequirementHashMismatchError):
+        install_dependencies_pinned(
+            'requirements.txt', 'python3.6', '%s/.gcdt/venv' % temp_folder[0],
+            package_index=PackageIndex(index_server['url'],
+                                       cache_dir=temp_folder[0] + '/pypi'),
+            wheel_cache=WheelCache(temp_folder[0] + '/wheels'))
+
+
+def _tree(folder):
+    # files and content of an installed tree without pip bookkeeping
+    skip = ('INSTALLER', 'REQUESTED', 'RECORD', 'direct_url.json')
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames[:] = [d for d in dirnames if d not in ('__pycache__', 'bin')]
+        for filename in filenames:
+            if filename in skip:
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path, 'rb') as f:
+                tree[os.path.relpath(path, folder)] = f.read()
+    return tree
+
+
+@pytest.mark.slow
+def test_install_dependencies_pinned_benchmark(index_server, temp_folder):
+    # 30 pinned packages with 100 modules each from a local wheelhouse
+    index_server['delay'] = 0
+    packages = [('package%d' % i, '1.0') for i in range(30)]
+    files = _serve_wheels(index_server, packages, modules=100,
+                          content='x = 1\n' * 500)
+    os.mkdir('./wheelhouse')
+    for filename, data in files.items():
+        with open(os.path.join('./wheelhouse', filename), 'wb') as f:
+            f.write(data)
+    with open('requirements.txt', 'w') as f:
+        f.write(''.join('%s==%s\n' % p for p in packages))
+    runtime = 'python%d.%d' % sys.version_info[:2]
+
+    start = time.time()
+    subprocess.check_output(
+        [sys.executable, '-m', 'pip', 'install', '--no-index',
+         '--find-links', './wheelhouse', '--target', './pip-target',
+         '-r', 'requirements.txt'], stderr=subprocess.STDOUT)
+    pip_time = time.time() - start
+
+    venv_dir = '%s/.gcdt/venv' % temp_folder[0]
+    start = time.time()
+    install_dependencies_pinned(
+        'requirements.txt', runtime, venv_dir,
+        package_index=PackageIndex(index_server['url'],
+                                   cache_dir=temp_folder[0] + '/pypi'),
+        wheel_cache=WheelCache(temp_folder[0] + '/wheels'))
+    pinned_time = time.time() - start
+
+    log.info('pip: %0.2f s, pinned installer: %0.2f s (%0.1fx)', pip_time,
+             pinned_time, pip_time / pinned_time)
+    site_packages = '%s/lib/%s/site-packages' % (venv_dir, runtime)
+    assert _tree(site_packages) == _tree('./pip-target')
+    assert pinned_time < pip_time
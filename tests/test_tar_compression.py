@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import gzip
+import io
+import random
+
+import pytest
+
+from gcdt_bundler.tar_compression import ParallelGzipWriter, \
+    open_compressed_writer
+
+
+def _random_data(size):
+    words = [b'%08x' % random.getrandbits(32) for _ in range(256)]
+    return b' '.join(random.choice(words) for _ in range(size // 9))
+
+
+def _gunzip(data):
+    with gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb') as f:
+        return f.read()
+
+
+def test_parallel_gzip_writer_multi_member():
+    data = _random_data(300000)
+    out = io.BytesIO()
+    with ParallelGzipWriter(out, workers=2, block_size=64 * 1024) as writer:
+        for start in range(0, len(data), 10000):
+            writer.write(data[start:start + 10000])
+        assert writer.tell() == len(data)
+
+    assert _gunzip(out.getvalue()) == data
+
+
+@pytest.mark.parametrize('workers', [2, 3, 8])
+def test_parallel_gzip_writer_independent_of_workers(workers):
+    data = _random_data(200000)
+    results = []
+    for w in [2, workers]:
+        out = io.BytesIO()
+        with ParallelGzipWriter(out, workers=w, block_size=32 * 1024) as writer:
+            writer.write(data)
+        results.append(out.getvalue())
+    assert results[0] == results[1]
+
+
+def test_parallel_gzip_writer_empty():
+    out = io.BytesIO()
+    ParallelGzipWriter(out, workers=2).close()
+    assert _gunzip(out.getvalue()) == b''
+
+
+def test_open_compressed_writer_gzip_reproducible():
+    results = []
+    for _ in range(2):
+        out = io.BytesIO()
+        writer = open_compressed_writer(out, 'gzip', workers=1)
+        writer.write(b'some content')
+        writer.close()
+        results.append(out.getvalue())
+    assert results[0] == results[1]
+    assert _gunzip(results[0]) == b'some content'
+
+
+def test_open_compressed_writer_unknown():
+    with pytest.raises(ValueError):
+        open_compressed_writer(io.BytesIO(), 'bzip2')
+
+
+def test_open_compressed_writer_zstd():
+    zstandard = pytest.importorskip('zstandard')
+    data = _random_data(100000)
+    out = io.BytesIO()
+    writer = open_compressed_writer(out, 'zstd', workers=2)
+    writer.write(data)
+    writer.close()
+    assert not out.closed
+    dctx = zstandard.ZstdDecompressor()
+    with dctx.stream_reader(io.BytesIO(out.getvalue())) as reader:
+        assert reader.read() == data
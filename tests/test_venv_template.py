@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import subprocess
+import sys
+import threading
+import time
+import logging
+
+import pytest
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler.venv_template import VenvTemplates, clone_venv
+from gcdt_bundler.python_bundler import _create_virtualenv
+from . import write_file
+
+log = logging.getLogger(__name__)
+
+
+def _fake_virtualenv(runtime, venv_dir):
+    # layout of a virtualenv with files and links referring to its path
+    venv_dir = os.path.abspath(venv_dir)
+    site_packages = os.path.join(venv_dir, 'lib', runtime, 'site-packages')
+    write_file(os.path.join(site_packages, 'pip', '__init__.py'), '')
+    write_file(os.path.join(venv_dir, 'bin', 'activate'),
+           'VIRTUAL_ENV="%s"\n' % venv_dir)
+    write_file(os.path.join(venv_dir, 'bin', 'pip'),
+           '#!%s/bin/python\nimport pip\n' % venv_dir, 0o755)
+    write_file(os.path.join(venv_dir, 'pyvenv.cfg'), 'home = /usr/bin\n')
+    os.symlink(sys.executable, os.path.join(venv_dir, 'bin', 'python'))
+    os.symlink('lib', os.path.join(venv_dir, 'lib64'))
+    os.symlink(os.path.join(venv_dir, 'bin'),
+               os.path.join(venv_dir, 'local-bin'))
+
+
+def test_clone_venv(temp_folder):
+    _fake_virtualenv('python3.6', './template')
+    clone_venv('./template', './venv')
+    venv_dir = os.path.abspath('./venv')
+
+    with open('./venv/bin/pip') as f:
+        assert f.read().startswith('#!%s/bin/python\n' % venv_dir)
+    with open('./venv/bin/activate') as f:
+        assert venv_dir in f.read()
+    assert os.access('./venv/bin/pip', os.X_OK)
+    # files without the template path are hardlinked
+    init = 'lib/python3.6/site-packages/pip/__init__.py'
+    assert os.stat('./venv/' + init).st_ino == \
+        os.stat('./template/' + init).st_ino
+    assert os.stat('./venv/pyvenv.cfg').st_ino == \
+        os.stat('./template/pyvenv.cfg').st_ino
+    assert os.stat('./venv/bin/pip').st_ino != \
+        os.stat('./template/bin/pip').st_ino
+    assert os.readlink('./venv/bin/python') == sys.executable
+    assert os.readlink('./venv/lib64') == 'lib'
+    assert os.readlink('./venv/local-bin') == os.path.join(venv_dir, 'bin')
+
+
+def test_venv_templates_create_once(temp_folder):
+    templates = VenvTemplates(temp_folder[0] + '/venvs')
+    created = []
+
+    def _create(runtime, venv_dir):
+        created.append(venv_dir)
+        time.sleep(0.2)
+        _fake_virtualenv(runtime, venv_dir)
+
+    threads = [threading.Thread(target=templates.clone,
+                                args=('python3.6', './venv%d' % i, _create))
+               for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert (templates.hits, templates.misses) == (2, 1)
+    for i in range(3):
+        with open('./venv%d/bin/activate' % i) as f:
+            assert os.path.abspath('./venv%d' % i) in f.read()
+
+
+def test_venv_templates_failed_create(temp_folder):
+    templates = VenvTemplates(temp_folder[0] + '/venvs')
+
+    def _fail(runtime, venv_dir):
+        os.makedirs(venv_dir)
+        raise RuntimeError('virtualenv failed')
+
+    with pytest.raises(RuntimeError):
+        templates.clone('python3.6', './venv', _fail)
+    # nothing incomplete is left behind
+    templates.clone('python3.6', './venv', _fake_virtualenv)
+    assert templates.misses == 2
+
+
+@pytest.mark.slow
+def test_venv_templates_benchmark(temp_folder):
+    runtime = 'python%d.%d' % sys.version_info[:2]
+    templates = VenvTemplates(temp_folder[0] + '/venvs')
+
+    start = time.time()
+    _create_virtualenv(runtime, './created')
+    create_time = time.time() - start
+    templates.template(runtime, _create_virtualenv)
+
+    start = time.time()
+    templates.clone(runtime, './cloned', _create_virtualenv)
+    clone_time = time.time() - start
+
+    log.info('virtualenv: %0.2f s, cloned template: %0.2f s (%0.1fx)',
+             create_time, clone_time, create_time / clone_time)
+    # the cloned venv is usable
+    output = subprocess.check_output(['./cloned/bin/python', '-m', 'pip',
+                                      '--version'])
+    assert os.path.abspath('./cloned') in output.decode('utf-8')
+    assert clone_time < create_time
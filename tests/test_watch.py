@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import binascii
+import io
+import json
+import os
+import sys
+import threading
+import time
+import logging
+from zipfile import ZipFile
+
+import mock
+import pytest
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler.bundler import make_zip_file_bytes, watch_main
+from gcdt_bundler.watch import BundleWatcher, PollingEvents, InotifyEvents
+from gcdt_bundler.pruning import Pruner
+from gcdt_bundler.bytecode import BytecodeCompiler
+from gcdt_bundler.zip_writer import BundleSizeLimitExceeded
+from . import write_file
+
+log = logging.getLogger(__name__)
+
+
+def _read_zip(data):
+    z = ZipFile(io.BytesIO(data))
+    return dict((name, z.read(name)) for name in z.namelist())
+
+
+def test_bundle_watcher_patches_changed_entries(temp_folder):
+    for i in range(10):
+        write_file('./src/file_%d.py' % i, 'content %d' % i)
+    write_file('./src/tests/test_file.py', 'test')
+    folders = [{'source': 'src', 'target': ''}]
+    watcher = BundleWatcher(folders, gcdtignore=['tests/'],
+                            events=PollingEvents())
+
+    assert watcher.refresh()
+    assert watcher.stats['compressed'] == 10
+    assert watcher.bundle == make_zip_file_bytes(folders,
+                                                 gcdtignore=['tests/'])
+    assert not watcher.refresh()
+
+    write_file('./src/file_3.py', 'changed content')
+    os.remove('./src/file_4.py')
+    write_file('./src/new.py', 'new')
+    assert watcher.refresh()
+    assert watcher.stats['compressed'] == 12
+    content = _read_zip(watcher.bundle)
+    assert content['file_3.py'] == b'changed content'
+    assert content['new.py'] == b'new'
+    assert 'file_4.py' not in content
+    assert 'tests/test_file.py' not in content
+
+
+def test_bundle_watcher_prunes_dependencies(temp_folder):
+    write_file('./src/myapp/tests/fixtures.py', 'project')
+    write_file('./deps/werkzeug/tests/test_routing.py', 'dependency')
+    write_file('./deps/werkzeug/__init__.py', 'dependency')
+    watcher = BundleWatcher([{'source': 'src', 'target': ''},
+                             {'source': 'deps', 'target': '',
+                              'dependencies': True}],
+                            pruner=Pruner('python3.6'),
+                            events=PollingEvents())
+    watcher.refresh()
+    assert sorted(_read_zip(watcher.bundle)) == [
+        'myapp/tests/fixtures.py', 'werkzeug/__init__.py']
+
+    assert watcher.pruner.stats['tests'] == [1, len('dependency')]
+
+    deps = os.path.abspath('./deps')
+    write_file('./deps/werkzeug/tests/test_new.py', 'dependency')
+    assert not watcher.refresh([deps + '/werkzeug/tests/test_new.py'])
+    # pruned files are counted once
+    watcher.refresh()
+    assert watcher.pruner.stats['tests'] == [2, 2 * len('dependency')]
+
+
+def test_bundle_watcher_zip_options(temp_folder):
+    # same bundle as make_zip_file with bytecode in deterministic mode
+    write_file('./src/handler.py', 'def handle(event, context):\n    pass\n')
+    write_file('./src/lib/util.py', 'x = 1\n')
+    write_file('./src/lib/data.txt', 'data')
+    folders = [{'source': 'src', 'target': ''}]
+    runtime = 'python%d.%d' % sys.version_info[:2]
+
+    def _compiler():
+        return BytecodeCompiler(runtime, python_exe=sys.executable,
+                                pyc_only=True)
+
+    watcher = BundleWatcher(folders, events=PollingEvents(),
+                            deterministic=True, compiler=_compiler())
+    try:
+        assert watcher.refresh()
+        assert watcher.bundle == make_zip_file_bytes(
+            folders, deterministic=True, compiler=_compiler())
+        assert sorted(_read_zip(watcher.bundle)) == [
+            'handler.pyc', 'lib/data.txt', 'lib/util.pyc']
+
+        write_file('./src/lib/util.py', 'x = 2\n')
+        assert watcher.refresh()
+        assert watcher.stats['compressed'] == 4
+        assert watcher.bundle == make_zip_file_bytes(
+            folders, deterministic=True, compiler=_compiler())
+    finally:
+        watcher.close()
+
+
+def test_bundle_watcher_size_limits(temp_folder):
+    write_file('./src/data.txt', binascii.hexlify(os.urandom(20000)).decode(
+        'ascii'))
+    watcher = BundleWatcher([{'source': 'src', 'target': ''}],
+                            events=PollingEvents(), outfile='bundle.zip',
+                            size_limits={'compressed': 0.01,
+                                         'uncompressed': None})
+    with pytest.raises(BundleSizeLimitExceeded):
+        watcher.refresh()
+    assert not os.path.exists('bundle.zip')
+
+    # reported while watching
+    callback = mock.Mock()
+    watcher.run(callback=callback, should_stop=lambda: True)
+    assert not callback.called
+
+
+def test_bundle_watcher_with_wheels_overlapping(temp_folder):
+    write_file('./src/pkg/module.py', 'project')
+    os.mkdir('./wheels')
+    wheels = ['./wheels/a-1.0-py3-none-any.whl',
+              './wheels/b-1.0-py3-none-any.whl']
+    for wheel_path, content in zip(wheels, [b'a', b'b']):
+        with ZipFile(wheel_path, 'w') as z:
+            z.writestr('google/__init__.py', content)
+            z.writestr('pkg/module.py', content)
+    watcher = BundleWatcher([{'source': 'src', 'target': ''}],
+                            events=PollingEvents(), wheels=wheels)
+
+    assert watcher.refresh()
+    names = ZipFile(io.BytesIO(watcher.bundle)).namelist()
+    assert sorted(names) == ['google/__init__.py', 'pkg/module.py']
+    content = _read_zip(watcher.bundle)
+    assert content['google/__init__.py'] == b'b'
+    assert content['pkg/module.py'] == b'project'
+
+    # the wheel member is bundled once the project file is removed
+    os.remove('./src/pkg/module.py')
+    assert watcher.refresh()
+    assert _read_zip(watcher.bundle)['pkg/module.py'] == b'b'
+
+
+def test_bundle_watcher_changed_paths(temp_folder):
+    write_file('./src/a.py', 'a')
+    write_file('./src/tests/t.py', 't')
+    outfile = temp_folder[0] + '/bundle.zip'
+    watcher = BundleWatcher([{'source': 'src', 'target': 'lib'}],
+                            gcdtignore=['tests/'], outfile=outfile,
+                            artifacts=[{'content': '{}',
+                                        'target': 'settings.conf'}],
+                            events=PollingEvents())
+    watcher.refresh()
+
+    src = os.path.abspath('./src')
+    write_file('./src/b.py', 'b')
+    write_file('./src/tests/t.py', 'changed')
+    assert not watcher.refresh([src + '/tests/t.py'])
+    assert watcher.refresh([src + '/b.py', src + '/tests/t.py'])
+    with open(outfile, 'rb') as f:
+        assert sorted(_read_zip(f.read())) == ['lib/a.py', 'lib/b.py',
+                                               'settings.conf']
+
+    os.remove('./src/a.py')
+    assert watcher.refresh([src + '/a.py'])
+    assert sorted(_read_zip(watcher.bundle)) == ['lib/b.py', 'settings.conf']
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='inotify is linux only')
+def test_bundle_watcher_inotify(temp_folder):
+    write_file('./src/a.py', 'a')
+    updates = []
+    stop = threading.Event()
+    watcher = BundleWatcher([{'source': 'src', 'target': ''}],
+                            events=InotifyEvents())
+    thread = threading.Thread(
+        target=watcher.run,
+        kwargs={'callback': lambda w: updates.append(_read_zip(w.bundle)),
+                'poll_interval': 0.1, 'should_stop': stop.is_set})
+    thread.start()
+    try:
+        for _ in range(50):
+            if updates:
+                break
+            time.sleep(0.1)
+        start = time.time()
+        write_file('./src/a.py', 'changed')
+        for _ in range(50):
+            if len(updates) > 1 and updates[-1]['a.py'] == b'changed':
+                break
+            time.sleep(0.01)
+        log.info('bundle updated after %0.0f ms', (time.time() - start) * 1000)
+        assert updates[-1]['a.py'] == b'changed'
+        assert watcher.stats['compressed'] == 2
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_watch_main(temp_folder):
+    write_file('./handler.py', 'def handle(event, context): pass\n')
+    write_file('./src/lib.py', 'lib')
+    write_file('./src/ignored.log', 'log')
+    write_file('./.gcdtignore', '*.log\n')
+    write_file('./gcdt_dev.json', json.dumps({'ramuda': {
+        'lambda': {'runtime': 'python3.6', 'handlerFile': 'handler.py'},
+        'bundling': {'folders': [{'source': './src', 'target': 'src'}],
+                     'workers': 2},
+        'settings': {'env': 'dev'}
+    }}))
+
+    def _run_once(watcher, callback=None, **kwargs):
+        watcher.refresh()
+        callback(watcher)
+
+    with mock.patch.object(BundleWatcher, 'run', _run_once):
+        assert watch_main(['gcdt_dev.json', '-o', 'out.zip']) == 0
+    with open('out.zip', 'rb') as f:
+        assert sorted(_read_zip(f.read())) == ['handler.py', 'settings.json',
+                                               'src/lib.py']
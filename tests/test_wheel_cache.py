@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import hashlib
+import os
+import threading
+import time
+import logging
+
+import pytest
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler.wheel_cache import WheelCache, WheelDigestMismatchError
+
+log = logging.getLogger(__name__)
+
+CONTENT = b'wheel content' * 100
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+def _download(f):
+    f.write(CONTENT[:100])
+    f.write(CONTENT[100:])
+
+
+def test_wheel_cache_hit_and_miss(temp_folder):
+    cache = WheelCache(temp_folder[0] + '/wheels')
+    assert cache.get('package-1.0.whl') is None
+    path = cache.fetch('package-1.0.whl', _download, sha256=SHA256)
+    assert cache.get('package-1.0.whl') == path
+    with open(path, 'rb') as f:
+        assert f.read() == CONTENT
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_wheel_cache_interrupted_download(temp_folder):
+    cache_dir = temp_folder[0] + '/wheels'
+    cache = WheelCache(cache_dir)
+
+    def _interrupted(f):
+        f.write(CONTENT[:100])
+        raise IOError('connection reset')
+
+    with pytest.raises(IOError):
+        cache.fetch('package-1.0.whl', _interrupted)
+    assert cache.get('package-1.0.whl') is None
+    assert [f for f in os.listdir(cache_dir) if f.endswith('.whl')] == []
+    assert not [f for f in os.listdir(cache_dir) if f.startswith('.tmp-')]
+
+
+def test_wheel_cache_digest_mismatch(temp_folder):
+    cache = WheelCache(temp_folder[0] + '/wheels')
+    with pytest.raises(WheelDigestMismatchError):
+        cache.fetch('package-1.0.whl', _download,
+                    sha256=hashlib.sha256(b'other').hexdigest())
+    assert cache.get('package-1.0.whl') is None
+
+
+def test_wheel_cache_concurrent_fetch(temp_folder):
+    cache = WheelCache(temp_folder[0] + '/wheels')
+    downloads = []
+
+    def _slow_download(f):
+        downloads.append(1)
+        time.sleep(0.1)
+        _download(f)
+
+    threads = [threading.Thread(
+        target=cache.fetch, args=('package-1.0.whl', _slow_download, SHA256))
+        for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(downloads) == 1
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_wheel_cache_fetch_hit_and_miss(temp_folder):
+    cache = WheelCache(temp_folder[0] + '/wheels')
+    path = cache.fetch('package-1.0.whl', _download, sha256=SHA256)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    def _fail(f):
+        raise AssertionError('cached wheel is downloaded again')
+
+    assert cache.fetch('package-1.0.whl', _fail, sha256=SHA256) == path
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_wheel_cache_prune(temp_folder):
+    cache = WheelCache(temp_folder[0] + '/wheels', max_size=None)
+    paths = [cache.fetch('package%d-1.0.whl' % i, _download)
+             for i in range(3)]
+    for i, path in enumerate(paths):
+        os.utime(path, (1000 + i, 1000 + i))
+    cache.get('package0-1.0.whl')  # recently used
+
+    removed = cache.prune(2 * len(CONTENT))
+    assert removed == [paths[1]]
+    assert not os.path.exists(paths[1] + '.lock')
+    assert os.path.exists(paths[0] + '.lock')
+    assert cache.get('package0-1.0.whl') is not None
+    assert cache.get('package2-1.0.whl') is not None
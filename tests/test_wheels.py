@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import stat
+import zipfile
+import logging
+
+import mock
+import pytest
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler.wheels import target_platform, wheel_member_target, \
+    install_wheel, install_wheels, download_wheels, keep_metadata_file, \
+    wheel_entries, supported_tags, wheel_rank, select_wheel
+
+log = logging.getLogger(__name__)
+
+
+def _make_wheel(path, members):
+    with zipfile.ZipFile(path, 'w') as z:
+        for name, content, mode in members:
+            info = zipfile.ZipInfo(name)
+            info.external_attr = mode << 16
+            z.writestr(info, content.encode('utf-8'))
+    return path
+
+
+@pytest.mark.parametrize('runtime, expected', [
+    ('python2.7', ('27', 'cp27mu')),
+    ('python3.6', ('36', 'cp36m')),
+    ('python3.8', ('38', 'cp38')),
+])
+def test_target_platform(runtime, expected):
+    target = target_platform(runtime)
+    assert (target['python_version'], target['abi']) == expected
+    assert target['platform'] == 'manylinux1_x86_64'
+
+
+@pytest.mark.parametrize('filename, compatible', [
+    ('six-1.11.0-py2.py3-none-any.whl', True),
+    ('cffi-1.11.5-cp36-cp36m-manylinux1_x86_64.whl', True),
+    ('cffi-1.11.5-cp36-cp36m-manylinux2014_x86_64.whl', True),
+    ('cffi-1.11.5-cp36-cp36m-manylinux_2_24_x86_64.whl', False),
+    ('cffi-1.11.5-cp37-cp37m-manylinux1_x86_64.whl', False),
+    ('cffi-1.11.5-cp36-cp36m-macosx_10_6_intel.whl', False),
+    ('cryptography-2.3-cp34-abi3-manylinux1_x86_64.whl', True),
+    ('futures-3.2.0-py2-none-any.whl', False),
+    ('pkg-1.0-1-py3-none-any.whl', True),
+])
+def test_wheel_rank(filename, compatible):
+    rank = wheel_rank(filename, supported_tags('python3.6'))
+    assert (rank is not None) == compatible
+
+
+def test_select_wheel():
+    files = [{'filename': name} for name in [
+        'cffi-1.11.5.tar.gz',
+        'cffi-1.11.5-cp36-cp36m-win_amd64.whl',
+        'cffi-1.11.5-py3-none-any.whl',
+        'cffi-1.11.5-cp36-cp36m-manylinux1_x86_64.whl',
+        'cffi-1.11.5-cp27-cp27mu-manylinux1_x86_64.whl',
+    ]]
+    assert select_wheel(files, 'python3.6')['filename'] == \
+        'cffi-1.11.5-cp36-cp36m-manylinux1_x86_64.whl'
+    assert select_wheel(files, 'python2.7')['filename'] == \
+        'cffi-1.11.5-cp27-cp27mu-manylinux1_x86_64.whl'
+    assert select_wheel(files[:2], 'python3.6') is None
+
+
+def test_wheel_member_target():
+    assert wheel_member_target('six.py') == 'six.py'
+    assert wheel_member_target('pkg-1.0.data/purelib/pkg/a.py') == 'pkg/a.py'
+    assert wheel_member_target('pkg-1.0.data/platlib/pkg/_c.so') == \
+        'pkg/_c.so'
+    assert wheel_member_target('pkg-1.0.data/scripts/tool') is None
+    assert wheel_member_target('pkg-1.0.data/headers/pkg.h') is None
+    assert wheel_member_target('../evil.py') is None
+    assert wheel_member_target('/etc/evil.py') is None
+
+
+def test_install_wheel(temp_folder):
+    wheel = _make_wheel('pkg-1.0-py3-none-any.whl', [
+        ('pkg/__init__.py', 'name = "pkg"', 0o644),
+        ('pkg/bin/tool', '#!/bin/sh', 0o755),
+        ('pkg-1.0.data/platlib/pkg/_speedups.so', 'ELF', 0o755),
+        ('pkg-1.0.data/scripts/pkg', '#!python', 0o755),
+        ('pkg-1.0.dist-info/METADATA', 'Name: pkg', 0o644),
+    ])
+    installed = install_wheel(wheel, 'site-packages')
+
+    assert sorted(installed) == [
+        'pkg-1.0.dist-info/METADATA', 'pkg/__init__.py', 'pkg/_speedups.so',
+        'pkg/bin/tool']
+    assert sorted(os.listdir('site-packages')) == ['pkg', 'pkg-1.0.dist-info']
+    assert stat.S_IMODE(os.stat('site-packages/pkg/bin/tool').st_mode) == \
+        0o755
+
+
+def test_download_and_install_wheels(temp_folder):
+    def _pip_download(cmd, **kwargs):
+        dest_dir = cmd[cmd.index('--dest') + 1]
+        for name in ['six', 'werkzeug']:
+            _make_wheel(os.path.join(dest_dir, '%s-1.0-py3-none-any.whl' % name),
+                        [('%s/__init__.py' % name, '', 0o644)])
+        return b''
+
+    with mock.patch('subprocess.check_output',
+                    side_effect=_pip_download) as check_output:
+        wheels = download_wheels('requirements.txt', 'python3.6', 'wheels')
+    cmd = check_output.call_args[0][0]
+    assert cmd[cmd.index('--abi') + 1] == 'cp36m'
+    assert '--only-binary=:all:' in cmd
+    assert [os.path.basename(w) for w in wheels] == [
+        'six-1.0-py3-none-any.whl', 'werkzeug-1.0-py3-none-any.whl']
+
+    assert install_wheels(wheels, 'site-packages') == 2
+    assert sorted(os.listdir('site-packages')) == ['six', 'werkzeug']
+
+
+@pytest.mark.parametrize('dist_info, expected', [
+    ('keep', [True, True, True, True]),
+    ('minimal', [True, True, False, True]),
+    ('strip', [True, False, False, False]),
+])
+def test_keep_metadata_file(dist_info, expected):
+    assert [keep_metadata_file(arcname, dist_info) for arcname in [
+        'pkg/__init__.py',
+        'pkg-1.0.dist-info/METADATA',
+        'pkg-1.0.dist-info/RECORD',
+        'lib/pkg-1.0.egg-info/entry_points.txt',
+    ]] == expected
+
+
+def test_wheel_entries(temp_folder):
+    wheel = _make_wheel('pkg-1.0-py3-none-any.whl', [
+        ('pkg/__init__.py', 'name = "pkg"', 0o644),
+        ('pkg-1.0.data/platlib/pkg/_speedups.so', 'ELF', 0o755),
+        ('pkg-1.0.data/scripts/pkg', '#!python', 0o755),
+        ('pkg-1.0.dist-info/METADATA', 'Name: pkg', 0o644),
+        ('pkg-1.0.dist-info/RECORD', '', 0o644),
+    ])
+    assert [e.arcname for e in wheel_entries(wheel, dist_info='minimal')] == [
+        'pkg/__init__.py', 'pkg/_speedups.so', 'pkg-1.0.dist-info/METADATA']
+    assert [e.arcname for e in wheel_entries(wheel, target='vendored/')][:2] == [
+        'vendored/pkg/__init__.py', 'vendored/pkg/_speedups.so']
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import io
+import json
+import random
+import time
+import logging
+from zipfile import ZipFile
+
+import pytest
+from gcdt_testtools.helpers import temp_folder
+
+from gcdt_bundler.bundler import make_zip_file_bytes
+from gcdt_bundler.zip_cache import ZipEntryCache
+from gcdt_bundler.zip_writer import compress_file, CompressionPolicy
+
+log = logging.getLogger(__name__)
+
+
+def _create_files(folder, count, size=1000):
+    os.makedirs(folder)
+    for i in range(count):
+        with open('%s/file_%d.txt' % (folder, i), 'w') as f:
+            f.write(('content of file %d\n' % i) * (size // 20))
+
+
+def test_entry_cache_reuses_unchanged_files(temp_folder):
+    _create_files('./root', 10)
+    folders_from_file = [{'source': 'root/**', 'target': ''}]
+    cache_dir = temp_folder[0] + '/cache'
+
+    cache = ZipEntryCache(cache_dir)
+    first = make_zip_file_bytes(folders_from_file, entry_cache=cache)
+    assert (cache.hits, cache.misses) == (0, 10)
+
+    # change a single file
+    with open('./root/file_3.txt', 'w') as f:
+        f.write('changed')
+    cache = ZipEntryCache(cache_dir)
+    second = make_zip_file_bytes(folders_from_file, entry_cache=cache)
+    assert (cache.hits, cache.misses) == (9, 1)
+
+    assert first != second
+    assert second == make_zip_file_bytes(folders_from_file)
+    assert ZipFile(io.BytesIO(second)).read('file_3.txt') == b'changed'
+
+
+def test_entry_cache_same_content_different_path(temp_folder):
+    _create_files('./a', 1)
+    _create_files('./b', 1)
+    cache = ZipEntryCache(temp_folder[0] + '/cache')
+
+    entry_a = cache.compress_file('./a/file_0.txt', 'a/file_0.txt')
+    entry_b = cache.compress_file('./b/file_0.txt', 'b/file_0.txt')
+
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert entry_b.arcname == 'b/file_0.txt'
+    assert entry_a.data == entry_b.data
+
+
+def test_entry_cache_eviction(temp_folder):
+    _create_files('./root', 10, size=10000)
+    cache_dir = temp_folder[0] + '/cache'
+    cache = ZipEntryCache(cache_dir, max_size=200)
+    for i in range(10):
+        cache.compress_file('./root/file_%d.txt' % i, 'file_%d.txt' % i)
+    cache.flush()
+
+    cache = ZipEntryCache(cache_dir, max_size=200)
+    for i in range(10):
+        cache.compress_file('./root/file_%d.txt' % i, 'file_%d.txt' % i)
+    assert cache.misses >= 8
+
+
+def test_entry_cache_with_compression_policy(temp_folder):
+    with open('./random.bin', 'wb') as f:
+        f.write(os.urandom(10000))
+    cache_dir = temp_folder[0] + '/cache'
+
+    for _ in range(2):
+        cache = ZipEntryCache(cache_dir)
+        entry = cache.compress_file('./random.bin', 'random.bin',
+                                    policy=CompressionPolicy('fast'))
+        cache.flush()
+        assert entry.compress_type == 0  # stored
+        assert entry.compress_size == 10000
+    assert cache.hits == 1
+
+
+def test_entry_cache_same_content_different_compression(temp_folder):
+    _create_files('./root', 1, size=10000)
+    cache = ZipEntryCache(temp_folder[0] + '/cache')
+    policy = CompressionPolicy('fast')
+
+    deflated = cache.compress_file('./root/file_0.txt', 'file_0.txt',
+                                   policy=policy)
+    stored = cache.compress_file('./root/file_0.txt', 'file_0.zip',
+                                 policy=policy)
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert deflated.compress_type == 8  # deflated
+    assert stored.compress_type == 0  # stored
+    assert stored.compress_size == os.path.getsize('./root/file_0.txt')
+
+
+def test_entry_cache_flush_merges_index(temp_folder):
+    _create_files('./a', 1)
+    _create_files('./b', 1)
+    cache_dir = temp_folder[0] + '/cache'
+    # two concurrent bundling processes
+    cache_a = ZipEntryCache(cache_dir)
+    cache_b = ZipEntryCache(cache_dir)
+    cache_a.compress_file('./a/file_0.txt', 'file_0.txt')
+    cache_b.compress_file('./b/file_0.txt', 'file_0.txt')
+    cache_a.flush()
+    cache_b.flush()
+
+    with open(cache_dir + '/index.json') as f:
+        assert sorted(json.load(f)) == ['./a/file_0.txt', './b/file_0.txt']
+
+
+@pytest.mark.slow
+def test_entry_cache_benchmark(temp_folder):
+    words = ['%08x' % random.getrandbits(32) for _ in range(2000)]
+    os.makedirs('./site-packages')
+    for i in range(5000):
+        with open('./site-packages/module_%d.py' % i, 'w') as f:
+            f.write(' '.join(random.choice(words) for _ in range(500)))
+    folders_from_file = [{'source': 'site-packages', 'target': ''}]
+    cache_dir = temp_folder[0] + '/cache'
+
+    start = time.time()
+    make_zip_file_bytes(folders_from_file)
+    uncached = time.time() - start
+
+    make_zip_file_bytes(folders_from_file, entry_cache=ZipEntryCache(cache_dir))
+    with open('./site-packages/module_42.py', 'w') as f:
+        f.write('changed')
+
+    start = time.time()
+    make_zip_file_bytes(folders_from_file, entry_cache=ZipEntryCache(cache_dir))
+    incremental = time.time() - start
+
+    log.info('full build: %0.2f s, one file changed: %0.2f s', uncached,
+             incremental)
+    assert incremental < uncached
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import io
+import os
+import logging
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED
+
+import pytest
+from gcdt_testtools.helpers import temp_folder, create_tempfile
+
+from gcdt_bundler.zip_writer import ZipWriter, compress_bytes, \
+    compress_file, imap_entries, normalize_arcname, SizeBudget, \
+    BundleSizeLimitExceeded, CompressionPolicy, read_raw_entries
+
+log = logging.getLogger(__name__)
+
+
+def test_normalize_arcname():
+    assert normalize_arcname('/handler.py') == 'handler.py'
+    assert normalize_arcname('./impl/a.py') == 'impl/a.py'
+    assert normalize_arcname('impl//a.py') == 'impl/a.py'
+
+
+def test_zip_writer_entries_readable():
+    buf = io.BytesIO()
+    with ZipWriter(buf) as z:
+        z.add(compress_bytes('a.txt', b'some content for file a'))
+        z.add(compress_bytes('/b/b.txt', b'some content for file b',
+                             external_attr=0o644 << 16))
+        z.add(compress_bytes('empty.txt', b''))
+
+    zfile = ZipFile(io.BytesIO(buf.getvalue()))
+    assert zfile.testzip() is None
+    assert zfile.namelist() == ['a.txt', 'b/b.txt', 'empty.txt']
+    assert zfile.read('a.txt') == b'some content for file a'
+    assert zfile.read('empty.txt') == b''
+    assert zfile.getinfo('b/b.txt').external_attr == 0o644 << 16
+
+
+def test_compress_file(temp_folder):
+    file_a = create_tempfile('some content for my file a' * 100)
+    entry = compress_file(file_a, 'blub/a.txt')
+    assert entry.arcname == 'blub/a.txt'
+    assert entry.file_size == 2600
+    assert entry.compress_size < entry.file_size
+    assert entry.external_attr >> 16 == os.stat(file_a).st_mode
+
+
+def test_imap_entries_keeps_order():
+    tasks = [('file_%d.txt' % i, b'content %d' % i) for i in range(100)]
+    sequential = [e.arcname for e in imap_entries(compress_bytes, tasks)]
+    parallel = [e.arcname for e in
+                imap_entries(compress_bytes, tasks, workers=4, chunksize=3)]
+    assert sequential == parallel == [t[0] for t in tasks]
+
+
+def test_zip_writer_many_entries():
+    # more entries than the classic end of central directory can hold
+    buf = io.BytesIO()
+    with ZipWriter(buf) as z:
+        for i in range(70000):
+            z.add(compress_bytes('f%d' % i, b''))
+
+    zfile = ZipFile(io.BytesIO(buf.getvalue()))
+    assert len(zfile.namelist()) == 70000
+
+
+def test_size_budget_compressed_size_is_exact():
+    budget = SizeBudget()
+    buf = io.BytesIO()
+    with ZipWriter(buf) as z:
+        for i in range(10):
+            entry = compress_bytes('pkg_%d/file.txt' % i, os.urandom(1000))
+            budget.add(entry)
+            z.add(entry)
+
+    assert budget.sizes['compressed'] == len(buf.getvalue())
+    assert budget.sizes['uncompressed'] == 10000
+
+
+def test_size_budget_exceeded():
+    budget = SizeBudget(uncompressed=0.5)
+    budget.add(compress_bytes('small/a.txt', b'a' * 1000))
+    budget.add(compress_bytes('big/a.txt', b'a' * 300000))
+    with pytest.raises(BundleSizeLimitExceeded) as e:
+        budget.add(compress_bytes('big/b.txt', b'b' * 300000))
+
+    assert budget.largest_contributors('uncompressed') == \
+        [('big', 600000), ('small', 1000)]
+    assert 'uncompressed' in str(e.value)
+    assert 'big (0.60 MB)' in str(e.value)
+
+
+def test_compression_policy_choose():
+    policy = CompressionPolicy('fast')
+    text = b'some content for my file a\n' * 100
+    assert policy.choose('a.txt', text) == 1
+    assert policy.choose('a.png', text) is None
+    assert policy.choose('a.so', os.urandom(4096)) is None
+    # too small to sample
+    assert policy.choose('a.so', os.urandom(100)) == 1
+    assert CompressionPolicy('max').choose('a.txt', text) == 9
+
+
+def test_compress_file_with_policy(temp_folder):
+    random_file = temp_folder[0] + '/random.bin'
+    with open(random_file, 'wb') as f:
+        f.write(os.urandom(10000))
+    text_file = create_tempfile('some content for my file a\n' * 100)
+    policy = CompressionPolicy()
+
+    stored = compress_file(random_file, 'random.bin', policy=policy)
+    deflated = compress_file(text_file, 'text.txt', policy=policy)
+
+    assert stored.compress_type == ZIP_STORED
+    assert stored.compress_size == stored.file_size == 10000
+    assert deflated.compress_type == ZIP_DEFLATED
+    assert policy.stats[None][:3] == [1, 10000, 10000]
+    assert policy.stats[6][0] == 1
+
+    buf = io.BytesIO()
+    with ZipWriter(buf) as z:
+        z.add(stored)
+        z.add(deflated)
+    zfile = ZipFile(io.BytesIO(buf.getvalue()))
+    assert zfile.testzip() is None
+    with open(random_file, 'rb') as f:
+        assert zfile.read('random.bin') == f.read()
+
+
+def test_read_raw_entries(temp_folder):
+    wheel = temp_folder[0] + '/pkg-1.0-py3-none-any.whl'
+    with ZipFile(wheel, 'w', ZIP_DEFLATED) as z:
+        z.writestr('pkg/', b'')
+        z.writestr('pkg/__init__.py', b'name = "pkg"\n' * 100)
+        info = ZipInfo('pkg/data.bin', (2018, 6, 1, 12, 0, 0))
+        info.external_attr = 0o100755 << 16
+        z.writestr(info, os.urandom(1000), ZIP_STORED)
+
+    entries = list(read_raw_entries(wheel))
+    assert [e.arcname for e in entries] == ['pkg/__init__.py', 'pkg/data.bin']
+    source = ZipFile(wheel)
+    for entry in entries:
+        info = source.getinfo(entry.arcname)
+        # copied without compressing again
+        assert (entry.compress_type, entry.compress_size, entry.crc) == \
+            (info.compress_type, info.compress_size, info.CRC)
+    assert entries[1].date_time == (2018, 6, 1, 12, 0, 0)
+    assert entries[1].external_attr >> 16 == 0o100755
+
+    buf = io.BytesIO()
+    with ZipWriter(buf) as z:
+        for entry in entries:
+            z.add(entry)
+    zfile = ZipFile(io.BytesIO(buf.getvalue()))
+    assert zfile.testzip() is None
+    for entry in entries:
+        assert zfile.read(entry.arcname) == source.read(entry.arcname)